@@ -1,36 +1,43 @@
 #!/usr/bin/env python
 
 ### can logger using comma panda
+### the usb receive loop only timestamps frames and queues them, a writer thread encodes and flushes to disk
+### a -m selection is pushed into the interface where it has a receive filter (see can_bus.set_filters), only what
+### it cannot drop itself is checked on the writer thread
 
 from __future__ import print_function
 import argparse
 import numpy as np
-import binascii
-import csv
 import sys
 import time
-from panda import Panda
+import can_bus
+import can_filter
+import can_log
 
 def parse_args():
 	arg_parser = argparse.ArgumentParser(description='log can data using comma.ai panda and export to txt')
 	arg_parser.add_argument('-o', '--outputFileArg', required=True, help='txt file output path')
 	arg_parser.add_argument('-t', '--testMode', required=True, help='set to <True> if ack is required')
-	arg_parser.add_argument('-m', '--mask', required=False, help='set to only log / display data from a particular identifier e.g. <0x666>')
+	arg_parser.add_argument('-i', '--interface', required=False, default='panda', help='can interface e.g. <panda>, <socketcan:can0,can1>, <sim:rate=5000,ids=40,buses=3> (see can_bus.py)')
+	arg_parser.add_argument('-m', '--mask', required=False, help='only log these ids e.g. <0x666> <0:0x155,0:0x200-0x2ff,1:0x700/0x7f0,!0x250> (see can_filter.py)')
+	arg_parser.add_argument('-f', '--format', required=False, default='csv', choices=['csv', 'bin', 'seg'], help='log as csv text, fixed width binary records or a directory of compressed segments')
+	arg_parser.add_argument('-c', '--codec', required=False, default=None, choices=can_log.CODECS, help='segment compression, defaults to zstd / lz4 when installed, else gzip')
+	arg_parser.add_argument('-sm', '--segmentMB', required=False, default=256, type=float, help='rotate segments after this many compressed MB')
+	arg_parser.add_argument('-sh', '--segmentHours', required=False, default=1.0, type=float, help='rotate segments after this many hours')
+	arg_parser.add_argument('-q', '--queue', required=False, default=4096, type=int, help='receive batches buffered ahead of the writer thread')
+	arg_parser.add_argument('-st', '--status', required=False, default=1.0, type=float, help='seconds between status line updates, 0 to disable')
 	return arg_parser.parse_args()
 
 def can_logger():
 	args = parse_args()
 
-	if args.mask is not None:
-		argId = int(args.mask, 0)
-
 	try:
-		print("Trying to connect to Panda over USB...")
-		p = Panda()
+		print("Trying to connect to", args.interface, "...")
+		p = can_bus.open_bus(args.interface)
 	except AssertionError:
 		print("USB connection failed.")
 		try:
-			p = Panda("WIFI")
+			p = can_bus.open_bus("panda:WIFI")
 		except:
 			print("WiFi connection timed out. Please make sure your Panda is connected and try again.")
 			sys.exit(0)
@@ -53,42 +60,29 @@ def can_logger():
 
 	try:
 		p.can_clear(0xffff)	
-		outputfile = open(args.outputFileArg, 'wb')
-		csvwriter = csv.writer(outputfile)
-		csvwriter.writerow(['Bus', 'MessageID', 'Message', 'MessageLength', 'UTC Time'])
-		print("Writing csv file to", args.outputFileArg, "Press Ctrl-C to exit...\n")
-		
-		bus0_msg_cnt = 0
-		bus1_msg_cnt = 0
-		bus2_msg_cnt = 0
-
-		while True:
-			can_recv = p.can_recv()
-
-			for address, _, dat, src  in can_recv:
-				if args.mask is None:
-					csvwriter.writerow([str(src), str(hex(address)), "0x" + binascii.hexlify(dat), len(dat), time.time()])
-					print([str(src), str(hex(address)), "0x" + binascii.hexlify(dat), len(dat), time.time()])
+		if args.format == 'seg':
+			logwriter = can_log.open_writer(args.outputFileArg, 'seg', codec=args.codec, max_bytes=int(args.segmentMB * (1 << 20)),
+				max_seconds=args.segmentHours * 3600.0, bus_kbps=(500, 500, 500, 0))
+		else:
+			logwriter = can_log.open_writer(args.outputFileArg, args.format)
+		print("Writing", args.format, "file to", args.outputFileArg, "Press Ctrl-C to exit...\n")
 
-					if src == 0:
-						bus0_msg_cnt += 1
-					elif src == 1:
-						bus1_msg_cnt += 1
-					elif src == 2:
-						bus2_msg_cnt += 1
+		# address filtering happens in the interface where it can, the rest on the writer thread
+		accept = None
+		if args.mask is not None:
+			residual = p.set_filters(can_filter.IdFilter.from_spec(args.mask))
+			print("Filter", args.mask, "checked on the host" if residual is not None else "pushed down to " + args.interface)
+			if residual is not None:
+				accept = residual.accept()
 
-				if args.mask is not None:
-					# address filtering ...
-					if address == argId:
-						csvwriter.writerow([str(src), str(hex(address)), "0x" + binascii.hexlify(dat), len(dat), time.time()])
-						print([str(src), str(hex(address)), "0x" + binascii.hexlify(dat), len(dat), time.time()])
+		ring = can_log.FrameRing(args.queue)
+		writer_thread = can_log.LogWriterThread(logwriter, ring, accept, args.status)
+		writer_thread.start()
 
-						if src == 0:
-							bus0_msg_cnt += 1
-						elif src == 1:
-							bus1_msg_cnt += 1
-						elif src == 2:
-							bus2_msg_cnt += 1
+		while True:
+			can_recv = p.can_recv()
+			if can_recv:
+				ring.push((time.time(), can_recv), len(can_recv))
 
 	except KeyboardInterrupt:
 		if args.testMode == "Bench":
@@ -97,8 +91,10 @@ def can_logger():
 		# turn off output mode
 			p.set_safety_mode(p.SAFETY_NOOUTPUT)
 
-		print("\nNow exiting. Final message Counts... Bus 0: " + str(bus0_msg_cnt) + " Bus 1: " + str(bus1_msg_cnt) + " Bus 2: " + str(bus2_msg_cnt))
-		outputfile.close()
+		writer_thread.stop()
+		counts = writer_thread.counts
+		print("\nNow exiting. Final message Counts... Bus 0: " + str(counts[0]) + " Bus 1: " + str(counts[1]) + " Bus 2: " + str(counts[2]) +
+			" Dropped: " + str(ring.dropped) + " Overflows: " + str(ring.overflows))
 			
 if __name__ == "__main__":
 		can_logger()
\ No newline at end of file
@@ -2,27 +2,43 @@
 
 ### can receive module ###
 
-from pyvit import can
-from pyvit.hw import socketcan
+import can_bus
+import can_filter
 import os
 import time
 import argparse
 
+def parse_args():
+	arg_parser = argparse.ArgumentParser(description='tool to print received can messages')
+	arg_parser.add_argument('-i', '--interface', required=False, default='socketcan:can0', help='can interface e.g. <socketcan:can0>, <sim:rate=100> (see can_bus.py)')
+	arg_parser.add_argument('-m', '--mask', required=False, default=None, help='only print these ids e.g. <0x155,0x200-0x2ff> (see can_filter.py)')
+	return arg_parser.parse_args()
+
 def main():
-	# bring up can interface device
-	os.system("sudo /sbin/ip link set can0 up type can bitrate 1000000")
-	print("if no errors above, can device up at can0")
-	print("can baud rate set to 1000kbps")
+	args = parse_args()
+
+	if args.interface.startswith('socketcan'):
+		# bring up can interface device
+		os.system("sudo /sbin/ip link set can0 up type can bitrate 1000000")
+		print("if no errors above, can device up at can0")
+		print("can baud rate set to 1000kbps")
+
+	dev = can_bus.open_bus(args.interface)
 
-	# associate device with "can0"
-	dev = socketcan.SocketCanDev("can0")
-	dev.start()
+	# the interface drops what it can, the rest is checked here
+	accept = None
+	if args.mask is not None:
+		residual = dev.set_filters(can_filter.IdFilter.from_spec(args.mask))
+		if residual is not None:
+			accept = residual.accept()
 
 	# ready for messages
 	print("ready and waiting for data...")
 
 	while True:
-		print("new message: ", dev.recv())
+		for address, _, dat, bus in dev.recv():
+			if accept is None or accept(bus, address):
+				print("new message: ", bus, hex(address), dat.hex())
 
 if __name__ == "__main__":
 	main()
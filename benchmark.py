@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+
+### benchmarks on the simulated bus, no hardware needed
+###   logger -> PandaLogger receive loop + writer thread fed by a SimBus as fast as it can produce frames
+###   replay -> ReplayScheduler sending a generated log into a SimBus
+###   grapher -> PandaParser grapher over generated logs of doubling size, time per frame should stay flat
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import can_bus
+import can_log
+import can_replay
+
+def bench_logger(args):
+	bus = can_bus.open_bus(args.interface)
+	tmp = tempfile.mkdtemp()
+	path = os.path.join(tmp, 'bench.' + args.format)
+	writer = can_log.open_writer(path, args.format)
+	ring = can_log.FrameRing(args.queue)
+	writer_thread = can_log.LogWriterThread(writer, ring, status_interval=0)
+	writer_thread.start()
+
+	# same receive loop as PandaLogger
+	received = 0
+	start = time.time()
+	while received < args.frames:
+		can_recv = bus.can_recv()
+		if can_recv:
+			ring.push((time.time(), can_recv), len(can_recv))
+			received += len(can_recv)
+	recv_time = time.time() - start
+	writer_thread.stop()
+	total_time = time.time() - start
+
+	written = sum(writer_thread.counts)
+	size = sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(tmp) for f in files)
+	shutil.rmtree(tmp)
+
+	print('logger', args.interface, 'format', args.format)
+	print('received %d frames in %.3f s: %.0f frames/s' % (received, recv_time, received / recv_time))
+	print('written %d frames in %.3f s: %.0f frames/s, %.1f bytes/frame' % (written, total_time, written / total_time, size / float(max(written, 1))))
+	print('dropped:', ring.dropped, 'overflows:', ring.overflows)
+
+def sim_frames(n, rate, ids, buses, seed=0):
+	# log style frame array of n frames at rate frames/s
+	rng = np.random.RandomState(seed)
+	frames = np.zeros(n, dtype=can_log.FRAME_DTYPE)
+	frames['time'] = np.arange(n) / float(rate)
+	frames['id'] = rng.choice(np.arange(0x100, 0x700), size=ids, replace=False)[np.arange(n) % ids]
+	frames['bus'] = np.arange(n) % buses
+	frames['dlc'] = 8
+	frames['data'] = rng.randint(0, 2 ** 63, size=n, dtype=np.int64).astype(np.uint64)
+	return frames
+
+def bench_replay(args):
+	bus = can_bus.open_bus(args.interface)
+	frames = sim_frames(args.frames, args.rate, args.ids, args.buses)
+	scheduler = can_replay.ReplayScheduler(bus, args.speed)
+	batches = (frames[k:k + can_log.DEFAULT_CHUNK] for k in range(0, len(frames), can_log.DEFAULT_CHUNK))
+	print('replay', args.frames, 'frames recorded at', args.rate, 'frames/s, speed', args.speed)
+	can_replay.print_stats(scheduler.run(batches))
+
+def bench_grapher(args):
+	# whole PandaParser runs (read, decode, aggregate, plot without a display), so startup is included
+	tmp = tempfile.mkdtemp()
+	parser = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'PandaParser.py')
+	env = dict(os.environ, MPLBACKEND='Agg')
+	print('grapher, %d ids on %d buses' % (args.ids, args.buses))
+	print('frames      seconds   us/frame')
+	try:
+		for step in range(args.steps):
+			n = args.frames << step
+			frames = sim_frames(n, args.rate, args.ids, args.buses)
+			path = os.path.join(tmp, 'bench_%d.bin' % n)
+			writer = can_log.open_writer(path, 'bin')
+			writer.write_frames(frames)
+			writer.close()
+
+			command = [sys.executable, parser, '-i', path, '-r', 'False', '-g', 'True', '-m', hex(int(frames['id'][0])), '-b', '0']
+			start = time.time()
+			with open(os.devnull, 'w') as devnull:
+				subprocess.check_call(command, stdout=devnull, env=env)
+			elapsed = time.time() - start
+			print('%-11d %-9.3f %.2f' % (n, elapsed, 1e6 * elapsed / n))
+	finally:
+		shutil.rmtree(tmp)
+
+def parse_args():
+	arg_parser = argparse.ArgumentParser(description='can_tools benchmarks on the simulated bus')
+	sub = arg_parser.add_subparsers(dest='bench')
+	sub.required = True
+
+	logger = sub.add_parser('logger', help='receive loop + log writer throughput')
+	logger.add_argument('-i', '--interface', default='sim:rate=2000000,ids=40,buses=3,realtime=0,batch=256', help='bus to read from (see can_bus.py)')
+	logger.add_argument('-n', '--frames', type=int, default=1000000, help='frames to receive')
+	logger.add_argument('-f', '--format', default='bin', choices=['csv', 'bin', 'seg'], help='log format')
+	logger.add_argument('-q', '--queue', type=int, default=4096, help='ring buffer size in recv batches')
+	logger.set_defaults(func=bench_logger)
+
+	replay = sub.add_parser('replay', help='replay scheduler rate and timing error')
+	replay.add_argument('-i', '--interface', default='sim:rate=0', help='bus to send to (see can_bus.py)')
+	replay.add_argument('-n', '--frames', type=int, default=200000, help='frames to replay')
+	replay.add_argument('-r', '--rate', type=float, default=8000.0, help='recorded frame rate (frames/s)')
+	replay.add_argument('-x', '--speed', type=float, default=10.0, help='replay speed multiplier')
+	replay.add_argument('--ids', type=int, default=40, help='distinct ids')
+	replay.add_argument('--buses', type=int, default=3, help='source buses')
+	replay.set_defaults(func=bench_replay)
+
+	grapher = sub.add_parser('grapher', help='PandaParser grapher runtime against log size')
+	grapher.add_argument('-n', '--frames', type=int, default=100000, help='frames in the smallest log')
+	grapher.add_argument('-s', '--steps', type=int, default=4, help='logs, each twice the size of the last')
+	grapher.add_argument('-r', '--rate', type=float, default=8000.0, help='recorded frame rate (frames/s)')
+	grapher.add_argument('--ids', type=int, default=40, help='distinct ids')
+	grapher.add_argument('--buses', type=int, default=3, help='source buses')
+	grapher.set_defaults(func=bench_grapher)
+	return arg_parser.parse_args()
+
+def main():
+	args = parse_args()
+	args.func(args)
+
+if __name__ == "__main__":
+	main()
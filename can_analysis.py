@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+
+### bit level change / entropy analysis
+### for every (bus, id) of a log: per bit flip counts and entropy, constant bits, likely counter and checksum
+### bytes and candidate signal boundaries in both byte orders. payloads are unpacked to bits a whole batch at a
+### time and accumulated per id, so a log is read once whatever its size
+### bits are numbered byte * 8 + bit (bit 0 = lsb of byte 0), the same numbering as dbc start bits
+
+import argparse
+import numpy as np
+import can_decode
+import can_filter
+import can_log
+
+NUM_BITS = 64
+
+# flip rate of a counter's lsb, and the band the bits of a checksum byte flip in
+COUNTER_LSB_RATE = 0.9
+CHECKSUM_RATE = (0.4, 0.6)
+# a bit flipping this much more often than the one below it starts a new signal, once the run has decayed
+# to below BOUNDARY_DECAY of its busiest bit (the lowest bits of a slow signal flip less than the next ones)
+BOUNDARY_JUMP = 1.5
+BOUNDARY_DECAY = 0.5
+
+def unpack_bits(frames):
+	# (n, 64) uint8, column byte * 8 + bit
+	return np.unpackbits(can_log.payload_bytes(frames), axis=1, bitorder='little')
+
+class BitStats():
+	def __init__(self, bus, ident):
+		self.bus = bus
+		self.ident = ident
+		self.count = 0
+		self.dlc = 0
+		self.ones = np.zeros(NUM_BITS, dtype=np.int64)
+		self.flips = np.zeros(NUM_BITS, dtype=np.int64)
+		self.last = None
+
+	@property
+	def bits(self):
+		return self.dlc * 8
+
+	def p_one(self):
+		return self.ones / float(max(self.count, 1))
+
+	def flip_rate(self):
+		return self.flips / float(max(self.count - 1, 1))
+
+	def entropy(self):
+		p = self.p_one()
+		with np.errstate(divide='ignore', invalid='ignore'):
+			h = -(p * np.log2(p) + (1 - p) * np.log2(1 - p))
+		return np.nan_to_num(h)
+
+	def constant(self):
+		used = np.arange(NUM_BITS) < self.bits
+		return used & ((self.ones == 0) | (self.ones == self.count))
+
+	def counters(self):
+		# [(start, length)] runs inside a byte from its lsb up whose flip rate halves bit by bit
+		rate = self.flip_rate()
+		found = []
+		for byte in range(self.dlc):
+			for lsb in range(8):
+				pos = byte * 8 + lsb
+				if rate[pos] < COUNTER_LSB_RATE or (lsb and rate[pos - 1] >= COUNTER_LSB_RATE):
+					continue
+				length = 1
+				while lsb + length < 8 and abs(rate[pos + length] - rate[pos] / 2 ** length) < 0.1 / 2 ** length:
+					length += 1
+				if length >= 2:
+					found.append((pos, length))
+		return found
+
+	def checksum_bytes(self):
+		# bytes whose every bit looks random: flips about half the time and about equally often 0 / 1
+		rate = self.flip_rate().reshape(8, 8)
+		h = self.entropy().reshape(8, 8)
+		lo, hi = CHECKSUM_RATE
+		return [byte for byte in range(self.dlc) if ((rate[byte] > lo) & (rate[byte] < hi)).all() and (h[byte] > 0.95).all()]
+
+	def boundaries(self, little_endian):
+		# [(start, length)] candidate signals in one byte order. walking from lsb to msb a signal's bits flip
+		# less and less often, so a constant bit or a jump back up in flip rate after that starts the next one
+		rate = self.flip_rate()
+		const = self.constant()
+		if little_endian:
+			order = list(range(self.bits))
+		else:
+			# motorola: lsb of the payload word is bit 0 of the last byte, msb bit 7 of byte 0
+			order = [(7 - p // 8) * 8 + p % 8 for p in range(NUM_BITS) if 7 - p // 8 < self.dlc]
+
+		found = []
+		run = []
+		for bit in order + [None]:
+			jump = False
+			if run and bit is not None:
+				last = rate[run[-1]]
+				jump = rate[bit] > last * BOUNDARY_JUMP + 1e-3 and last < BOUNDARY_DECAY * rate[run].max()
+			if bit is None or const[bit] or jump:
+				if len(run) >= 2:
+					shift = order.index(run[0]) if little_endian else order.index(run[0]) + (8 - self.dlc) * 8
+					found.append((can_decode.dbc_start(shift, len(run), little_endian), len(run)))
+				run = [] if bit is None or const[bit] else [bit]
+			else:
+				run.append(bit)
+		return found
+
+class BitAnalysis():
+	def __init__(self, id_filter=None):
+		self.id_filter = id_filter
+		self.stats = {}
+
+	def add(self, frames):
+		if self.id_filter is not None:
+			frames = frames[self.id_filter.mask(frames['bus'], frames['id'])]
+		if len(frames) == 0:
+			return
+		keys = (frames['bus'].astype(np.uint64) << np.uint64(32)) | frames['id']
+		order = np.argsort(keys, kind='stable')
+		uniq, starts = np.unique(keys[order], return_index=True)
+		ends = np.append(starts[1:], len(order))
+
+		bits = unpack_bits(frames[order])
+		ones = np.add.reduceat(bits.astype(np.int32), starts, axis=0)
+		flips = (bits[1:] != bits[:-1]).astype(np.int32)
+		flips[starts[1:] - 1] = 0 # no flips across two ids
+		flips = np.add.reduceat(np.vstack([flips, np.zeros((1, NUM_BITS), dtype=np.int32)]), starts, axis=0)
+		dlcs = np.maximum.reduceat(frames['dlc'][order], starts)
+
+		for k, (key, start, end) in enumerate(zip(uniq.tolist(), starts.tolist(), ends.tolist())):
+			stats = self.stats.get(key)
+			if stats is None:
+				stats = self.stats[key] = BitStats(key >> 32, key & 0xffffffff)
+			elif stats.last is not None:
+				stats.flips += stats.last != bits[start]
+			stats.count += end - start
+			stats.ones += ones[k]
+			stats.flips += flips[k]
+			stats.dlc = max(stats.dlc, min(int(dlcs[k]), 8))
+			stats.last = bits[end - 1].copy()
+
+	def results(self):
+		return [self.stats[key] for key in sorted(self.stats)]
+
+def analyse(path, spec=None, chunk_size=can_log.DEFAULT_CHUNK):
+	analysis = BitAnalysis(can_filter.IdFilter.from_spec(spec) if spec else None)
+	for frames in can_log.iter_frames(path, chunk_size):
+		analysis.add(frames)
+	return analysis.results()
+
+### report ###
+def bit_map(stats):
+	# one character per bit, byte 0 first and bit 7 .. 0 within a byte like the hex payload:
+	# '-' unused, '.' constant, 0..9 flip rate in tenths (9 = flips on almost every frame)
+	rate = stats.flip_rate()
+	const = stats.constant()
+	chars = []
+	for byte in range(8):
+		for bit in range(7, -1, -1):
+			pos = byte * 8 + bit
+			if pos >= stats.bits:
+				chars.append('-')
+			elif const[pos]:
+				chars.append('.')
+			else:
+				chars.append(str(min(int(rate[pos] * 10), 9)))
+		chars.append(' ')
+	return ''.join(chars).rstrip()
+
+def print_report(results, boundaries=True):
+	for stats in results:
+		print('bus %d id %s  frames: %d  dlc: %d  constant bits: %d' % (stats.bus, hex(stats.ident), stats.count, stats.dlc,
+			np.count_nonzero(stats.constant())))
+		print('  bits     %s' % bit_map(stats))
+		for start, length in stats.counters():
+			print('  counter  {start: %d, length: %d}' % (start, length))
+		random = stats.checksum_bytes()
+		if random:
+			print('  random   bytes %s (checksum or noise)' % ' '.join(str(byte) for byte in random))
+		if boundaries:
+			print('  intel    %s' % ' '.join('%d|%d' % b for b in stats.boundaries(True)))
+			print('  motorola %s' % ' '.join('%d|%d' % b for b in stats.boundaries(False)))
+
+def heatmap(results, path=None):
+	# flip rate of every bit (columns, byte 0 bit 7 first) of every id (rows), constant / unused bits blank
+	import matplotlib.pyplot as plt
+
+	order = [byte * 8 + bit for byte in range(8) for bit in range(7, -1, -1)]
+	grid = np.full((len(results), NUM_BITS), np.nan)
+	for row, stats in enumerate(results):
+		rate = np.where(stats.constant() | (np.arange(NUM_BITS) >= stats.bits), np.nan, stats.flip_rate())
+		grid[row] = rate[order]
+
+	fig, ax = plt.subplots(1, 1, figsize=(12, max(3, 0.25 * len(results))))
+	image = ax.imshow(grid, aspect='auto', interpolation='nearest', cmap='viridis', vmin=0, vmax=1)
+	ax.set_yticks(range(len(results)))
+	ax.set_yticklabels(['%d:%s' % (s.bus, hex(s.ident)) for s in results])
+	ax.set_xticks(range(0, NUM_BITS, 8))
+	ax.set_xticklabels(['byte %d' % byte for byte in range(8)])
+	ax.set_title('bit flip rate')
+	fig.colorbar(image, ax=ax)
+	if path:
+		fig.savefig(path, bbox_inches='tight')
+	else:
+		plt.show()
+
+def parse_args():
+	arg_parser = argparse.ArgumentParser(description='bit flip / entropy analysis of every id in a PandaLogger log')
+	arg_parser.add_argument('-i', '--input', required=True, help='csv or binary log, or directory of segments')
+	arg_parser.add_argument('-S', '--select', required=False, default=None, help='ids to analyse e.g. <0:0x100-0x3ff> (see can_filter.py)')
+	arg_parser.add_argument('-g', '--heatmap', required=False, default=None, help='show a flip rate heatmap, <show> or an image path')
+	arg_parser.add_argument('-c', '--chunk', required=False, default=can_log.DEFAULT_CHUNK, type=int, help='number of frames read from the log per batch')
+	return arg_parser.parse_args()
+
+def main():
+	args = parse_args()
+	results = analyse(args.input, args.select, args.chunk)
+	print_report(results)
+	if args.heatmap:
+		heatmap(results, None if args.heatmap == 'show' else args.heatmap)
+
+if __name__ == "__main__":
+	main()
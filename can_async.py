@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+
+### asyncio front end for can_bus backends
+### an AsyncBus reads its bus in a thread of its own (every backend's recv() blocks or polls) and hands each batch
+### to the subscriptions whose ids / buses it matches, through bounded queues: a consumer that falls behind makes the
+### reader wait, so frames pile up in the kernel / device buffer instead of in memory. sending is a plain call that
+### works while the reader is waiting, request() sends and awaits the first answer from a set of ids with a timeout,
+### and AsyncIsoTp runs can_isotp sessions on top, so several buses, queries and consumers share one event loop
+###   async with AsyncBus(can_bus.open_bus('socketcan:can0')) as can0:
+###       async for address, _, data, bus in can0.subscribe(ids=[0x7e8]):
+
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import time
+import can_bus
+import can_isotp
+import vinQuery
+
+QUEUE_SIZE = 64 # batches per subscription before the reader waits
+IDLE = 0.001 # seconds between polls of backends whose recv() returns at once when nothing came in
+
+class Subscription():
+	# frames of some ids (None = all) on some bus numbers (None = all), iterate it or await get() / batch()
+	def __init__(self, abus, ids=None, buses=None, maxsize=QUEUE_SIZE):
+		self.abus = abus
+		self.ids = None if ids is None else frozenset(ids)
+		self.buses = None if buses is None else frozenset(buses)
+		self.queue = asyncio.Queue(maxsize)
+		self.pending = collections.deque()
+
+	def select(self, frames):
+		if self.ids is None and self.buses is None:
+			return frames
+		ids, buses = self.ids, self.buses
+		return [f for f in frames if (ids is None or f[0] in ids) and (buses is None or f[3] in buses)]
+
+	async def batch(self):
+		# the next list of frames, whatever arrived together
+		if self.pending:
+			frames = list(self.pending)
+			self.pending.clear()
+			return frames
+		return await self.queue.get()
+
+	async def get(self):
+		while not self.pending:
+			self.pending.extend(await self.queue.get())
+		return self.pending.popleft()
+
+	def __aiter__(self):
+		return self
+
+	async def __anext__(self):
+		return await self.get()
+
+	def close(self):
+		self.abus.unsubscribe(self)
+
+	async def __aenter__(self):
+		return self
+
+	async def __aexit__(self, *exc):
+		self.close()
+
+class AsyncBus():
+	def __init__(self, bus, name=None, idle=IDLE):
+		self.bus = bus
+		self.name = name
+		self.idle = idle
+		self.subscriptions = []
+		self.executor = concurrent.futures.ThreadPoolExecutor(1)
+		self.reader = None
+		self.frames = 0
+
+	def subscribe(self, ids=None, buses=None, maxsize=QUEUE_SIZE):
+		sub = Subscription(self, ids, buses, maxsize)
+		self.subscriptions.append(sub)
+		if self.reader is None:
+			self.reader = asyncio.get_running_loop().create_task(self._read())
+		return sub
+
+	def unsubscribe(self, sub):
+		if sub in self.subscriptions:
+			self.subscriptions.remove(sub)
+		# a reader waiting on the full queue of a closed subscription would wait forever
+		while not sub.queue.empty():
+			sub.queue.get_nowait()
+
+	async def _read(self):
+		loop = asyncio.get_running_loop()
+		while True:
+			frames = await loop.run_in_executor(self.executor, self.bus.recv)
+			if not frames:
+				await asyncio.sleep(self.idle)
+				continue
+			self.frames += len(frames)
+			for sub in list(self.subscriptions):
+				selected = sub.select(frames)
+				if selected:
+					await sub.queue.put(selected)
+
+	def send(self, address, data, bus=0):
+		self.bus.send(address, data, bus)
+
+	async def request(self, address, data, response_ids, bus=0, timeout=1.0):
+		# send one frame and return the first frame from response_ids, asyncio.TimeoutError without one in time
+		async with self.subscribe(response_ids, [bus]) as sub:
+			self.send(address, data, bus)
+			return await asyncio.wait_for(sub.get(), timeout)
+
+	async def close(self):
+		if self.reader is not None:
+			self.reader.cancel()
+			try:
+				await self.reader
+			except asyncio.CancelledError:
+				pass
+		# let the last recv() return before the bus goes away under it
+		self.executor.shutdown(wait=True)
+		self.bus.close()
+
+	async def __aenter__(self):
+		return self
+
+	async def __aexit__(self, *exc):
+		await self.close()
+
+### iso-tp ###
+class AsyncIsoTp():
+	# can_isotp sessions fed from a subscription of an AsyncBus, await request() / receive() per session
+	def __init__(self, abus, timeout=can_isotp.TIMEOUT, tick=0.001):
+		self.stack = can_isotp.IsoTpStack(abus.bus, timeout)
+		self.sub = abus.subscribe()
+		self.tick = tick
+		self.waiters = {} # session -> (future of its next message, errors it had when the wait started)
+		self.pump = asyncio.get_running_loop().create_task(self._pump())
+
+	async def _pump(self):
+		while True:
+			try:
+				frames = await asyncio.wait_for(self.sub.batch(), self.tick)
+			except asyncio.TimeoutError:
+				frames = None
+			if frames:
+				self.stack.feed(frames)
+			# consecutive frames waiting for stmin and timeouts need polling without traffic too
+			self.stack.poll()
+			for session, (future, seen) in list(self.waiters.items()):
+				if session.messages or (len(session.errors) > seen and not session.receiving):
+					del self.waiters[session]
+					if not future.done():
+						future.set_result(session.messages.popleft() if session.messages else None)
+
+	async def receive(self, session, timeout=can_isotp.TIMEOUT):
+		# the session's next message, None on an iso-tp error or timeout
+		if session.messages:
+			return session.messages.popleft()
+		# only transfers failing from here on end the wait, errors of earlier ones stay in the list for reporting
+		future = asyncio.get_running_loop().create_future()
+		self.waiters[session] = (future, len(session.errors))
+		try:
+			return await asyncio.wait_for(future, timeout)
+		except asyncio.TimeoutError:
+			return None
+		finally:
+			self.waiters.pop(session, None)
+
+	async def request(self, session, payload, timeout=can_isotp.TIMEOUT):
+		self.stack.send(session, payload)
+		return await self.receive(session, timeout)
+
+	async def collect(self, timeout=can_isotp.TIMEOUT):
+		# {session: [payloads]} of every message completed until the deadline
+		await asyncio.sleep(timeout)
+		got = {}
+		for session in self.stack.sessions.values():
+			while session.messages:
+				got.setdefault(session, []).append(session.messages.popleft())
+		return got
+
+	async def close(self):
+		self.pump.cancel()
+		try:
+			await self.pump
+		except asyncio.CancelledError:
+			pass
+		self.sub.close()
+
+async def query_vins(abus, timeout=1.0, bus=0):
+	# vinQuery.query_vins without blocking the loop: {responder id: vin}
+	isotp = AsyncIsoTp(abus)
+	try:
+		isotp.stack.accept(vinQuery.obd_request_id)
+		isotp.stack.send_functional(vinQuery.FUNCTIONAL_11_BIT, vinQuery.VIN_REQUEST, bus)
+		isotp.stack.send_functional(vinQuery.FUNCTIONAL_29_BIT, vinQuery.VIN_REQUEST, bus)
+		vins = {}
+		for session, payloads in (await isotp.collect(timeout)).items():
+			for payload in payloads:
+				vin = vinQuery.decode_vin(payload)
+				if vin is not None:
+					vins[session.rx_id] = vin
+		return vins
+	finally:
+		await isotp.close()
+
+### monitor ###
+async def _print_frames(abus, ids, verbose):
+	async with abus.subscribe(ids) as sub:
+		while True:
+			for address, _, data, bus in await sub.batch():
+				if verbose:
+					print(abus.name, bus, hex(address), data.hex())
+
+async def _report(buses, period):
+	last = dict((abus.name, 0) for abus in buses)
+	while True:
+		await asyncio.sleep(period)
+		print(', '.join('%s %.0f fps' % (abus.name, (abus.frames - last[abus.name]) / period) for abus in buses))
+		last = dict((abus.name, abus.frames) for abus in buses)
+
+async def monitor(specs, ids=None, seconds=None, query=False, verbose=True, period=1.0):
+	buses = [AsyncBus(can_bus.open_bus(spec), spec) for spec in specs]
+	tasks = [asyncio.ensure_future(_print_frames(abus, ids, verbose)) for abus in buses]
+	tasks.append(asyncio.ensure_future(_report(buses, period)))
+	start = time.monotonic()
+	try:
+		if query:
+			for abus in buses:
+				vins = await query_vins(abus)
+				print(abus.name, 'vins:', dict((hex(rx_id), vin) for rx_id, vin in vins.items()) or 'no answer')
+		await asyncio.sleep(max(seconds - (time.monotonic() - start), 0) if seconds is not None else float('inf'))
+	finally:
+		for task in tasks:
+			task.cancel()
+		await asyncio.gather(*tasks, return_exceptions=True)
+		for abus in buses:
+			await abus.close()
+
+def parse_args():
+	arg_parser = argparse.ArgumentParser(description='print frames of several can interfaces from one event loop')
+	arg_parser.add_argument('-i', '--interfaces', required=False, nargs='+', default=['socketcan:can0'], help='bus specs e.g. <socketcan:can0 socketcan:can1> <sim:rate=100> (see can_bus.py)')
+	arg_parser.add_argument('-m', '--messages', required=False, nargs='*', default=None, help='ids to print, all by default e.g. <0x7e8 0x155>')
+	arg_parser.add_argument('-s', '--seconds', required=False, default=None, type=float, help='stop after this long, runs until ctrl-c by default')
+	arg_parser.add_argument('-q', '--query', required=False, action='store_true', help='ask every interface for the vins of its ecus while printing')
+	arg_parser.add_argument('--quiet', required=False, action='store_true', help='frame rates only')
+	return arg_parser.parse_args()
+
+def main():
+	args = parse_args()
+	ids = None if args.messages is None else [int(ident, 0) for ident in args.messages]
+	try:
+		asyncio.run(monitor(args.interfaces, ids, args.seconds, args.query, not args.quiet))
+	except KeyboardInterrupt:
+		print(' ...exiting...')
+
+if __name__ == "__main__":
+	main()
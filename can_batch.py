@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+
+### batch processing of many PandaLogger logs
+### every log found under the given globs / directories is read once for per id statistics, checksum validation and
+### decoded signal summaries (plus, with -e, a table of its decoded signals, see can_resample.py). files are spread
+### over a process pool, binary logs bigger than --split frames are cut into row ranges processed on their own and
+### merged back. each file's result is cached by path, size, mtime and definitions, so a re-run only reads new or
+### changed logs, and all results are merged into one dataset of structured arrays:
+###   ids        file, bus, id, count, first / last time, dlc histogram
+###   checksums  file, bus, id, checked, failed
+###   signals    file, signal, count, min, max, mean, first / last time
+
+import argparse
+import collections
+import glob
+import hashlib
+import multiprocessing
+import os
+import numpy as np
+import can_checksum
+import can_decode
+import can_index
+import can_log
+import can_resample
+
+DEFAULT_SPLIT = 4000000
+CACHE_VERSION = 1
+MAX_DLC = 8
+
+ID_DTYPE = np.dtype([('file', '<i4'), ('bus', 'u1'), ('id', '<u4'), ('count', '<i8'), ('first_time', '<f8'),
+	('last_time', '<f8'), ('dlc_hist', '<i8', (MAX_DLC + 1,))])
+CHECKSUM_DTYPE = np.dtype([('file', '<i4'), ('bus', 'u1'), ('id', '<u4'), ('checked', '<i8'), ('failed', '<i8')])
+SIGNAL_DTYPE = np.dtype([('file', '<i4'), ('signal', 'U64'), ('count', '<i8'), ('min', '<f8'), ('max', '<f8'),
+	('mean', '<f8'), ('first_time', '<f8'), ('last_time', '<f8')])
+TABLES = collections.OrderedDict([('ids', ID_DTYPE), ('checksums', CHECKSUM_DTYPE), ('signals', SIGNAL_DTYPE)])
+
+### finding logs ###
+def _is_log(path):
+	if can_log.is_segment_dir(path):
+		return any(f.endswith(can_log.SEG_SUFFIX) for f in os.listdir(path))
+	return path.endswith('.csv') or path.endswith('.bin')
+
+def find_logs(patterns):
+	# sorted paths of every log and segment directory matching the globs. a file matched directly is taken whatever its
+	# name (PandaLogger writes whatever -o says), can_log.is_binary tells binary logs from csv text when it is read.
+	# directories are searched for .csv / .bin files and segment directories, anything else found is reported
+	found = set()
+	for pattern in patterns:
+		matches = glob.glob(pattern)
+		if not matches:
+			print('skipped', pattern, '(no match)')
+		for path in matches:
+			if os.path.isfile(path):
+				found.add(os.path.abspath(path))
+			elif _is_log(path):
+				found.add(os.path.abspath(path))
+			elif os.path.isdir(path):
+				for root, dirs, files in os.walk(path):
+					for name in list(dirs):
+						if _is_log(os.path.join(root, name)):
+							found.add(os.path.abspath(os.path.join(root, name)))
+							dirs.remove(name) # its segments are read as one log
+					for name in files:
+						if _is_log(os.path.join(root, name)):
+							found.add(os.path.abspath(os.path.join(root, name)))
+						elif not name.endswith(can_index.INDEX_SUFFIX):
+							print('skipped', os.path.join(root, name), '(not a .csv / .bin log)')
+			else:
+				print('skipped', path, '(not a file or directory)')
+	return sorted(found)
+
+### results cache ###
+def fingerprint(definitions, checksum_definitions, export):
+	return hashlib.sha1(repr((CACHE_VERSION, definitions, checksum_definitions, export)).encode()).hexdigest()
+
+def cache_key(path, fp):
+	if can_log.is_segment_dir(path):
+		stats = [os.stat(seg.path) for seg in can_log.list_segments(path)]
+		stamp = (sum(st.st_size for st in stats), max([st.st_mtime_ns for st in stats] + [0]))
+	else:
+		st = os.stat(path)
+		stamp = (st.st_size, st.st_mtime_ns)
+	return hashlib.sha1(repr((path, stamp, fp)).encode()).hexdigest()
+
+def load_cached(cache_dir, key):
+	path = os.path.join(cache_dir, key + '.npz')
+	if not os.path.exists(path):
+		return None
+	try:
+		with np.load(path) as z:
+			return dict((name, z[name]) for name in TABLES)
+	except (ValueError, KeyError, IOError):
+		return None
+
+def save_cached(cache_dir, key, tables):
+	with open(os.path.join(cache_dir, key + '.npz'), 'wb') as f:
+		np.savez(f, **tables)
+
+### per job work ###
+_shared = {}
+
+def _init(definitions, checksum_definitions, export):
+	_shared['definitions'] = definitions
+	_shared['checksum_definitions'] = checksum_definitions
+	_shared['export'] = export
+
+def split_jobs(path, split):
+	# (path, first row, end row) ranges, the whole file (None, None) unless it is a binary log longer than split
+	if split and not can_log.is_segment_dir(path) and can_log.is_binary(path):
+		n = can_log.count_frames(path)
+		if n > split:
+			return [(path, start, min(start + split, n)) for start in range(0, n, split)]
+	return [(path, None, None)]
+
+def _batches(path, start, end, chunk_size=can_log.DEFAULT_CHUNK):
+	if start is None:
+		return can_log.iter_frames(path, chunk_size)
+	frames = can_log.open_bin(path)
+	return (frames[k:min(k + chunk_size, end)] for k in range(start, end, chunk_size))
+
+def process_job(job):
+	# partial result of one job: {key: [count, first, last, dlc hist]}, checksum counters,
+	# {signal: [count, sum, min, max, first time, last time]} and, when exporting, decoded samples per signal
+	path, start, end = job
+	ids = {}
+	checker = can_checksum.BatchChecker(_shared['checksum_definitions'], keep_failures=False)
+	decoder = can_decode.BatchDecoder(_shared['definitions'])
+
+	for frames in _batches(path, start, end):
+		keys = (frames['bus'].astype(np.int64) << 32) | frames['id']
+		uniq, slot = np.unique(keys, return_inverse=True)
+		counts = np.bincount(slot, minlength=len(uniq))
+		hist = np.bincount(slot * (MAX_DLC + 1) + np.minimum(frames['dlc'], MAX_DLC), minlength=len(uniq) * (MAX_DLC + 1))
+		hist = hist.reshape(-1, MAX_DLC + 1)
+		times = frames['time']
+		first = np.full(len(uniq), np.inf)
+		last = np.full(len(uniq), -np.inf)
+		np.minimum.at(first, slot, times)
+		np.maximum.at(last, slot, times)
+		for k, key in enumerate(uniq.tolist()):
+			if key in ids:
+				entry = ids[key]
+				entry[0] += counts[k]
+				entry[1] = min(entry[1], first[k])
+				entry[2] = max(entry[2], last[k])
+				entry[3] += hist[k]
+			else:
+				ids[key] = [int(counts[k]), first[k], last[k], hist[k].copy()]
+		checker.add(frames)
+		decoder.add(frames)
+
+	# summaries are all the parent needs of a signal, the samples themselves only travel back when exporting
+	stats = {}
+	samples = {}
+	for sig in decoder.signals:
+		times, values = decoder.timeseries(sig.name)
+		if len(times):
+			stats[sig.name] = [len(values), float(np.sum(values, dtype=np.float64)), float(values.min()), float(values.max()),
+				float(times.min()), float(times.max())]
+		else:
+			stats[sig.name] = [0, 0.0, np.inf, -np.inf, np.inf, -np.inf]
+		if _shared['export']:
+			samples[sig.name] = (times, values)
+	return path, start, ids, (checker.checked, checker.failed), stats, samples
+
+def merge_partials(partials):
+	# one file's jobs, in row order, into its tables and its decoded samples (empty unless exporting)
+	partials = sorted(partials, key=lambda p: p[1] or 0)
+	ids = {}
+	checked = collections.Counter()
+	failed = collections.Counter()
+	stats = collections.OrderedDict()
+	samples = collections.OrderedDict()
+	for _, _, part_ids, (part_checked, part_failed), part_stats, part_samples in partials:
+		for key, (count, first, last, hist) in part_ids.items():
+			if key in ids:
+				entry = ids[key]
+				ids[key] = [entry[0] + count, min(entry[1], first), max(entry[2], last), entry[3] + hist]
+			else:
+				ids[key] = [count, first, last, hist]
+		checked.update(part_checked)
+		failed.update(part_failed)
+		for name, (count, total, low, high, first, last) in part_stats.items():
+			if name in stats:
+				entry = stats[name]
+				stats[name] = [entry[0] + count, entry[1] + total, min(entry[2], low), max(entry[3], high), min(entry[4], first), max(entry[5], last)]
+			else:
+				stats[name] = [count, total, low, high, first, last]
+		for name, (times, values) in part_samples.items():
+			samples.setdefault(name, []).append((times, values))
+	samples = collections.OrderedDict((name, (np.concatenate([p[0] for p in parts]), np.concatenate([p[1] for p in parts])))
+		for name, parts in samples.items())
+
+	id_table = np.zeros(len(ids), dtype=ID_DTYPE)
+	for row, key in enumerate(sorted(ids)):
+		count, first, last, hist = ids[key]
+		id_table[row] = (0, key >> 32, key & 0xffffffff, count, first, last, hist)
+
+	checksum_table = np.zeros(len(checked), dtype=CHECKSUM_DTYPE)
+	for row, key in enumerate(sorted(checked)):
+		checksum_table[row] = (0, key >> 32, key & 0xffffffff, checked[key], failed[key])
+
+	present = [(name, entry) for name, entry in stats.items() if entry[0]]
+	signal_table = np.zeros(len(present), dtype=SIGNAL_DTYPE)
+	for row, (name, (count, total, low, high, first, last)) in enumerate(present):
+		signal_table[row] = (0, name, count, low, high, total / count, first, last)
+
+	tables = {'ids': id_table, 'checksums': checksum_table, 'signals': signal_table}
+	return tables, samples
+
+def export_name(path, key):
+	# logs of different vehicles often share a file name, the cache key keeps them apart
+	return '%s_%s.npz' % (os.path.basename(path.rstrip(os.sep)), key[:8])
+
+def export_samples(export_dir, path, key, samples):
+	# decoded signals of one log on the union of their sample times (see can_resample.py)
+	all_series = [can_resample.series(name, times, values) for name, (times, values) in samples.items() if len(times)]
+	can_resample.save_table(os.path.join(export_dir, export_name(path, key)), can_resample.resample(all_series))
+
+### whole batch ###
+def run_batch(paths, definitions, checksum_definitions, cache_dir, export_dir=None, processes=None, split=DEFAULT_SPLIT):
+	# {path: tables} for every log, cached ones are loaded and only the others read
+	if not os.path.isdir(cache_dir):
+		os.makedirs(cache_dir)
+	if export_dir and not os.path.isdir(export_dir):
+		os.makedirs(export_dir)
+	fp = fingerprint(definitions, checksum_definitions, export_dir)
+
+	results = collections.OrderedDict()
+	keys = {}
+	todo = []
+	for path in paths:
+		keys[path] = cache_key(path, fp)
+		cached = load_cached(cache_dir, keys[path])
+		if cached is None:
+			todo.append(path)
+		else:
+			results[path] = cached
+	print('logs:', len(paths), ' cached:', len(results), ' to process:', len(todo))
+
+	jobs = [job for path in todo for job in split_jobs(path, split)]
+	remaining = collections.Counter(job[0] for job in jobs)
+	partials = collections.defaultdict(list)
+
+	def finished(partial):
+		path = partial[0]
+		partials[path].append(partial)
+		remaining[path] -= 1
+		if remaining[path]:
+			return
+		tables, samples = merge_partials(partials.pop(path))
+		if export_dir:
+			export_samples(export_dir, path, keys[path], samples)
+		save_cached(cache_dir, keys[path], tables)
+		results[path] = tables
+		print('done', path)
+
+	if processes == 1:
+		_init(definitions, checksum_definitions, export_dir)
+		for job in jobs:
+			finished(process_job(job))
+	elif jobs:
+		pool = multiprocessing.Pool(processes, _init, (definitions, checksum_definitions, export_dir))
+		try:
+			for partial in pool.imap_unordered(process_job, jobs):
+				finished(partial)
+		finally:
+			pool.close()
+			pool.join()
+
+	return collections.OrderedDict((path, results[path]) for path in paths)
+
+def merge_results(results):
+	# one dataset: the files in order and every table with the file's position in its file column
+	dataset = {'files': np.array(list(results), dtype=str)}
+	for name, dtype in TABLES.items():
+		parts = []
+		for k, tables in enumerate(results.values()):
+			table = np.array(tables[name], dtype=dtype)
+			table['file'] = k
+			parts.append(table)
+		dataset[name] = np.concatenate(parts) if parts else np.zeros(0, dtype=dtype)
+	return dataset
+
+def save_dataset(path, dataset):
+	with open(path, 'wb') as f:
+		np.savez(f, **dataset)
+
+def load_dataset(path):
+	with np.load(path) as z:
+		return dict((name, z[name]) for name in z.files)
+
+def print_summary(dataset):
+	ids = dataset['ids']
+	checks = dataset['checksums']
+	print('files: %d  frames: %d  (bus, id) pairs: %d' % (len(dataset['files']), ids['count'].sum(),
+		len(set(zip(ids['bus'].tolist(), ids['id'].tolist())))))
+	if len(checks):
+		print('bus  id          files   checked   failed   fail %')
+		keys = sorted(set(zip(checks['bus'].tolist(), checks['id'].tolist())))
+		for bus, ident in keys:
+			sel = (checks['bus'] == bus) & (checks['id'] == ident)
+			checked, failed = checks['checked'][sel].sum(), checks['failed'][sel].sum()
+			print('%-4d %-10s %6d %9d %8d %8.3f' % (bus, hex(ident), np.count_nonzero(sel), checked, failed, 100.0 * failed / max(checked, 1)))
+
+def parse_args():
+	arg_parser = argparse.ArgumentParser(description='per id statistics, checksums and decoded signals of many PandaLogger logs')
+	arg_parser.add_argument('-i', '--input', required=True, nargs='+', help='log globs or directories e.g. <"logs/*/2024-*.bin" logs/>')
+	arg_parser.add_argument('-o', '--output', required=True, help='merged dataset (.npz)')
+	arg_parser.add_argument('-d', '--definitions', required=False, nargs='+', default=['tesla_model_s', 'ford_f150'], help='signal / checksum definition files (.dbc / .yaml) or names of bundled ones in signals/')
+	arg_parser.add_argument('-C', '--cache', required=False, default=None, help='results cache directory, defaults to <output>.cache')
+	arg_parser.add_argument('-e', '--export', required=False, default=None, help='also write the decoded signals of every log to this directory')
+	arg_parser.add_argument('-p', '--processes', required=False, default=None, type=int, help='worker processes, defaults to one per cpu')
+	arg_parser.add_argument('-s', '--split', required=False, default=DEFAULT_SPLIT, type=int, help='binary logs longer than this many frames are split into jobs of this size, 0 never splits')
+	return arg_parser.parse_args()
+
+def main():
+	args = parse_args()
+	definitions = []
+	checksum_definitions = []
+	for path in args.definitions:
+		definitions += can_decode.load_definitions(path)
+		checksum_definitions += can_checksum.load_definitions(path)
+
+	paths = find_logs(args.input)
+	cache_dir = args.cache or args.output + '.cache'
+	results = run_batch(paths, definitions, checksum_definitions, cache_dir, args.export, args.processes, args.split)
+	dataset = merge_results(results)
+	save_dataset(args.output, dataset)
+	print_summary(dataset)
+	print('dataset written to', args.output)
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+
+### one can bus interface over interchangeable backends
+###   panda[:serial]                          comma.ai panda over usb (or panda:WIFI)
+###   socketcan:can0,can1 / vcan:vcan0        linux raw can sockets, bus number = position in the list
+###   pythoncan:<interface>:<ch0>,<ch1>       any python-can interface
+###   sim[:rate=1000,ids=20,buses=1,...]      in process simulated traffic, no hardware needed
+### frames come back in panda's can_recv() format, [(address, bus time, data, bus), ...], and every backend also
+### answers to the panda method names so PandaLogger / PandaParser replay can drive any of them
+### set_filters(can_filter.IdFilter) pushes an id selection into the backend as far as it goes (CAN_RAW_FILTER,
+### python-can can_filters, the simulated traffic) and returns what is left to check per frame, None for nothing.
+### panda firmware has no receive filter, its frames are all checked on the host
+
+import collections
+import select
+import socket
+import struct
+import time
+import numpy as np
+import can_filter
+
+# linux/can.h
+CAN_EFF_FLAG = 0x80000000
+CAN_RTR_FLAG = 0x40000000
+CAN_ERR_FLAG = 0x20000000
+CAN_SFF_MASK = 0x000007ff
+CAN_EFF_MASK = 0x1fffffff
+CAN_FRAME = struct.Struct('=IB3x8s')
+
+MAX_STD_ID = 0x7ff
+TX_ECHO = 0x80 # panda reports our own transmitted frames on bus + 0x80
+
+class CanBus():
+	SAFETY_NOOUTPUT = 0
+	SAFETY_ALLOUTPUT = 0x1337
+
+	def recv(self):
+		raise NotImplementedError
+
+	def send(self, address, data, bus=0):
+		raise NotImplementedError
+
+	def send_many(self, msgs):
+		for address, _, data, bus in msgs:
+			self.send(address, data, bus)
+
+	def clear(self):
+		pass
+
+	def close(self):
+		pass
+
+	# panda.Panda compatible names
+	def can_recv(self):
+		return self.recv()
+
+	def can_send(self, address, data, bus):
+		self.send(address, data, bus)
+
+	def can_send_many(self, msgs):
+		self.send_many(msgs)
+
+	def can_clear(self, bus):
+		self.clear()
+
+	def set_safety_mode(self, mode):
+		pass
+
+	def set_filters(self, idfilter):
+		return idfilter
+
+### comma.ai panda ###
+class PandaBus(CanBus):
+	def __init__(self, serial=None):
+		from panda import Panda
+		self.panda = Panda(serial) if serial else Panda()
+		self.SAFETY_NOOUTPUT = self.panda.SAFETY_NOOUTPUT
+		self.SAFETY_ALLOUTPUT = self.panda.SAFETY_ALLOUTPUT
+
+	def recv(self):
+		return self.panda.can_recv()
+
+	def send(self, address, data, bus=0):
+		self.panda.can_send(address, data, bus)
+
+	def send_many(self, msgs):
+		self.panda.can_send_many(msgs)
+
+	def clear(self):
+		self.panda.can_clear(0xffff)
+
+	def set_safety_mode(self, mode):
+		self.panda.set_safety_mode(mode)
+
+	def close(self):
+		self.panda.close()
+
+	def __getattr__(self, name):
+		# anything panda specific (set_can_speed_kbps, ...) goes straight to the panda
+		return getattr(self.panda, name)
+
+### linux socketcan ###
+def pack_frame(address, data, extended=None):
+	if extended is None:
+		extended = address > MAX_STD_ID
+	can_id = (address & CAN_EFF_MASK) | CAN_EFF_FLAG if extended else address & CAN_SFF_MASK
+	data = bytes(data)
+	return CAN_FRAME.pack(can_id, len(data), data.ljust(8, b'\x00'))
+
+def unpack_frame(raw):
+	# (address, data, extended), None for error / remote frames
+	can_id, dlc, data = CAN_FRAME.unpack(raw)
+	if can_id & (CAN_ERR_FLAG | CAN_RTR_FLAG):
+		return None
+	if can_id & CAN_EFF_FLAG:
+		return can_id & CAN_EFF_MASK, data[:dlc], True
+	return can_id & CAN_SFF_MASK, data[:dlc], False
+
+class SocketCanBus(CanBus):
+	def __init__(self, channels, timeout=0.01, max_batch=1024):
+		self.channels = list(channels)
+		self.timeout = timeout
+		self.max_batch = max_batch
+		self.socks = []
+		for channel in self.channels:
+			sock = socket.socket(socket.AF_CAN, socket.SOCK_RAW, socket.CAN_RAW)
+			sock.bind((channel,))
+			sock.setblocking(False)
+			self.socks.append(sock)
+
+	def recv(self):
+		frames = []
+		ready, _, _ = select.select(self.socks, [], [], self.timeout)
+		for sock in ready:
+			bus = self.socks.index(sock)
+			for _ in range(self.max_batch):
+				try:
+					raw = sock.recv(CAN_FRAME.size)
+				except (BlockingIOError, InterruptedError):
+					break
+				frame = unpack_frame(raw)
+				if frame is not None:
+					frames.append((frame[0], 0, frame[1], bus))
+		return frames
+
+	def send(self, address, data, bus=0, extended=None):
+		self.socks[bus].send(pack_frame(address, data, extended))
+
+	def set_filters(self, idfilter):
+		exact = not idfilter.excludes
+		for bus, sock in enumerate(self.socks):
+			filters = idfilter.socketcan_filters(bus)
+			if filters is None:
+				exact = False
+				filters = [(0, 0)]
+			sock.setsockopt(socket.SOL_CAN_RAW, socket.CAN_RAW_FILTER, can_filter.pack_socketcan_filters(filters))
+		return None if exact else idfilter
+
+	def close(self):
+		for sock in self.socks:
+			sock.close()
+
+### python-can ###
+class PythonCanBus(CanBus):
+	def __init__(self, interface, channels, timeout=0.01, **kwargs):
+		import can
+		self.can = can
+		self.timeout = timeout
+		self.buses = [can.Bus(interface=interface, channel=channel, **kwargs) for channel in channels]
+
+	def recv(self):
+		frames = []
+		for bus, dev in enumerate(self.buses):
+			msg = dev.recv(timeout=self.timeout if not frames else 0)
+			while msg is not None:
+				if not (msg.is_error_frame or msg.is_remote_frame):
+					frames.append((msg.arbitration_id, 0, bytes(msg.data), bus))
+				msg = dev.recv(timeout=0)
+		return frames
+
+	def send(self, address, data, bus=0, extended=None):
+		if extended is None:
+			extended = address > MAX_STD_ID
+		self.buses[bus].send(self.can.Message(arbitration_id=address, data=bytes(data), is_extended_id=extended))
+
+	def set_filters(self, idfilter):
+		# python-can filters in hardware where the interface can, in its own recv() otherwise
+		exact = not idfilter.excludes
+		for bus, dev in enumerate(self.buses):
+			filters = idfilter.python_can_filters(bus)
+			if filters is None:
+				exact = False
+			dev.set_filters(filters)
+		return None if exact else idfilter
+
+	def close(self):
+		for dev in self.buses:
+			dev.shutdown()
+
+### simulated bus ###
+class SimBus(CanBus):
+	# periodic multi id traffic at a chosen total frame rate. realtime=True paces frames to the wall clock,
+	# realtime=False hands out batch frames per recv() as fast as the caller can take them.
+	# sent frames are recorded in self.sent, echoed back like a panda does when loopback is set, and passed
+	# to listeners(bus, address, data, bus number) which may inject() responses (simulated ecus)
+	def __init__(self, rate=1000.0, ids=20, buses=1, dlc=8, realtime=True, batch=256, loopback=False, seed=0, clock=time.time):
+		self.rng = np.random.RandomState(seed)
+		self.rate = float(rate)
+		self.clock = clock
+		self.realtime = realtime
+		self.batch = batch
+		self.loopback = loopback
+		self.dlc = dlc
+		self.sent = []
+		self.inbox = collections.deque() # appended to by send / inject from other threads, drained by recv
+		self.listeners = []
+		self.keep = None
+
+		if isinstance(ids, int):
+			idents = np.sort(self.rng.choice(np.arange(0x100, MAX_STD_ID), size=ids, replace=False))
+			self.traffic_ids = idents.astype(np.uint32)
+			self.traffic_buses = (np.arange(ids) % buses).astype(np.uint8)
+		else:
+			self.traffic_ids = np.array([ident for _, ident in ids], dtype=np.uint32)
+			self.traffic_buses = np.array([bus for bus, _ in ids], dtype=np.uint8)
+
+		n = len(self.traffic_ids)
+		self.period = np.full(n, n / float(rate)) if rate > 0 and n else np.full(n, np.inf)
+		self.now = self.clock()
+		self.next_due = self.now + self.rng.uniform(0, 1, n) * self.period
+		self.counter = np.zeros(n, dtype=np.uint8)
+
+	def _generate(self, now):
+		due = self.next_due <= now
+		if not due.any():
+			return []
+		counts = (np.floor((now - self.next_due[due]) / self.period[due]) + 1).astype(np.int64)
+		slots = np.repeat(np.flatnonzero(due), counts)
+		self.next_due[due] += counts * self.period[due]
+
+		# byte 0 is a rolling counter per id, the rest is noise
+		counter = (self.counter[slots] + (np.arange(len(slots)) - np.searchsorted(slots, slots))).astype(np.uint8)
+		self.counter[due] += counts.astype(np.uint8)
+		if self.keep is not None:
+			# filtered ids keep counting, they are just never handed out, like behind a kernel filter
+			kept = self.keep[slots]
+			slots, counter = slots[kept], counter[kept]
+		payload = self.rng.randint(0, 256, size=(len(slots), 8)).astype(np.uint8)
+		payload[:, 0] = counter
+		raw = payload[:, :self.dlc].tobytes()
+		size = self.dlc
+		return [(ident, 0, raw[k * size:(k + 1) * size], bus)
+			for k, (ident, bus) in enumerate(zip(self.traffic_ids[slots].tolist(), self.traffic_buses[slots].tolist()))]
+
+	def recv(self):
+		if self.realtime:
+			self.now = self.clock()
+		else:
+			self.now += self.batch / self.rate if self.rate > 0 else 0.0
+		frames = self._generate(self.now)
+		if self.inbox:
+			# popleft is atomic, a frame appended while draining is either taken now or left for the next recv
+			injected = []
+			while self.inbox:
+				injected.append(self.inbox.popleft())
+			frames = injected + frames
+		return frames
+
+	def inject(self, address, data, bus=0):
+		self.inbox.append((address, 0, bytes(data), bus))
+
+	def set_filters(self, idfilter):
+		# generated traffic is filtered at the source, injected frames (simulated ecus) always pass
+		self.keep = idfilter.mask(self.traffic_buses, self.traffic_ids)
+		return None
+
+	def send(self, address, data, bus=0, extended=None):
+		self.sent.append((self.clock(), address, bytes(data), bus))
+		if self.loopback:
+			self.inbox.append((address, 0, bytes(data), bus | TX_ECHO))
+		for listener in self.listeners:
+			listener(self, address, bytes(data), bus)
+
+	def clear(self):
+		self.inbox.clear()
+
+### bus specs ###
+def _options(text):
+	opts = {}
+	for item in text.split(','):
+		if '=' in item:
+			key, value = item.split('=', 1)
+			opts[key.strip()] = float(value) if '.' in value else int(value, 0)
+	return opts
+
+def open_bus(spec='panda'):
+	kind, _, rest = spec.partition(':')
+	if kind == 'panda':
+		return PandaBus(rest or None)
+	if kind in ('socketcan', 'vcan'):
+		return SocketCanBus((rest or ('vcan0' if kind == 'vcan' else 'can0')).split(','))
+	if kind == 'pythoncan':
+		interface, _, channels = rest.partition(':')
+		return PythonCanBus(interface, channels.split(','))
+	if kind == 'sim':
+		opts = _options(rest)
+		if 'realtime' in opts:
+			opts['realtime'] = bool(opts['realtime'])
+		return SimBus(**opts)
+	raise ValueError('unknown bus %s' % spec)
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+
+### socketcan capture daemon
+### reads any number of socketcan interfaces (bus number = position in the list, as in can_bus) into one log in
+### the formats PandaLogger writes (csv, bin, seg). each raw socket is read with recvmmsg, up to --batch frames per
+### system call, straight into preallocated arrays that convert to FRAME_DTYPE without a per frame python step.
+### every frame carries its kernel receive timestamp (SO_TIMESTAMPING, the software one or with --clock hardware the
+### adapter's own, falling back to SO_TIMESTAMPNS), so batching does not blur frame times. a -m selection (see
+### can_filter.py) is installed as CAN_RAW_FILTER, the process only wakes for frames it will keep
+### writing runs on can_log's writer thread, as in PandaLogger. try it with:
+###   sudo ip link add dev vcan0 type vcan && sudo ip link set up vcan0
+###   ./can_capture.py -i vcan0 -o /tmp/vcan.bin -f bin      (and cangen vcan0 in another shell)
+
+import argparse
+import ctypes
+import ctypes.util
+import os
+import select
+import signal
+import socket
+import time
+import numpy as np
+import can_filter
+import can_log
+
+# asm-generic/socket.h, linux/net_tstamp.h
+SO_TIMESTAMPNS = 35
+SO_TIMESTAMPING = 37
+SOF_TIMESTAMPING_RX_HARDWARE = 1 << 2
+SOF_TIMESTAMPING_RX_SOFTWARE = 1 << 3
+SOF_TIMESTAMPING_SOFTWARE = 1 << 4
+SOF_TIMESTAMPING_RAW_HARDWARE = 1 << 6
+MSG_DONTWAIT = 0x40
+CAN_EFF_FLAG = 0x80000000
+CAN_RTR_FLAG = 0x40000000
+CAN_ERR_FLAG = 0x20000000
+CAN_EFF_MASK = 0x1fffffff
+
+# struct can_frame as a raw socket hands it over, payload kept in wire order like FRAME_DTYPE
+RAW_FRAME = np.dtype([('can_id', '=u4'), ('dlc', 'u1'), ('pad', 'V3'), ('data', '>u8')])
+# bits of the left aligned payload a dlc covers, bytes past it are not guaranteed to be zero
+DLC_MASK = np.array([(0xffffffffffffffff << (64 - 8 * n)) & 0xffffffffffffffff for n in range(9)], dtype=np.uint64)
+
+CONTROL = 64 # ancillary bytes per message, room for one SCM_TIMESTAMPING (3 timespecs) on 64 bit
+BATCH = 256
+
+### recvmmsg ###
+class _IoVec(ctypes.Structure):
+	_fields_ = [('base', ctypes.c_void_p), ('len', ctypes.c_size_t)]
+
+class _MsgHdr(ctypes.Structure):
+	_fields_ = [('name', ctypes.c_void_p), ('namelen', ctypes.c_uint32), ('iov', ctypes.POINTER(_IoVec)), ('iovlen', ctypes.c_size_t),
+		('control', ctypes.c_void_p), ('controllen', ctypes.c_size_t), ('flags', ctypes.c_int)]
+
+class _MMsgHdr(ctypes.Structure):
+	_fields_ = [('hdr', _MsgHdr), ('len', ctypes.c_uint)]
+
+try:
+	_libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+	_recvmmsg = _libc.recvmmsg
+	_recvmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(_MMsgHdr), ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+	_recvmmsg.restype = ctypes.c_int
+except (OSError, AttributeError, TypeError):
+	_recvmmsg = None
+
+# struct cmsghdr is size_t len, int level, int type, then data aligned to size_t
+_WORD = ctypes.sizeof(ctypes.c_size_t)
+_CMSG_DATA = (_WORD + 8 + _WORD - 1) & ~(_WORD - 1)
+_LONG = np.dtype('=i%d' % ctypes.sizeof(ctypes.c_long))
+_TIMESPEC = 2 * _LONG.itemsize
+
+def _column(array, offset, dtype, stride):
+	# one field of every record of a raw buffer as a strided numpy view
+	return np.ndarray(len(array) * array.itemsize // stride, dtype=dtype, buffer=array, offset=offset, strides=(stride,))
+
+class CaptureSocket():
+	# one raw can socket, read() returns whatever is queued (up to batch frames) as FRAME_DTYPE
+	def __init__(self, channel, bus, filters=None, batch=BATCH, clock='software'):
+		self.channel = channel
+		self.bus = bus
+		self.batch = batch
+		self.sock = self._open(channel, filters)
+		self.sock.setblocking(False)
+
+		# every message gets a fixed slot in raw / control, so a batch is read in place
+		self.raw = np.zeros(batch, dtype=RAW_FRAME)
+		self.control = np.zeros(batch * CONTROL, dtype=np.uint8)
+		self.iov = (_IoVec * batch)()
+		self.msgs = (_MMsgHdr * batch)()
+		for k in range(batch):
+			self.iov[k].base = self.raw.ctypes.data + k * RAW_FRAME.itemsize
+			self.iov[k].len = RAW_FRAME.itemsize
+			hdr = self.msgs[k].hdr
+			hdr.iov = ctypes.pointer(self.iov[k])
+			hdr.iovlen = 1
+			hdr.control = self.control.ctypes.data + k * CONTROL
+		msgs = np.frombuffer(self.msgs, dtype=np.uint8)
+		self.controllen = _column(msgs, _MMsgHdr.hdr.offset + _MsgHdr.controllen.offset, np.dtype('=u%d' % _WORD), ctypes.sizeof(_MMsgHdr))
+		self.msg_len = _column(msgs, _MMsgHdr.len.offset, np.dtype('=u4'), ctypes.sizeof(_MMsgHdr))
+
+		# timestamping puts software, legacy and raw hardware timespecs in that order
+		self.cmsg_type = _column(self.control, _WORD + 4, np.dtype('=i4'), CONTROL)
+		self.stamp = dict((k, (_column(self.control, _CMSG_DATA + k * _TIMESPEC, _LONG, CONTROL),
+			_column(self.control, _CMSG_DATA + k * _TIMESPEC + _LONG.itemsize, _LONG, CONTROL))) for k in (0, 2))
+		self.hardware = clock == 'hardware'
+
+	def _open(self, channel, filters):
+		sock = socket.socket(socket.AF_CAN, socket.SOCK_RAW, socket.CAN_RAW)
+		if filters is not None:
+			sock.setsockopt(socket.SOL_CAN_RAW, socket.CAN_RAW_FILTER, can_filter.pack_socketcan_filters(filters))
+		try:
+			sock.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPING, SOF_TIMESTAMPING_RX_SOFTWARE | SOF_TIMESTAMPING_SOFTWARE |
+				SOF_TIMESTAMPING_RX_HARDWARE | SOF_TIMESTAMPING_RAW_HARDWARE)
+			self.scm = SO_TIMESTAMPING
+		except OSError:
+			sock.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPNS, 1)
+			self.scm = SO_TIMESTAMPNS
+		sock.bind((channel,))
+		return sock
+
+	def fileno(self):
+		return self.sock.fileno()
+
+	def _recv(self):
+		# messages read into the slots: recvmmsg when libc has it, else one recvmsg per frame
+		if _recvmmsg is not None:
+			self.controllen[:] = CONTROL
+			n = _recvmmsg(self.sock.fileno(), self.msgs, self.batch, MSG_DONTWAIT, None)
+			if n < 0:
+				errno = ctypes.get_errno()
+				if errno in (11, 4): # EAGAIN, EINTR
+					return 0
+				raise OSError(errno, os.strerror(errno))
+			return n
+		n = 0
+		raw = self.raw.view(np.uint8)
+		while n < self.batch:
+			try:
+				data, ancdata, _, _ = self.sock.recvmsg(RAW_FRAME.itemsize, CONTROL)
+			except (BlockingIOError, InterruptedError):
+				break
+			raw[n * RAW_FRAME.itemsize:n * RAW_FRAME.itemsize + len(data)] = np.frombuffer(data, dtype=np.uint8)
+			self.msg_len[n] = len(data)
+			self.controllen[n] = 0
+			self.control[n * CONTROL:(n + 1) * CONTROL] = 0
+			for level, kind, value in ancdata:
+				if level == socket.SOL_SOCKET and kind == self.scm:
+					value = value[:CONTROL - _CMSG_DATA]
+					self.control[n * CONTROL + _WORD + 4:n * CONTROL + _WORD + 8] = np.frombuffer(np.int32(kind).tobytes(), dtype=np.uint8)
+					self.control[n * CONTROL + _CMSG_DATA:n * CONTROL + _CMSG_DATA + len(value)] = np.frombuffer(value, dtype=np.uint8)
+					self.controllen[n] = _CMSG_DATA + len(value)
+			n += 1
+		return n
+
+	def read(self):
+		n = self._recv()
+		if n == 0:
+			return np.zeros(0, dtype=can_log.FRAME_DTYPE)
+		raw = self.raw[:n]
+		keep = (self.msg_len[:n] == RAW_FRAME.itemsize) & ((raw['can_id'] & (CAN_ERR_FLAG | CAN_RTR_FLAG)) == 0)
+
+		sec, nsec = self.stamp[0]
+		times = sec[:n] + nsec[:n] * 1e-9
+		if self.hardware and self.scm == SO_TIMESTAMPING:
+			hw_sec, hw_nsec = self.stamp[2]
+			hw = hw_sec[:n] + hw_nsec[:n] * 1e-9
+			times = np.where(hw > 0, hw, times)
+		# a frame without a timestamp (none enabled, or stripped) gets the time of the read
+		stamped = (self.controllen[:n] > _CMSG_DATA) & (self.cmsg_type[:n] == self.scm) & (times > 0)
+		times = np.where(stamped, times, time.time())
+
+		frames = np.zeros(int(keep.sum()), dtype=can_log.FRAME_DTYPE)
+		raw = raw[keep]
+		dlc = np.minimum(raw['dlc'], 8)
+		frames['time'] = times[keep]
+		frames['bus'] = self.bus
+		frames['id'] = np.where(raw['can_id'] & CAN_EFF_FLAG, raw['can_id'] & CAN_EFF_MASK, raw['can_id'] & 0x7ff)
+		frames['dlc'] = dlc
+		frames['data'] = raw['data'] & DLC_MASK[dlc]
+		return frames
+
+	def close(self):
+		self.sock.close()
+
+class Capture():
+	# all interfaces behind one epoll, poll() returns the FRAME_DTYPE batches of every socket that was ready
+	def __init__(self, channels, spec=None, batch=BATCH, clock='software'):
+		self.idfilter = can_filter.IdFilter.from_spec(spec) if spec else None
+		self.sockets = []
+		self.checks = []
+		for bus, channel in enumerate(channels):
+			filters = None if self.idfilter is None else self.idfilter.socketcan_filters(bus)
+			self.sockets.append(CaptureSocket(channel, bus, filters, batch, clock))
+			# what the kernel cannot rule out (exclusions, too many ranges) is dropped here
+			self.checks.append(self.idfilter is not None and (filters is None or bool(self.idfilter.excludes)))
+		self.poller = select.epoll()
+		self.by_fd = {}
+		for sock, check in zip(self.sockets, self.checks):
+			self.poller.register(sock.fileno(), select.EPOLLIN)
+			self.by_fd[sock.fileno()] = (sock, check)
+
+	def poll(self, timeout=0.1):
+		batches = []
+		for fd, _ in self.poller.poll(timeout):
+			sock, check = self.by_fd[fd]
+			frames = sock.read()
+			# a socket with more than batch frames queued is read again on the next poll without waiting
+			if check and len(frames):
+				frames = frames[self.idfilter.mask(frames['bus'], frames['id'])]
+			if len(frames):
+				batches.append(frames)
+		return batches
+
+	def close(self):
+		self.poller.close()
+		for sock in self.sockets:
+			sock.close()
+
+def bring_up(channels, bitrate):
+	for channel in channels:
+		if channel.startswith('vcan'):
+			os.system('sudo /sbin/ip link set %s up' % channel)
+		else:
+			os.system('sudo /sbin/ip link set %s up type can bitrate %d' % (channel, bitrate))
+
+def parse_args():
+	arg_parser = argparse.ArgumentParser(description='capture socketcan interfaces into a PandaLogger log')
+	arg_parser.add_argument('-i', '--interfaces', required=False, nargs='+', default=['can0'], help='socketcan interfaces, bus number = position e.g. <can0 can1> <vcan0>')
+	arg_parser.add_argument('-o', '--output', required=True, help='log file, or directory for -f seg')
+	arg_parser.add_argument('-f', '--format', required=False, default='bin', choices=['csv', 'bin', 'seg'], help='log as csv text, fixed width binary records or a directory of compressed segments')
+	arg_parser.add_argument('-c', '--codec', required=False, default=None, choices=can_log.CODECS, help='segment compression, defaults to zstd / lz4 when installed, else gzip')
+	arg_parser.add_argument('-sm', '--segmentMB', required=False, default=256, type=float, help='rotate segments after this many compressed MB')
+	arg_parser.add_argument('-sh', '--segmentHours', required=False, default=1.0, type=float, help='rotate segments after this many hours')
+	arg_parser.add_argument('-m', '--mask', required=False, default=None, help='ids to keep, pushed down to the kernel e.g. <0x155,1:0x200-0x2ff> (see can_filter.py)')
+	arg_parser.add_argument('-b', '--batch', required=False, default=BATCH, type=int, help='frames read per system call')
+	arg_parser.add_argument('--clock', required=False, default='software', choices=['software', 'hardware'], help='kernel receive time, or the adapter clock where it has one')
+	arg_parser.add_argument('--up', required=False, default=None, type=int, help='bring the interfaces up at this bitrate first (needs sudo)')
+	arg_parser.add_argument('-q', '--queue', required=False, default=4096, type=int, help='receive batches buffered ahead of the writer thread')
+	arg_parser.add_argument('-st', '--status', required=False, default=1.0, type=float, help='seconds between status line updates, 0 to disable')
+	return arg_parser.parse_args()
+
+def main():
+	args = parse_args()
+	channels = [c for arg in args.interfaces for c in arg.split(',') if c]
+	if args.up is not None:
+		bring_up(channels, args.up)
+
+	capture = Capture(channels, args.mask, args.batch, args.clock)
+	if args.format == 'seg':
+		logwriter = can_log.open_writer(args.output, 'seg', codec=args.codec, max_bytes=int(args.segmentMB * (1 << 20)), max_seconds=args.segmentHours * 3600.0)
+	else:
+		logwriter = can_log.open_writer(args.output, args.format)
+	ring = can_log.FrameRing(args.queue)
+	writer_thread = can_log.LogWriterThread(logwriter, ring, None, args.status)
+	writer_thread.start()
+	print('capturing', ', '.join('%s as bus %d' % (c, bus) for bus, c in enumerate(channels)), 'to', args.output,
+		'(%s)' % ('recvmmsg' if _recvmmsg is not None else 'recvmsg'), 'Press Ctrl-C to exit...\n')
+
+	# run as a service: SIGTERM closes the log like Ctrl-C does
+	stopping = []
+	signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+	try:
+		while not stopping:
+			for frames in capture.poll():
+				ring.push((None, frames), len(frames))
+	except KeyboardInterrupt:
+		pass
+	finally:
+		capture.close()
+		writer_thread.stop()
+	counts = writer_thread.counts
+	print('\nNow exiting. Final message Counts...', ' '.join('Bus %d: %d' % (bus, counts[bus]) for bus in range(len(channels))),
+		'Dropped: %d Overflows: %d' % (ring.dropped, ring.overflows))
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+
+### checksum verification
+### every checked id has one table entry (algorithm, byte range, offset / "mystery factor", target byte) and whole
+### batches of frames are checked at once, giving pass / fail masks and per (bus, id) error counts
+### entries live next to the signals of a message in the definition yaml:
+###   checksum: {algorithm: sum, bytes: [0, 6], target: 7, offset: -5}
+### algorithms
+###   sum    (bytes + id + dlc + offset) % 256, the tesla scheme. include_id / include_len switch the id / dlc terms
+###   xor    bytes xor'd together, then offset added % 256
+###   crc8*  table driven crc8 over the bytes, a nonzero offset is fed as one more byte (per message "data id")
+###          named variants are listed in CRC8_VARIANTS, 'crc8' with poly / init / xorout gives any other one
+
+import argparse
+import collections
+import os
+import numpy as np
+import yaml
+import can_decode
+import can_log
+
+# name -> (poly, init, xorout)
+CRC8_VARIANTS = {
+	'crc8': (0x07, 0x00, 0x00),
+	'crc8_sae_j1850': (0x1d, 0xff, 0xff),
+	'crc8_sae_j1850_zero': (0x1d, 0x00, 0x00),
+	'crc8_autosar': (0x2f, 0xff, 0xff),
+	'crc8_h2f': (0x2f, 0xff, 0xff),
+	'crc8_cdma2000': (0x9b, 0xff, 0x00),
+}
+
+Checksum = collections.namedtuple('Checksum', ['ident', 'algorithm', 'first', 'last', 'target', 'offset', 'include_id', 'include_len', 'bus', 'poly', 'init', 'xorout'])
+
+def checksum(ident, algorithm='sum', first=0, last=6, target=7, offset=0, include_id=True, include_len=True, bus=None, poly=None, init=None, xorout=None):
+	if algorithm.startswith('crc8'):
+		if algorithm not in CRC8_VARIANTS:
+			raise ValueError('unknown crc8 variant %s' % algorithm)
+		default = CRC8_VARIANTS[algorithm]
+		poly = default[0] if poly is None else poly
+		init = default[1] if init is None else init
+		xorout = default[2] if xorout is None else xorout
+	elif algorithm not in ('sum', 'xor'):
+		raise ValueError('unknown checksum algorithm %s' % algorithm)
+	return Checksum(ident, algorithm, first, last, target, offset, include_id, include_len, bus, poly, init, xorout)
+
+### crc8 ###
+_CRC8_TABLES = {}
+
+def crc8_table(poly):
+	# 256 entry msb first table, built once per polynomial
+	if poly not in _CRC8_TABLES:
+		crc = np.arange(256, dtype=np.uint16)
+		for _ in range(8):
+			crc = np.where(crc & 0x80, (crc << 1) ^ poly, crc << 1) & 0xff
+		_CRC8_TABLES[poly] = crc.astype(np.uint8)
+	return _CRC8_TABLES[poly]
+
+def crc8(data, poly=0x07, init=0x00, xorout=0x00):
+	# single message reference implementation
+	table = crc8_table(poly)
+	crc = init
+	for byte in bytearray(data):
+		crc = int(table[crc ^ byte])
+	return crc ^ xorout
+
+### vectorized computation ###
+def expected(defn, payloads, ids, dlcs):
+	# checksum every row of payloads ((n, 8) uint8) should carry in its target byte
+	block = payloads[:, defn.first:defn.last + 1]
+	if defn.algorithm == 'sum':
+		total = block.sum(axis=1, dtype=np.int64) + defn.offset
+		if defn.include_id:
+			total += ids.astype(np.int64)
+		if defn.include_len:
+			total += dlcs.astype(np.int64)
+		return (total % 256).astype(np.uint8)
+
+	if defn.algorithm == 'xor':
+		total = np.bitwise_xor.reduce(block, axis=1).astype(np.int64) + defn.offset
+		return (total % 256).astype(np.uint8)
+
+	table = crc8_table(defn.poly)
+	crc = np.full(len(payloads), defn.init, dtype=np.uint8)
+	for k in range(block.shape[1]):
+		crc = table[crc ^ block[:, k]]
+	if defn.offset:
+		crc = table[crc ^ np.uint8(defn.offset & 0xff)]
+	return crc ^ np.uint8(defn.xorout)
+
+class ChecksumTable():
+	def __init__(self, definitions):
+		self.definitions = list(definitions)
+		by_id = collections.OrderedDict()
+		for defn in self.definitions:
+			by_id.setdefault(defn.ident, []).append(defn)
+		self.ids = np.array(sorted(by_id), dtype=np.uint32)
+		self.entries = [by_id[ident] for ident in self.ids.tolist()]
+
+	def definition(self, bus, ident):
+		pos = int(np.searchsorted(self.ids, ident))
+		if pos < len(self.ids) and self.ids[pos] == ident:
+			for defn in self.entries[pos]:
+				if defn.bus is None or defn.bus == bus:
+					return defn
+		return None
+
+	def check(self, frames):
+		# (checked, ok, expected) per frame: checked marks frames with a table entry whose target byte is present
+		n = len(frames)
+		checked = np.zeros(n, dtype=bool)
+		ok = np.zeros(n, dtype=bool)
+		want = np.zeros(n, dtype=np.uint8)
+		if len(self.ids) == 0 or n == 0:
+			return checked, ok, want
+
+		ids = frames['id']
+		pos = np.minimum(np.searchsorted(self.ids, ids), len(self.ids) - 1)
+		rows = np.flatnonzero(self.ids[pos] == ids)
+		if len(rows) == 0:
+			return checked, ok, want
+		payloads = can_log.payload_bytes(frames[rows])
+		buses = frames['bus'][rows]
+		dlcs = frames['dlc'][rows]
+		pos = pos[rows]
+
+		for group in np.unique(pos).tolist():
+			in_group = pos == group
+			for defn in self.entries[group]:
+				sel = in_group & (dlcs > defn.target)
+				if defn.bus is not None:
+					sel &= buses == defn.bus
+				sel &= ~checked[rows]
+				if not sel.any():
+					continue
+				target = rows[sel]
+				want[target] = expected(defn, payloads[sel], ids[target], dlcs[sel])
+				ok[target] = want[target] == payloads[sel, defn.target]
+				checked[target] = True
+		return checked, ok, want
+
+### streaming accumulation ###
+class BatchChecker():
+	# per (bus, id) checked / failed counts over a streamed log, plus the failing rows with the expected
+	# and received checksum byte so a row loop can report them, of every id (True), none (False) or the listed ids
+	def __init__(self, definitions, keep_failures=True):
+		self.table = ChecksumTable(definitions)
+		self.keep_failures = keep_failures
+		self.keep_ids = None if isinstance(keep_failures, bool) else np.array(list(keep_failures), dtype=np.uint32)
+		self.checked = collections.Counter()
+		self.failed = collections.Counter()
+		self.failures = {}
+		self.offset = 0
+
+	def add(self, frames, rows=None):
+		# rows: log row of each frame when frames are a selection of the log, they follow the previous batch otherwise
+		checked, ok, want = self.table.check(frames)
+		if checked.any():
+			keys = (frames['bus'][checked].astype(np.int64) << 32) | frames['id'][checked]
+			uniq, counts = np.unique(keys, return_counts=True)
+			self.checked.update(dict(zip(uniq.tolist(), counts.tolist())))
+
+			bad = np.flatnonzero(checked & ~ok)
+			if len(bad):
+				keys = (frames['bus'][bad].astype(np.int64) << 32) | frames['id'][bad]
+				uniq, counts = np.unique(keys, return_counts=True)
+				self.failed.update(dict(zip(uniq.tolist(), counts.tolist())))
+				if self.keep_ids is not None:
+					bad = bad[np.isin(frames['id'][bad], self.keep_ids)]
+				if self.keep_failures and len(bad):
+					payloads = can_log.payload_bytes(frames[bad])
+					log_rows = (bad + self.offset if rows is None else np.asarray(rows)[bad]).tolist()
+					for k, row in enumerate(bad.tolist()):
+						defn = self.table.definition(int(frames['bus'][row]), int(frames['id'][row]))
+						self.failures[log_rows[k]] = (int(want[row]), int(payloads[k, defn.target]))
+		if rows is None:
+			self.offset += len(frames)
+
+	def summary(self):
+		# [(bus, id, checked, failed)] sorted by bus, id
+		return [(key >> 32, key & 0xffffffff, self.checked[key], self.failed[key]) for key in sorted(self.checked)]
+
+def print_summary(checker):
+	print('bus  id          checked   failed   fail %')
+	for bus, ident, checked, failed in checker.summary():
+		print('%-4d %-10s %9d %8d %8.3f' % (bus, hex(ident), checked, failed, 100.0 * failed / checked))
+
+### definition files ###
+def load_yaml(path):
+	with open(path) as f:
+		spec = yaml.safe_load(f)
+
+	definitions = []
+	for ident, message in spec['messages'].items():
+		d = message.get('checksum')
+		if d is None:
+			continue
+		first, last = d.get('bytes', [0, 6])
+		definitions.append(checksum(can_decode._ident(ident), d.get('algorithm', 'sum'), first, last, d.get('target', 7),
+			d.get('offset', 0), d.get('include_id', True), d.get('include_len', True), d.get('bus', message.get('bus')),
+			d.get('poly'), d.get('init'), d.get('xorout')))
+	return definitions
+
+def load_definitions(path):
+	if not os.path.exists(path) and os.path.exists(os.path.join(can_decode.BUNDLED_DIR, path + '.yaml')):
+		path = os.path.join(can_decode.BUNDLED_DIR, path + '.yaml')
+	if path.lower().endswith('.dbc'):
+		return [] # dbc files carry no checksum layout
+	return load_yaml(path)
+
+def parse_args():
+	arg_parser = argparse.ArgumentParser(description='verify message checksums of a PandaLogger log')
+	arg_parser.add_argument('-i', '--input', required=True, help='csv or binary log, or directory of segments')
+	arg_parser.add_argument('-d', '--definitions', required=False, nargs='+', default=['tesla_model_s'], help='definition files (.yaml) or names of bundled ones in signals/')
+	arg_parser.add_argument('-v', '--verbose', required=False, action='store_true', help='list every failing row')
+	return arg_parser.parse_args()
+
+def main():
+	args = parse_args()
+	definitions = []
+	for path in args.definitions:
+		definitions += load_definitions(path)
+	checker = BatchChecker(definitions, keep_failures=args.verbose)
+	for frames in can_log.iter_frames(args.input):
+		checker.add(frames)
+
+	print_summary(checker)
+	for row in sorted(checker.failures):
+		print('row', row, 'calculated crc:', checker.failures[row][0], 'last byte:', checker.failures[row][1])
+
+if __name__ == "__main__":
+	main()
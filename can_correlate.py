@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+
+### candidate signal correlation against a known reference channel
+### every candidate field of every id (each bit range of 4..16 bits in intel and motorola order, unsigned and, from
+### 8 bits up, signed) is sampled onto the reference's uniform time grid with a zero order hold and ranked by
+### |pearson r| or mutual information. a field is a weighted sum of its bits, so pearson r of every candidate of an
+### id comes from one 64 x 64 bit covariance matrix; mutual information is scored in blocks of candidates with one
+### histogram per block. ids are spread over a process pool, and the best fields of each id are searched for their lag
+
+import argparse
+import collections
+import multiprocessing
+import numpy as np
+import can_decode
+import can_filter
+import can_index
+import can_resample
+
+DEFAULT_RATE = 10.0
+DEFAULT_LENGTHS = (4, 16)
+BLOCK = 128
+MI_BINS = 32
+MIN_POINTS = 32
+
+Candidate = collections.namedtuple('Candidate', ['start', 'length', 'little_endian', 'signed'])
+
+def candidate_name(cand):
+	# dbc notation, start|length@order sign
+	return '%d|%d@%d%s' % (cand.start, cand.length, 1 if cand.little_endian else 0, '-' if cand.signed else '+')
+
+def candidates(dlc, lengths=DEFAULT_LENGTHS):
+	# every bit range inside the first dlc bytes, a motorola range only when it differs from the intel one
+	found = []
+	seen = set()
+	for length in range(lengths[0], lengths[1] + 1):
+		for little_endian in (True, False):
+			for shift in range(0, 65 - length):
+				if little_endian:
+					bits = frozenset(range(shift, shift + length))
+				else:
+					bits = frozenset((7 - p // 8) * 8 + p % 8 for p in range(shift, shift + length))
+				if max(bits) >= dlc * 8 or bits in seen:
+					continue
+				seen.add(bits)
+				start = can_decode.dbc_start(shift, length, little_endian)
+				found.append(Candidate(start, length, little_endian, False))
+				if length >= 8:
+					found.append(Candidate(start, length, little_endian, True))
+	return found
+
+def compile_candidates(cands):
+	# per candidate shift / mask / byte order / sign threshold arrays, so a block extracts as a few array ops
+	layouts = [can_decode.layout(c.start, c.length, c.little_endian) for c in cands]
+	masks = np.array([l[1] for l in layouts], dtype=np.uint64)
+	half = (masks.astype(np.float64) + 1) / 2
+	return {
+		'shift': np.array([l[0] for l in layouts], dtype=np.uint64),
+		'mask': masks,
+		'le': np.array([c.little_endian for c in cands]),
+		'half': np.where([c.signed for c in cands], half, np.inf),
+	}
+
+def extract(data, table, lo=0, hi=None):
+	# (frames, candidates) float64 values of candidates lo..hi of a compiled table for every payload in data
+	le = table['le'][lo:hi]
+	words = np.where(le[None, :], can_decode.payload_words(data, True)[:, None], can_decode.payload_words(data, False)[:, None])
+	raw = ((words >> table['shift'][None, lo:hi]) & table['mask'][None, lo:hi]).astype(np.float64)
+	half = table['half'][lo:hi]
+	return raw - np.where(raw >= half[None, :], 2 * half[None, :], 0)
+
+def bit_weights(cands):
+	# (candidates, 64) weight of every payload bit (numbered byte * 8 + bit) in each candidate's raw value. a field
+	# is a weighted sum of its bits, with the msb weighing -2 ** (length - 1) when signed
+	weights = np.zeros((len(cands), 64))
+	for k, cand in enumerate(cands):
+		shift, _ = can_decode.layout(cand.start, cand.length, cand.little_endian)
+		for j in range(cand.length):
+			p = shift + j
+			bit = p if cand.little_endian else (7 - p // 8) * 8 + p % 8
+			weights[k, bit] = 2.0 ** j
+		if cand.signed:
+			weights[k, bit] = -weights[k, bit]
+	return weights
+
+### scores ###
+def _signed_pearson(x, y):
+	xc = x - x.mean(axis=0)
+	yc = y - y.mean()
+	norm = np.sqrt((xc * xc).sum(axis=0) * (yc * yc).sum())
+	with np.errstate(divide='ignore', invalid='ignore'):
+		r = xc.T.dot(yc) / norm
+	return np.nan_to_num(r)
+
+def pearson(x, y):
+	# |r| of every column of x against y
+	return np.abs(_signed_pearson(x, y))
+
+def pearson_bits(bits, y, weights):
+	# |r| of every candidate from the bit covariance: cov(field, y) = w . cov(bits, y), var(field) = w C w,
+	# so no candidate value is ever materialised
+	bc = bits - bits.mean(axis=0)
+	yc = y - y.mean()
+	cov = bc.T.dot(bc)
+	num = weights.dot(bc.T.dot(yc))
+	var = np.einsum('ij,jk,ik->i', weights, cov, weights)
+	with np.errstate(divide='ignore', invalid='ignore'):
+		r = np.abs(num) / np.sqrt(var * yc.dot(yc))
+	return np.nan_to_num(r)
+
+def _quantize(x, bins):
+	lo = x.min(axis=0)
+	span = x.max(axis=0) - lo
+	span[span == 0] = 1
+	return np.minimum(((x - lo) / span * bins).astype(np.intp), bins - 1)
+
+def mutual_information(x, y, bins=MI_BINS):
+	# mutual information (bits) of every column of x with y from equal width bins, one bincount per block
+	n, cols = x.shape
+	xq = _quantize(x, bins)
+	yq = _quantize(y[:, None], bins)
+	joint = np.bincount((np.arange(cols)[None, :] * bins * bins + xq * bins + yq).ravel(), minlength=cols * bins * bins)
+	joint = joint.reshape(cols, bins, bins) / float(n)
+	px = joint.sum(axis=2, keepdims=True)
+	py = joint.sum(axis=1, keepdims=True)
+	with np.errstate(divide='ignore', invalid='ignore'):
+		terms = joint * np.log2(joint / (px * py))
+	return np.nan_to_num(terms).sum(axis=(1, 2))
+
+def best_lags(x, y, max_lag):
+	# (lag in samples, r at that lag) per column of x, lag > 0 means x follows y. each lag is a pearson r over
+	# the samples that overlap at that lag
+	n = len(y)
+	best_lag = np.zeros(x.shape[1], dtype=np.int64)
+	best_r = np.zeros(x.shape[1])
+	for lag in range(-max_lag, max_lag + 1):
+		if abs(lag) >= n - 2:
+			continue
+		if lag >= 0:
+			r = _signed_pearson(x[lag:], y[:n - lag])
+		else:
+			r = _signed_pearson(x[:n + lag], y[-lag:])
+		better = np.abs(r) > np.abs(best_r)
+		best_lag[better] = lag
+		best_r[better] = r[better]
+	return best_lag, best_r
+
+### per id worker ###
+_shared = {}
+
+def _init(grid, ref, settings):
+	_shared['grid'] = grid
+	_shared['ref'] = ref
+	_shared['settings'] = settings
+
+def correlate_id(job):
+	# [(score, bus, id, candidate, lag seconds, r at lag)] for the best candidates of one id
+	bus, ident, times, data, dlc = job
+	grid, ref, settings = _shared['grid'], _shared['ref'], _shared['settings']
+
+	order = np.argsort(times, kind='stable')
+	rows = can_resample.hold_index(times[order], grid)
+	valid = rows >= 0
+	if np.count_nonzero(valid) < MIN_POINTS:
+		return []
+	# zero order hold: every grid point takes the latest frame at or before it
+	sampled = data[order][rows[valid]]
+	y = ref[valid]
+
+	cands = candidates(dlc, settings['lengths'])
+	if settings['metric'] == 'mi':
+		table = compile_candidates(cands)
+		scores = np.zeros(len(cands))
+		for lo in range(0, len(cands), BLOCK):
+			scores[lo:lo + BLOCK] = mutual_information(extract(sampled, table, lo, lo + BLOCK), y)
+	else:
+		bits = np.unpackbits(np.ascontiguousarray(sampled, dtype='>u8').view(np.uint8).reshape(-1, 8), axis=1, bitorder='little')
+		scores = pearson_bits(bits.astype(np.float64), y, bit_weights(cands))
+
+	best = np.argsort(-scores, kind='stable')[:settings['keep']]
+	best = best[scores[best] > 0]
+	if len(best) == 0:
+		return []
+	picked = [cands[k] for k in best.tolist()]
+	lags, lag_r = best_lags(extract(sampled, compile_candidates(picked)), y, settings['max_lag'])
+	period = grid[1] - grid[0] if len(grid) > 1 else 0.0
+	return [(scores[k], bus, ident, cand, lag * period, r)
+		for k, cand, lag, r in zip(best.tolist(), picked, lags.tolist(), lag_r.tolist())]
+
+def correlate(path, reference, definitions, spec='*', rate=DEFAULT_RATE, metric='pearson', lengths=DEFAULT_LENGTHS,
+		max_lag=2.0, keep=5, processes=None, min_frames=MIN_POINTS):
+	ref = can_resample.decode_series(path, [reference], definitions)[reference]
+	if len(ref.times) < 2:
+		raise ValueError('reference %s has fewer than two samples' % reference)
+	grid = can_resample.uniform_grid([ref], rate)
+	ref = can_resample.hold(ref, grid)
+	settings = {'metric': metric, 'lengths': lengths, 'max_lag': int(round(max_lag * rate)), 'keep': keep}
+
+	index = can_index.load_index(path)
+	slots = np.flatnonzero(can_filter.IdFilter.from_spec(spec).mask(index.buses, index.ids) & (index.count >= min_frames))
+	dlcs = [int(np.flatnonzero(index.dlc_hist[slot]).max()) for slot in slots.tolist()]
+	jobs = ((bus, ident, frames['time'], frames['data'], dlc)
+		for (bus, ident, frames), dlc in zip(can_index.iter_slot_frames(path, index, slots), dlcs))
+
+	if processes == 1:
+		_init(grid, ref, settings)
+		results = [correlate_id(job) for job in jobs]
+	else:
+		pool = multiprocessing.Pool(processes, _init, (grid, ref, settings))
+		try:
+			results = list(pool.imap_unordered(correlate_id, jobs))
+		finally:
+			pool.close()
+			pool.join()
+
+	ranked = [row for result in results for row in result]
+	ranked.sort(key=lambda row: -row[0])
+	return ranked
+
+def print_ranking(ranked, metric, top=25):
+	print('rank  bus  id          field          %-8s lag (s)  r at lag' % ('mi' if metric == 'mi' else '|r|'))
+	for rank, (score, bus, ident, cand, lag, r) in enumerate(ranked[:top]):
+		print('%-5d %-4d %-11s %-14s %-8.4f %-8.2f %.4f' % (rank + 1, bus, hex(ident), candidate_name(cand), score, lag, r))
+
+def parse_args():
+	arg_parser = argparse.ArgumentParser(description='rank candidate fields of every id by correlation with a reference signal')
+	arg_parser.add_argument('-i', '--input', required=True, help='csv or binary log, or directory of segments')
+	arg_parser.add_argument('-r', '--reference', required=True, help='decoded reference signal e.g. <veh_speed>, <ford_ws_lf>')
+	arg_parser.add_argument('-d', '--definitions', required=False, nargs='+', default=['tesla_model_s', 'ford_f150'], help='signal definition files (.dbc / .yaml) or names of bundled ones in signals/')
+	arg_parser.add_argument('-S', '--select', required=False, default='*', help='ids to scan e.g. <0:0x100-0x3ff,!0x155> (see can_filter.py)')
+	arg_parser.add_argument('-m', '--metric', required=False, default='pearson', choices=['pearson', 'mi'], help='|pearson r| or mutual information')
+	arg_parser.add_argument('-f', '--rate', required=False, default=DEFAULT_RATE, type=float, help='common time base (Hz)')
+	arg_parser.add_argument('-l', '--lengths', required=False, default=list(DEFAULT_LENGTHS), type=int, nargs=2, help='shortest and longest field (bits)')
+	arg_parser.add_argument('-L', '--lag', required=False, default=2.0, type=float, help='largest lag (s) searched for the best fields')
+	arg_parser.add_argument('-k', '--top', required=False, default=25, type=int, help='fields listed')
+	arg_parser.add_argument('-p', '--processes', required=False, default=None, type=int, help='worker processes, defaults to one per cpu')
+	return arg_parser.parse_args()
+
+def main():
+	args = parse_args()
+	definitions = []
+	for path in args.definitions:
+		definitions += can_decode.load_definitions(path)
+	ranked = correlate(args.input, args.reference, definitions, args.select, args.rate, args.metric, tuple(args.lengths),
+		args.lag, processes=args.processes)
+	print_ranking(ranked, args.metric, args.top)
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+
+### vectorized signal extraction
+### decodes one signal for every matching frame of a batch in a single numpy expression instead of slicing hex strings per row
+### signal definitions come from dbc or yaml files (bundled ones live in signals/) and are compiled into a per id DecodeTable
+
+import collections
+import os
+import re
+import numpy as np
+import yaml
+
+BUNDLED_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'signals')
+
+### signal layout ###
+# shift / mask are applied to the payload as a uint64:
+#   big endian    -> payload read with byte 0 as the most significant byte (the hex string in the csv log)
+#   little endian -> payload read with byte 0 as the least significant byte, so shift is the intel start bit
+# signed is False, True (two's complement), 'ones' (ones' complement) or an explicit (threshold, modulus) wrap
+# physical value = raw * scale + offset
+# mux is None or (shift, mask, little_endian, value) of the multiplexor the signal depends on
+Signal = collections.namedtuple('Signal', ['name', 'ident', 'shift', 'mask', 'little_endian', 'signed', 'scale', 'offset', 'bus', 'mux'])
+
+def signal(name, ident, shift, mask, little_endian=False, signed=False, scale=1.0, offset=0.0, bus=None, mux=None):
+	return Signal(name, ident, shift, mask, little_endian, signed, scale, offset, bus, mux)
+
+def bits(length):
+	return (1 << length) - 1
+
+def layout(start, length, little_endian):
+	# dbc start bit -> (shift, mask). intel start is the lsb, motorola start is the msb counted byte * 8 + bit
+	if little_endian:
+		return start, bits(length)
+	msb = (7 - start // 8) * 8 + start % 8
+	return msb - length + 1, bits(length)
+
+def dbc_start(shift, length, little_endian):
+	# inverse of layout: (shift, length) -> dbc start bit
+	if little_endian:
+		return shift
+	msb = shift + length - 1
+	return (7 - msb // 8) * 8 + msb % 8
+
+def _sign_params(sig):
+	if sig.signed is False or sig.signed is None:
+		return None
+	if isinstance(sig.signed, (tuple, list)):
+		return sig.signed
+	length = int(sig.mask).bit_length()
+	if sig.signed == 'ones':
+		return (bits(length - 1), bits(length))
+	return (bits(length - 1), 1 << length)
+
+### extraction ###
+def payload_words(payloads, little_endian):
+	words = np.ascontiguousarray(payloads, dtype='>u8')
+	if little_endian:
+		# same 8 bytes read the other way round, no copy
+		return words.view('<u8')
+	return words
+
+def decode(payloads, sig):
+	raw = (payload_words(payloads, sig.little_endian) >> np.uint64(sig.shift)) & np.uint64(sig.mask)
+	raw = raw.astype(np.float64)
+
+	wrap = _sign_params(sig)
+	if wrap is not None:
+		threshold, modulus = wrap
+		raw = np.where(raw > threshold, raw - modulus, raw)
+
+	return raw * sig.scale + sig.offset
+
+def select(ids, payloads, sig, buses=None):
+	sel = ids == sig.ident
+	if sig.bus is not None and buses is not None:
+		sel &= buses == sig.bus
+	if sig.mux is not None:
+		shift, mask, little_endian, value = sig.mux
+		sel &= ((payload_words(payloads, little_endian) >> np.uint64(shift)) & np.uint64(mask)) == value
+	return np.flatnonzero(sel)
+
+def extract(ids, payloads, sig, buses=None):
+	# row indices of the frames carrying sig and their decoded values
+	rows = select(ids, payloads, sig, buses)
+	return rows, decode(payloads[rows], sig)
+
+def extract_frames(frames, sig):
+	return extract(frames['id'], frames['data'], sig, frames['bus'])
+
+### compiled decode table ###
+# every signal of an id is decoded together as one (frames x signals) array, and frames are grouped
+# by id once per batch, so the cost follows the frames in the log rather than the definitions loaded
+class DecodeTable():
+	def __init__(self, signals):
+		self.signals = list(signals)
+		by_id = collections.OrderedDict()
+		for sig in self.signals:
+			by_id.setdefault(sig.ident, []).append(sig)
+
+		self.ids = np.array(sorted(by_id), dtype=np.uint32)
+		self.entries = [self._compile(by_id[ident]) for ident in self.ids.tolist()]
+
+	@staticmethod
+	def _compile(sigs):
+		wraps = [_sign_params(sig) or (np.inf, 0) for sig in sigs]
+		muxes = [sig.mux or (0, 0, False, -1) for sig in sigs]
+		return {
+			'names': [sig.name for sig in sigs],
+			'shift': np.array([sig.shift for sig in sigs], dtype=np.uint64),
+			'mask': np.array([sig.mask for sig in sigs], dtype=np.uint64),
+			'le': np.array([bool(sig.little_endian) for sig in sigs]),
+			'threshold': np.array([w[0] for w in wraps], dtype=np.float64),
+			'modulus': np.array([w[1] for w in wraps], dtype=np.float64),
+			'scale': np.array([sig.scale for sig in sigs], dtype=np.float64),
+			'offset': np.array([sig.offset for sig in sigs], dtype=np.float64),
+			'bus': np.array([-1 if sig.bus is None else sig.bus for sig in sigs], dtype=np.int16),
+			'mux_shift': np.array([m[0] for m in muxes], dtype=np.uint64),
+			'mux_mask': np.array([m[1] for m in muxes], dtype=np.uint64),
+			'mux_le': np.array([bool(m[2]) for m in muxes]),
+			'mux_value': np.array([m[3] for m in muxes], dtype=np.int64),
+		}
+
+	@staticmethod
+	def _raw(words_be, le, shift, mask):
+		words = np.where(le[None, :], words_be.view('<u8')[:, None], words_be[:, None])
+		return (words >> shift[None, :]) & mask[None, :]
+
+	def decode_group(self, entry, payloads, buses):
+		words = np.ascontiguousarray(payloads, dtype='>u8')
+		raw = self._raw(words, entry['le'], entry['shift'], entry['mask']).astype(np.float64)
+		raw = np.where(raw > entry['threshold'], raw - entry['modulus'], raw)
+		values = raw * entry['scale'] + entry['offset']
+
+		valid = (entry['bus'] < 0) | (buses.astype(np.int16)[:, None] == entry['bus'])
+		if (entry['mux_value'] >= 0).any():
+			mux = self._raw(words, entry['mux_le'], entry['mux_shift'], entry['mux_mask']).astype(np.int64)
+			valid &= (entry['mux_value'] < 0) | (mux == entry['mux_value'])
+		return values, valid
+
+	def decode(self, frames, offset=0):
+		# {name: (rows, values)} for every defined signal present in frames
+		out = {}
+		if len(self.ids) == 0 or len(frames) == 0:
+			return out
+
+		ids = frames['id']
+		pos = np.minimum(np.searchsorted(self.ids, ids), len(self.ids) - 1)
+		rows = np.flatnonzero(self.ids[pos] == ids)
+		rows = rows[np.argsort(pos[rows], kind='stable')]
+		groups, starts = np.unique(pos[rows], return_index=True)
+		ends = np.append(starts[1:], len(rows))
+
+		for group, start, end in zip(groups.tolist(), starts.tolist(), ends.tolist()):
+			entry = self.entries[group]
+			grows = rows[start:end]
+			values, valid = self.decode_group(entry, frames['data'][grows], frames['bus'][grows])
+			for j, name in enumerate(entry['names']):
+				keep = valid[:, j]
+				out[name] = (grows[keep] + offset, values[keep, j])
+		return out
+
+### streaming accumulation ###
+class BatchDecoder():
+	def __init__(self, signals):
+		self.table = DecodeTable(signals)
+		self.signals = self.table.signals
+		self.rows = dict((sig.name, []) for sig in self.signals)
+		self.times = dict((sig.name, []) for sig in self.signals)
+		self.values = dict((sig.name, []) for sig in self.signals)
+		self.offset = 0
+
+	def add(self, frames):
+		for name, (rows, values) in self.table.decode(frames, self.offset).items():
+			if len(rows):
+				self.rows[name].append(rows)
+				self.times[name].append(frames['time'][rows - self.offset])
+				self.values[name].append(values)
+		self.offset += len(frames)
+
+	def series(self, name):
+		if not self.rows.get(name):
+			return np.zeros(0, dtype=np.int64), np.zeros(0)
+		return np.concatenate(self.rows[name]), np.concatenate(self.values[name])
+
+	def timeseries(self, name):
+		# (times, values) sample points of one signal (see can_resample.py)
+		if not self.times.get(name):
+			return np.zeros(0), np.zeros(0)
+		return np.concatenate(self.times[name]), np.concatenate(self.values[name])
+
+### definition files ###
+def _ident(value):
+	if isinstance(value, str):
+		return int(value, 0)
+	return int(value)
+
+def _signedness(value):
+	if value in (None, False, 'unsigned'):
+		return False
+	if value in (True, 'signed', 'twos'):
+		return True
+	return value
+
+def load_yaml(path):
+	# messages: {id: {bus, multiplexer, signals: {name: {start, length, byte_order, signed, scale, offset, mux, wrap}}}}
+	# a message may carry only a checksum entry (see can_checksum.py) and no signals
+	with open(path) as f:
+		spec = yaml.safe_load(f)
+
+	signals = []
+	for ident, message in spec['messages'].items():
+		ident = _ident(ident)
+		defs = message.get('signals', {})
+
+		mux_name = message.get('multiplexer')
+		mux_layout = None
+		if mux_name is not None:
+			m = defs[mux_name]
+			little_endian = m.get('byte_order', 'little_endian') == 'little_endian'
+			mux_layout = layout(m['start'], m['length'], little_endian) + (little_endian,)
+
+		for name, d in defs.items():
+			little_endian = d.get('byte_order', 'little_endian') == 'little_endian'
+			shift, mask = layout(d['start'], d['length'], little_endian)
+			signed = _signedness(d.get('signed'))
+			if 'wrap' in d:
+				signed = tuple(d['wrap'])
+			mux = None
+			if 'mux' in d and mux_layout is not None:
+				mux = mux_layout + (int(d['mux']),)
+			signals.append(signal(name, ident, shift, mask, little_endian, signed,
+				float(d.get('scale', 1.0)), float(d.get('offset', 0.0)), d.get('bus', message.get('bus')), mux))
+	return signals
+
+_DBC_MESSAGE = re.compile(r'^BO_\s+(\d+)\s+\w+\s*:')
+_DBC_SIGNAL = re.compile(r'^SG_\s+(\w+)\s*(M|m\d+)?\s*:\s*(\d+)\|(\d+)@([01])([+-])\s*\(([^,]+),([^)]+)\)')
+
+def load_dbc(path, bus=None):
+	signals = []
+	ident = None
+	pending = []
+
+	def close_message():
+		mux = [p for p in pending if p[1] == 'M']
+		mux_layout = None
+		if mux:
+			_, _, start, length, little_endian, _, _, _ = mux[0]
+			mux_layout = layout(start, length, little_endian) + (little_endian,)
+		for name, mux_tag, start, length, little_endian, signed, scale, offset in pending:
+			shift, mask = layout(start, length, little_endian)
+			sig_mux = None
+			if mux_tag and mux_tag != 'M' and mux_layout is not None:
+				sig_mux = mux_layout + (int(mux_tag[1:]),)
+			signals.append(signal(name, ident, shift, mask, little_endian, signed, scale, offset, bus, sig_mux))
+
+	with open(path) as f:
+		for line in f:
+			line = line.strip()
+			m = _DBC_MESSAGE.match(line)
+			if m:
+				if ident is not None:
+					close_message()
+				ident = int(m.group(1)) & 0x1fffffff # extended ids carry bit 31
+				pending = []
+				continue
+			m = _DBC_SIGNAL.match(line)
+			if m and ident is not None:
+				name, mux_tag, start, length, order, sign, scale, offset = m.groups()
+				pending.append((name, mux_tag, int(start), int(length), order == '1', sign == '-', float(scale), float(offset)))
+	if ident is not None:
+		close_message()
+	return signals
+
+def load_definitions(path):
+	if not os.path.exists(path) and os.path.exists(os.path.join(BUNDLED_DIR, path + '.yaml')):
+		path = os.path.join(BUNDLED_DIR, path + '.yaml')
+	if path.lower().endswith('.dbc'):
+		return load_dbc(path)
+	return load_yaml(path)
+
+def bundled():
+	return sorted(f[:-len('.yaml')] for f in os.listdir(BUNDLED_DIR) if f.endswith('.yaml'))
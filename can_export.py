@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+
+### columnar export of raw frames and decoded signals
+### a log is written as hive style partitions, so later analysis reads only the vehicles, ids, signals and time
+### ranges it needs instead of re-running the parser:
+###   <root>/vehicle=<v>/frames/bus=<b>/id=<0x155>/<log>.<ext>   time, dlc, data (left aligned uint64 payload)
+###   <root>/vehicle=<v>/signals/id=<0x155>/<log>.<ext>          time, bus, one column per signal of the id
+### signal columns are NaN on frames a signal is not carried by (other bus, other multiplexor value). rows are time
+### sorted and written in row groups of ROW_GROUP rows, whose time min / max let a reader skip whole groups.
+### parquet and arrow ipc (feather v2) need pyarrow, without it a partition file is a <log>.npz directory holding one
+### <k>_<time min>_<time max>.npz file per row group, one array per column
+
+import argparse
+import collections
+import glob
+import os
+import numpy as np
+import can_decode
+import can_log
+
+try:
+	import pyarrow
+	import pyarrow.ipc
+	import pyarrow.parquet
+except ImportError:
+	pyarrow = None
+
+ROW_GROUP = 65536
+FORMATS = {'parquet': '.parquet', 'arrow': '.arrow', 'npz': '.npz'}
+
+def default_format():
+	return 'parquet' if pyarrow is not None else 'npz'
+
+def _id_dir(ident):
+	return 'id=%s' % hex(ident)
+
+def frames_dir(root, vehicle, bus, ident):
+	return os.path.join(root, 'vehicle=%s' % vehicle, 'frames', 'bus=%d' % bus, _id_dir(ident))
+
+def signals_dir(root, vehicle, ident):
+	return os.path.join(root, 'vehicle=%s' % vehicle, 'signals', _id_dir(ident))
+
+### partition files ###
+class PartitionWriter():
+	# one partition file, columns buffered until a row group is full. npz cannot be appended to, so each row group
+	# goes to a file of its own
+	def __init__(self, path, fmt, row_group=ROW_GROUP):
+		self.path = path
+		self.fmt = fmt
+		self.row_group = row_group
+		self.parts = []
+		self.buffered = 0
+		self.writer = None
+		self.groups = 0
+		self.rows = 0
+
+	def append(self, columns):
+		self.parts.append(columns)
+		self.buffered += len(columns['time'])
+		if self.buffered >= self.row_group:
+			self.flush()
+
+	def _take(self):
+		columns = collections.OrderedDict((name, np.concatenate([p[name] for p in self.parts])) for name in self.parts[0])
+		order = np.argsort(columns['time'], kind='stable')
+		self.parts = []
+		self.buffered = 0
+		return collections.OrderedDict((name, values[order]) for name, values in columns.items())
+
+	def flush(self, final=False):
+		# whole row groups only, the rest waits for more rows unless this is the last flush
+		if not self.parts:
+			return
+		columns = self._take()
+		if not final:
+			full = len(columns['time']) - len(columns['time']) % self.row_group
+			rest = collections.OrderedDict((name, values[full:]) for name, values in columns.items())
+			if len(rest['time']):
+				self.parts = [rest]
+				self.buffered = len(rest['time'])
+			columns = collections.OrderedDict((name, values[:full]) for name, values in columns.items())
+		self.rows += len(columns['time'])
+		if self.fmt == 'npz':
+			self._write_npz(columns)
+			return
+		table = pyarrow.table(columns)
+		if self.writer is None:
+			directory = os.path.dirname(self.path)
+			if not os.path.isdir(directory):
+				os.makedirs(directory)
+			if self.fmt == 'parquet':
+				self.writer = pyarrow.parquet.ParquetWriter(self.path, table.schema)
+			else:
+				self.writer = pyarrow.ipc.new_file(self.path, table.schema)
+		if self.fmt == 'parquet':
+			self.writer.write_table(table, row_group_size=self.row_group)
+		else:
+			self.writer.write_table(table, max_chunksize=self.row_group)
+
+	def _write_npz(self, columns):
+		if not os.path.isdir(self.path):
+			os.makedirs(self.path)
+		elif self.groups == 0:
+			# a re-export replaces the row groups of an earlier one, as the single file formats are overwritten
+			for old in glob.glob(os.path.join(self.path, '*.npz')):
+				os.remove(old)
+		for k in range(0, len(columns['time']), self.row_group):
+			group = collections.OrderedDict((name, values[k:k + self.row_group]) for name, values in columns.items())
+			times = group['time']
+			with open(os.path.join(self.path, '%d_%r_%r.npz' % (self.groups, float(times[0]), float(times[-1]))), 'wb') as f:
+				np.savez(f, **group)
+			self.groups += 1
+
+	def close(self):
+		self.flush(final=True)
+		if self.writer is not None:
+			self.writer.close()
+
+class Exporter():
+	# feed every batch of one log to add, then close
+	def __init__(self, root, vehicle, name, definitions=(), fmt=None, frames=True, row_group=ROW_GROUP):
+		self.root = root
+		self.vehicle = vehicle
+		self.name = name
+		self.fmt = fmt or default_format()
+		if self.fmt != 'npz' and pyarrow is None:
+			raise ValueError('%s export needs pyarrow, use npz' % self.fmt)
+		self.table = can_decode.DecodeTable(definitions)
+		self.frames = frames
+		self.row_group = row_group
+		self.writers = {}
+
+	def _writer(self, directory):
+		path = os.path.join(directory, self.name + FORMATS[self.fmt])
+		if path not in self.writers:
+			self.writers[path] = PartitionWriter(path, self.fmt, self.row_group)
+		return self.writers[path]
+
+	def add(self, frames):
+		if len(frames) == 0:
+			return
+		keys = (frames['bus'].astype(np.int64) << 32) | frames['id']
+		order = np.argsort(keys, kind='stable')
+		uniq, starts = np.unique(keys[order], return_index=True)
+		ends = np.append(starts[1:], len(order))
+
+		if self.frames:
+			for key, start, end in zip(uniq.tolist(), starts.tolist(), ends.tolist()):
+				rows = order[start:end]
+				self._writer(frames_dir(self.root, self.vehicle, key >> 32, key & 0xffffffff)).append(collections.OrderedDict([
+					('time', frames['time'][rows]),
+					('dlc', frames['dlc'][rows]),
+					('data', frames['data'][rows].astype(np.uint64))]))
+
+		decoded = self.table.decode(frames)
+		if not decoded:
+			return
+		for ident, entry in zip(self.table.ids.tolist(), self.table.entries):
+			rows = np.flatnonzero(frames['id'] == ident)
+			if len(rows) == 0:
+				continue
+			columns = collections.OrderedDict([('time', frames['time'][rows]), ('bus', frames['bus'][rows])])
+			for name in entry['names']:
+				sig_rows, values = decoded.get(name, ((), ()))
+				column = np.full(len(rows), np.nan)
+				column[np.searchsorted(rows, sig_rows)] = values
+				columns[name] = column
+			self._writer(signals_dir(self.root, self.vehicle, ident)).append(columns)
+
+	def close(self):
+		for writer in self.writers.values():
+			writer.close()
+		return len(self.writers)
+
+def export_log(path, root, vehicle, definitions=(), fmt=None, frames=True, row_group=ROW_GROUP, chunk_size=can_log.DEFAULT_CHUNK):
+	name = os.path.splitext(os.path.basename(path.rstrip(os.sep)))[0]
+	exporter = Exporter(root, vehicle, name, definitions, fmt, frames, row_group)
+	for batch in can_log.iter_frames(path, chunk_size):
+		exporter.add(batch)
+	return exporter.close()
+
+### reading back ###
+def _read_file(path, columns, start, end):
+	# {column: array} of one partition file, row groups / batches entirely outside [start, end] are skipped
+	if os.path.isdir(path):
+		parts = []
+		for name in os.listdir(path):
+			k, first, last = name[:-len('.npz')].split('_')
+			if (start is not None and float(last) < start) or (end is not None and float(first) > end):
+				continue
+			with np.load(os.path.join(path, name)) as z:
+				if any(c not in z.files for c in columns):
+					return None
+				parts.append((int(k), dict((c, z[c]) for c in columns)))
+		if not parts:
+			return dict((c, np.zeros(0)) for c in columns)
+		parts = [p for _, p in sorted(parts, key=lambda part: part[0])]
+		return dict((c, np.concatenate([p[c] for p in parts])) for c in columns)
+
+	if path.endswith('.npz'):
+		with np.load(path) as z:
+			if any(c not in z.files for c in columns):
+				return None
+			return dict((c, z[c]) for c in columns)
+
+	if path.endswith('.parquet'):
+		f = pyarrow.parquet.ParquetFile(path)
+		names = f.schema_arrow.names
+		if any(c not in names for c in columns):
+			return None
+		time_col = names.index('time')
+		groups = []
+		for k in range(f.num_row_groups):
+			stats = f.metadata.row_group(k).column(time_col).statistics
+			if stats is not None and stats.has_min_max:
+				if (start is not None and stats.max < start) or (end is not None and stats.min > end):
+					continue
+			groups.append(k)
+		table = f.read_row_groups(groups, columns=columns)
+		return dict((c, table.column(c).to_numpy()) for c in columns)
+
+	with pyarrow.memory_map(path) as source:
+		reader = pyarrow.ipc.open_file(source)
+		if any(c not in reader.schema.names for c in columns):
+			return None
+		parts = []
+		for k in range(reader.num_record_batches):
+			batch = reader.get_batch(k)
+			times = batch.column('time').to_numpy()
+			if len(times) == 0 or (start is not None and times[-1] < start) or (end is not None and times[0] > end):
+				continue
+			parts.append(dict((c, batch.column(c).to_numpy()) for c in columns))
+		if not parts:
+			return dict((c, np.zeros(0)) for c in columns)
+		return dict((c, np.concatenate([p[c] for p in parts])) for c in columns)
+
+def partition_files(root, kind='signals', vehicle=None, ident=None, bus=None):
+	parts = [root, 'vehicle=%s' % (vehicle or '*'), kind]
+	if kind == 'frames':
+		parts.append('bus=*' if bus is None else 'bus=%d' % bus)
+	parts.append('id=*' if ident is None else _id_dir(ident))
+	return sorted(f for ext in FORMATS.values() for f in glob.glob(os.path.join(*(parts + ['*' + ext]))))
+
+def read_columns(root, columns, kind='signals', vehicle=None, ident=None, bus=None, start=None, end=None):
+	# {column: array} of every partition file holding all of columns, time sorted and limited to [start, end]
+	columns = ['time'] + [c for c in columns if c != 'time']
+	parts = [part for part in (_read_file(path, columns, start, end) for path in partition_files(root, kind, vehicle, ident, bus)) if part]
+	if not parts:
+		return collections.OrderedDict((c, np.zeros(0)) for c in columns)
+	out = collections.OrderedDict((c, np.concatenate([p[c] for p in parts])) for c in columns)
+	keep = np.ones(len(out['time']), dtype=bool)
+	if start is not None:
+		keep &= out['time'] >= start
+	if end is not None:
+		keep &= out['time'] <= end
+	order = np.argsort(out['time'][keep], kind='stable')
+	return collections.OrderedDict((c, values[keep][order]) for c, values in out.items())
+
+def read_signals(root, names, vehicle=None, start=None, end=None):
+	# {name: (times, values)} sample points of decoded signals, whichever ids carry them
+	out = collections.OrderedDict()
+	for name in names:
+		columns = read_columns(root, [name], 'signals', vehicle, start=start, end=end)
+		carried = ~np.isnan(columns[name])
+		out[name] = (columns['time'][carried], columns[name][carried])
+	return out
+
+def parse_args():
+	arg_parser = argparse.ArgumentParser(description='export raw frames and decoded signals of PandaLogger logs to partitioned columnar files')
+	arg_parser.add_argument('-i', '--input', required=True, nargs='+', help='csv or binary logs, or directories of segments')
+	arg_parser.add_argument('-o', '--output', required=True, help='dataset root directory')
+	arg_parser.add_argument('-V', '--vehicle', required=False, default=None, help='vehicle partition, defaults to the name of the directory holding each log')
+	arg_parser.add_argument('-d', '--definitions', required=False, nargs='+', default=['tesla_model_s', 'ford_f150'], help='signal definition files (.dbc / .yaml) or names of bundled ones in signals/')
+	arg_parser.add_argument('-f', '--format', required=False, default=None, choices=sorted(FORMATS), help='file format, defaults to parquet when pyarrow is installed, npz otherwise')
+	arg_parser.add_argument('-g', '--row-group', required=False, default=ROW_GROUP, type=int, help='rows per row group')
+	arg_parser.add_argument('--no-frames', required=False, action='store_true', help='decoded signals only')
+	return arg_parser.parse_args()
+
+def main():
+	args = parse_args()
+	definitions = []
+	for path in args.definitions:
+		definitions += can_decode.load_definitions(path)
+	for path in args.input:
+		vehicle = args.vehicle or os.path.basename(os.path.dirname(os.path.abspath(path.rstrip(os.sep))))
+		files = export_log(path, args.output, vehicle, definitions, args.format, not args.no_frames, args.row_group)
+		print(path, '->', files, 'partition files for vehicle', vehicle)
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+
+### can id / bus selection
+### a spec is a comma separated list of terms, each optionally prefixed with '<bus>:' and negated with '!'
+###   0x155          one id
+###   0x200-0x2ff    inclusive id range
+###   0x100/0x700    id / mask pair, every id whose masked bits equal the id's (0x100..0x1ff here)
+###   *              every id
+### e.g. '0:0x155,0:0x200-0x2ff,1:*,!0x250' -> 0x155 and 0x200..0x2ff from bus 0, everything from bus 1, never 0x250
+### a frame passes when it matches any include term and no exclude term (only exclusions -> everything else passes)
+### specs compile into a dense (bus, id) lookup for standard ids so the per frame check is a single table read
+### include terms can also be pushed down to the kernel as CAN_RAW_FILTER (id, mask) pairs, each id range split into
+### aligned power of two blocks, so a socket never wakes for ids nothing asked for. the kernel ors its filters and
+### has no 'except', so exclusions stay a user space check on what it lets through. the same pairs go to python-can
+### as can_filters, and whatever no backend takes over is checked per frame by accept(), a set / table lookup
+
+import collections
+import struct
+import numpy as np
+
+MAX_STD_ID = 0x7ff
+MAX_EXT_ID = 0x1fffffff
+NUM_BUSES = 256
+
+# linux/can.h, linux/can/raw.h
+CAN_EFF_FLAG = 0x80000000
+CAN_RTR_FLAG = 0x40000000
+CAN_RAW_FILTER_MAX = 512
+CAN_FILTER = struct.Struct('=II')
+
+Term = collections.namedtuple('Term', ['bus', 'lo', 'hi', 'exclude', 'mask'])
+Term.__new__.__defaults__ = (None,) # mask terms match (id & mask) == lo, lo == hi
+
+# at most this many (bus, id) pairs are kept as a python set by accept(), wider filters use the table rows
+SET_LOOKUP_MAX = 4096
+
+def parse_term(text):
+	text = text.strip()
+	exclude = text.startswith('!')
+	if exclude:
+		text = text[1:].strip()
+
+	bus = None
+	if ':' in text:
+		bus, text = text.split(':', 1)
+		bus = int(bus, 0)
+		text = text.strip()
+
+	if '/' in text:
+		value, mask = [int(x, 0) for x in text.split('/', 1)]
+		return Term(bus, value & mask, value & mask, exclude, mask & MAX_EXT_ID)
+	if text == '*':
+		lo, hi = 0, MAX_EXT_ID
+	elif '-' in text:
+		lo, hi = [int(x, 0) for x in text.split('-', 1)]
+	else:
+		lo = hi = int(text, 0)
+	if lo > hi:
+		raise ValueError('empty id range: %s' % text)
+	return Term(bus, lo, hi, exclude)
+
+def parse_spec(spec):
+	return [parse_term(t) for t in spec.split(',') if t.strip()]
+
+def parse_remap(spec, default=0):
+	# '0:1,1:2' -> source bus to target bus table, unlisted buses go to default
+	bus_map = np.full(NUM_BUSES, default, dtype=np.uint8)
+	for pair in (spec or '').split(','):
+		if pair.strip():
+			src, dst = pair.split(':')
+			bus_map[int(src, 0)] = int(dst, 0)
+	return bus_map
+
+def id_blocks(lo, hi):
+	# fewest (value, mask) pairs whose matches are exactly lo..hi
+	blocks = []
+	while lo <= hi:
+		size = lo & -lo if lo else 1 << 29
+		while size > hi - lo + 1:
+			size >>= 1
+		blocks.append((lo, MAX_EXT_ID & ~(size - 1)))
+		lo += size
+	return blocks
+
+def socketcan_filters(terms, bus=None):
+	# CAN_RAW_FILTER (can_id, can_mask) pairs for the socket of bus, None when the kernel cannot narrow it down
+	# (no include terms, or more blocks than it takes). ids are matched on their number whatever the frame format
+	includes = [t for t in terms if not t.exclude]
+	if not includes:
+		return None
+	filters = []
+	for term in includes:
+		if term.bus is not None and bus is not None and term.bus != bus:
+			continue
+		if term.mask is not None:
+			if term.lo <= MAX_STD_ID:
+				filters.append((term.lo, (term.mask & MAX_STD_ID) | CAN_EFF_FLAG | CAN_RTR_FLAG))
+			filters.append((term.lo | CAN_EFF_FLAG, term.mask | CAN_EFF_FLAG | CAN_RTR_FLAG))
+			continue
+		if term.lo <= MAX_STD_ID:
+			for value, mask in id_blocks(term.lo, min(term.hi, MAX_STD_ID)):
+				filters.append((value, (mask & MAX_STD_ID) | CAN_EFF_FLAG | CAN_RTR_FLAG))
+		for value, mask in id_blocks(term.lo, term.hi):
+			filters.append((value | CAN_EFF_FLAG, mask | CAN_EFF_FLAG | CAN_RTR_FLAG))
+	if len(filters) > CAN_RAW_FILTER_MAX:
+		return None
+	return filters
+
+def python_can_filters(terms, bus=None):
+	# the same pairs as python-can can_filters, None where socketcan_filters is None
+	filters = socketcan_filters(terms, bus)
+	if filters is None:
+		return None
+	return [{'can_id': can_id & MAX_EXT_ID, 'can_mask': can_mask & MAX_EXT_ID, 'extended': bool(can_id & CAN_EFF_FLAG)} for can_id, can_mask in filters]
+
+def pack_socketcan_filters(filters):
+	# setsockopt(SOL_CAN_RAW, CAN_RAW_FILTER, ...) value, empty means no frames at all
+	return b''.join(CAN_FILTER.pack(can_id, can_mask) for can_id, can_mask in filters)
+
+class IdFilter():
+	def __init__(self, terms):
+		self.terms = list(terms)
+		self.includes = [t for t in self.terms if not t.exclude]
+		self.excludes = [t for t in self.terms if t.exclude]
+
+		buses = np.repeat(np.arange(NUM_BUSES), MAX_STD_ID + 1)
+		ids = np.tile(np.arange(MAX_STD_ID + 1), NUM_BUSES)
+		self.table = self._evaluate(buses, ids).reshape(NUM_BUSES, MAX_STD_ID + 1)
+
+	@classmethod
+	def from_spec(cls, spec):
+		return cls(parse_spec(spec))
+
+	@staticmethod
+	def _term_mask(term, buses, ids):
+		if term.mask is not None:
+			sel = (ids & term.mask) == term.lo
+		else:
+			sel = (ids >= term.lo) & (ids <= term.hi)
+		if term.bus is not None:
+			sel &= buses == term.bus
+		return sel
+
+	def _evaluate(self, buses, ids):
+		if self.includes:
+			keep = np.zeros(len(ids), dtype=bool)
+			for term in self.includes:
+				keep |= self._term_mask(term, buses, ids)
+		else:
+			keep = np.ones(len(ids), dtype=bool)
+		for term in self.excludes:
+			keep &= ~self._term_mask(term, buses, ids)
+		return keep
+
+	def match(self, bus, ident):
+		if ident <= MAX_STD_ID:
+			return bool(self.table[bus, ident])
+		return bool(self._evaluate(np.array([bus]), np.array([ident]))[0])
+
+	def mask(self, buses, ids):
+		# vectorized match over a batch
+		buses = np.asarray(buses).astype(np.intp)
+		ids = np.asarray(ids).astype(np.int64)
+		std = ids <= MAX_STD_ID
+		keep = np.zeros(len(ids), dtype=bool)
+		keep[std] = self.table[buses[std], ids[std]]
+		if not std.all():
+			keep[~std] = self._evaluate(buses[~std], ids[~std])
+		return keep
+
+	def socketcan_filters(self, bus=None):
+		return socketcan_filters(self.terms, bus)
+
+	def python_can_filters(self, bus=None):
+		return python_can_filters(self.terms, bus)
+
+	@property
+	def extended(self):
+		# whether any extended id can pass
+		return any(t.hi > MAX_STD_ID or (t.mask is not None and t.mask <= MAX_STD_ID) for t in self.includes) or not self.includes
+
+	def accept(self):
+		# accept(bus, address) for per frame checks, a set lookup when few (bus, id) pairs pass, else table rows
+		if not self.extended:
+			buses, ids = np.nonzero(self.table)
+			if len(ids) <= SET_LOOKUP_MAX:
+				keys = frozenset(zip(buses.tolist(), ids.tolist()))
+				return lambda bus, address: (bus, address) in keys
+		rows = [row.tobytes() for row in self.table]
+		match = self.match
+		return lambda bus, address: bool(rows[bus][address]) if address <= MAX_STD_ID else match(bus, address)
+
+	def rows(self, index):
+		# resolved once per (bus, id) of a can_index.LogIndex rather than per frame
+		return index.select_slots(np.flatnonzero(self.mask(index.buses, index.ids)))
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+
+### sidecar frame index for PandaLogger logs
+### maps (bus, id) to the sorted rows carrying it plus per id counts, first / last timestamp and dlc histogram
+### built once per log as <log>.idx.npz and rebuilt whenever the log's size or mtime changes
+
+import argparse
+import os
+import numpy as np
+import can_log
+
+INDEX_SUFFIX = '.idx.npz'
+INDEX_VERSION = 1
+MAX_DLC = 8
+
+def index_path(path):
+	# segment directories get a sibling file rather than a file inside the directory
+	return path.rstrip(os.sep) + INDEX_SUFFIX
+
+def _log_stamp(path):
+	if can_log.is_segment_dir(path):
+		stats = [os.stat(seg.path) for seg in can_log.list_segments(path)]
+		return sum(st.st_size for st in stats), max([st.st_mtime_ns for st in stats] + [0])
+	st = os.stat(path)
+	return st.st_size, st.st_mtime_ns
+
+def _key(bus, ident):
+	return (np.asarray(bus, dtype=np.uint64) << np.uint64(32)) | np.asarray(ident, dtype=np.uint64)
+
+class LogIndex():
+	def __init__(self, keys, starts, rows, count, first_time, last_time, dlc_hist, size=0, mtime=0):
+		self.keys = keys
+		self.starts = starts
+		self.rows_all = rows
+		self.count = count
+		self.first_time = first_time
+		self.last_time = last_time
+		self.dlc_hist = dlc_hist
+		self.size = size
+		self.mtime = mtime
+
+	@property
+	def buses(self):
+		return (self.keys >> np.uint64(32)).astype(np.uint8)
+
+	@property
+	def ids(self):
+		return (self.keys & np.uint64(0xffffffff)).astype(np.uint32)
+
+	@property
+	def num_frames(self):
+		return len(self.rows_all)
+
+	def _slot(self, bus, ident):
+		key = int(_key(bus, ident))
+		pos = int(np.searchsorted(self.keys, key))
+		if pos < len(self.keys) and int(self.keys[pos]) == key:
+			return pos
+		return None
+
+	def rows(self, bus, ident):
+		pos = self._slot(bus, ident)
+		if pos is None:
+			return np.zeros(0, dtype=self.rows_all.dtype)
+		return self.rows_all[self.starts[pos]:self.starts[pos + 1]]
+
+	def slots(self, ids=None, buses=None):
+		keep = np.ones(len(self.keys), dtype=bool)
+		if ids is not None:
+			keep &= np.isin(self.ids, np.asarray(list(ids), dtype=np.uint32))
+		if buses is not None:
+			keep &= np.isin(self.buses, np.asarray(list(buses), dtype=np.uint8))
+		return np.flatnonzero(keep)
+
+	def select(self, ids=None, buses=None):
+		# sorted rows of every frame matching any of ids on any of buses (None means all)
+		return self.select_slots(self.slots(ids, buses))
+
+	def select_slots(self, slots):
+		parts = [self.rows_all[self.starts[s]:self.starts[s + 1]] for s in np.asarray(slots).tolist()]
+		if not parts:
+			return np.zeros(0, dtype=self.rows_all.dtype)
+		if len(parts) == 1:
+			return parts[0]
+		return np.sort(np.concatenate(parts), kind='mergesort')
+
+	def save(self, path):
+		with open(path, 'wb') as f:
+			np.savez(f, version=INDEX_VERSION, keys=self.keys, starts=self.starts, rows=self.rows_all,
+				count=self.count, first_time=self.first_time, last_time=self.last_time, dlc_hist=self.dlc_hist,
+				size=self.size, mtime=self.mtime)
+
+	@classmethod
+	def load(cls, path):
+		with np.load(path) as z:
+			if int(z['version']) != INDEX_VERSION:
+				raise ValueError('stale index version in %s' % path)
+			return cls(z['keys'], z['starts'], z['rows'], z['count'], z['first_time'], z['last_time'],
+				z['dlc_hist'], int(z['size']), int(z['mtime']))
+
+def build_index(path, chunk_size=can_log.DEFAULT_CHUNK):
+	# per key lists of row chunks, grouped one batch at a time
+	parts = {}
+	first = {}
+	last = {}
+	hist = {}
+	offset = 0
+
+	for frames in can_log.iter_frames(path, chunk_size):
+		keys = _key(frames['bus'], frames['id'])
+		order = np.argsort(keys, kind='stable')
+		uniq, starts = np.unique(keys[order], return_index=True)
+		ends = np.append(starts[1:], len(order))
+		times = frames['time']
+		dlcs = np.minimum(frames['dlc'], MAX_DLC)
+
+		for key, start, end in zip(uniq.tolist(), starts.tolist(), ends.tolist()):
+			rows = order[start:end]
+			parts.setdefault(key, []).append(rows + offset)
+			if key not in first:
+				first[key] = times[rows[0]]
+			last[key] = times[rows[-1]]
+			h = np.bincount(dlcs[rows], minlength=MAX_DLC + 1)
+			hist[key] = hist[key] + h if key in hist else h
+		offset += len(frames)
+
+	keys = np.array(sorted(parts), dtype=np.uint64)
+	row_dtype = np.uint32 if offset < 2 ** 32 else np.uint64
+	chunks = [np.concatenate(parts[k]).astype(row_dtype) for k in keys.tolist()]
+	count = np.array([len(c) for c in chunks], dtype=np.int64)
+	starts = np.concatenate([[0], np.cumsum(count)]).astype(np.int64)
+	rows = np.concatenate(chunks) if chunks else np.zeros(0, dtype=row_dtype)
+
+	size, mtime = _log_stamp(path)
+	return LogIndex(keys, starts, rows, count,
+		np.array([first[k] for k in keys.tolist()], dtype=np.float64),
+		np.array([last[k] for k in keys.tolist()], dtype=np.float64),
+		np.array([hist[k] for k in keys.tolist()], dtype=np.int64).reshape(-1, MAX_DLC + 1),
+		size, mtime)
+
+def load_index(path, chunk_size=can_log.DEFAULT_CHUNK, save=True):
+	# cached sidecar when it still matches the log, otherwise rebuild it
+	sidecar = index_path(path)
+	size, mtime = _log_stamp(path)
+	if os.path.exists(sidecar):
+		try:
+			index = LogIndex.load(sidecar)
+			if index.size == size and index.mtime == mtime:
+				return index
+		except (ValueError, KeyError, IOError):
+			pass
+
+	index = build_index(path, chunk_size)
+	if save:
+		try:
+			index.save(sidecar)
+		except IOError:
+			print('could not write index', sidecar)
+	return index
+
+def iter_selected_frames(path, rows, chunk_size=can_log.DEFAULT_CHUNK, on_batch=None):
+	# (rows, frames) batches for the given sorted rows
+	# binary logs are gathered straight from the memmap, csv logs still have to be streamed
+	if can_log.is_binary(path):
+		if on_batch is not None:
+			for frames in can_log.iter_frames(path, chunk_size):
+				on_batch(frames)
+		frames = can_log.open_bin(path)
+		for start in range(0, len(rows), chunk_size):
+			sel = rows[start:start + chunk_size]
+			yield sel, frames[sel]
+		return
+
+	offset = 0
+	for frames in can_log.iter_frames(path, chunk_size):
+		if on_batch is not None:
+			on_batch(frames)
+		lo, hi = np.searchsorted(rows, [offset, offset + len(frames)])
+		sel = rows[lo:hi]
+		if len(sel):
+			yield sel, frames[sel - offset]
+		offset += len(frames)
+
+def iter_selected(path, rows, chunk_size=can_log.DEFAULT_CHUNK, on_batch=None):
+	# (row, (time, bus, id, dlc, data)) for the given sorted rows
+	for sel, frames in iter_selected_frames(path, rows, chunk_size, on_batch):
+		for row in zip(sel.tolist(), frames.tolist()):
+			yield row
+
+def iter_slot_frames(path, index, slots, chunk_size=can_log.DEFAULT_CHUNK):
+	# (bus, id, frames) for every given slot of index, each in log order
+	# binary logs gather one slot at a time from the memmap, other logs are read once and split
+	if can_log.is_binary(path):
+		frames = can_log.open_bin(path)
+		for slot in np.asarray(slots).tolist():
+			key = int(index.keys[slot])
+			yield key >> 32, key & 0xffffffff, frames[index.rows_all[index.starts[slot]:index.starts[slot + 1]]]
+		return
+
+	parts = [frames for _, frames in iter_selected_frames(path, index.select_slots(slots), chunk_size)]
+	frames = np.concatenate(parts) if parts else np.zeros(0, dtype=can_log.FRAME_DTYPE)
+	keys = _key(frames['bus'], frames['id'])
+	order = np.argsort(keys, kind='stable')
+	uniq, starts = np.unique(keys[order], return_index=True)
+	ends = np.append(starts[1:], len(order))
+	for key, start, end in zip(uniq.tolist(), starts.tolist(), ends.tolist()):
+		yield key >> 32, key & 0xffffffff, frames[order[start:end]]
+
+def parse_args():
+	arg_parser = argparse.ArgumentParser(description='build / show the frame index of a PandaLogger log')
+	arg_parser.add_argument('-i', '--input', required=True, help='csv or binary log')
+	arg_parser.add_argument('-r', '--rebuild', required=False, action='store_true', help='ignore an existing sidecar index')
+	return arg_parser.parse_args()
+
+def main():
+	args = parse_args()
+	if args.rebuild:
+		index = build_index(args.input)
+		index.save(index_path(args.input))
+	else:
+		index = load_index(args.input)
+
+	print('frames: ', index.num_frames, ' ids: ', len(index.keys))
+	print('bus  id          count  first            last             hz       dlc histogram (0..8)')
+	for k in range(len(index.keys)):
+		span = index.last_time[k] - index.first_time[k]
+		rate = (index.count[k] - 1) / span if span > 0 else 0.0
+		print('%-4d %-10s %7d  %-16.3f %-16.3f %-8.1f %s' % (index.buses[k], hex(int(index.ids[k])), index.count[k],
+			index.first_time[k], index.last_time[k], rate, index.dlc_hist[k].tolist()))
+
+if __name__ == "__main__":
+	main()
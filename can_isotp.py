@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+
+### iso-tp (iso 15765-2) transport over any can_bus backend
+### a Session is one (tx id, rx id) pair on one bus with its receive buffer allocated once at full size, sessions are
+### found from an incoming frame with one dict lookup, and any number of them share one bus handle in an IsoTpStack
+###   single frame       0x0L data                   L = 1..7 bytes
+###   first frame        0x1L LL data                12 bit length, answered with a flow control
+###   consecutive frame  0x2N data                   N = sequence number mod 16
+###   flow control       0x3S BS ST                  S = 0 continue / 1 wait / 2 overflow, BS = frames per block
+###                                                  (0 = no limit), ST = minimum gap between frames (stmin)
+### sending honours the receiver's block size and stmin, receiving announces our own. timeouts follow N_Bs / N_Cr
+### responders not known in advance (every ecu answering a functional request) are taken in by accept rules, which
+### map an unknown rx id to the tx id of its session on first sight, the answer is cached either way
+
+import collections
+import time
+
+MAX_SIZE = 4095
+PADDING = 0x00
+TIMEOUT = 1.0
+
+SINGLE = 0x0
+FIRST = 0x1
+CONSECUTIVE = 0x2
+FLOW = 0x3
+
+CONTINUE = 0
+WAIT = 1
+OVERFLOW = 2
+
+class IsoTpError(Exception):
+	pass
+
+def st_min_seconds(value):
+	# 0x00..0x7f milliseconds, 0xf1..0xf9 100..900 microseconds, reserved values mean the longest gap
+	if value <= 0x7f:
+		return value / 1000.0
+	if 0xf1 <= value <= 0xf9:
+		return (value - 0xf0) / 10000.0
+	return 0.127
+
+def _pad(frame, padding):
+	if padding is None or len(frame) >= 8:
+		return bytes(frame)
+	return bytes(frame) + bytes([padding]) * (8 - len(frame))
+
+class Session():
+	def __init__(self, tx_id, rx_id, bus=0, block_size=0, st_min=0, max_size=MAX_SIZE, padding=PADDING):
+		self.tx_id = tx_id
+		self.rx_id = rx_id
+		self.bus = bus
+		self.block_size = block_size
+		self.st_min = st_min
+		self.padding = padding
+		self.messages = collections.deque()
+		self.errors = []
+
+		# receiving
+		self.buffer = bytearray(max_size)
+		self.view = memoryview(self.buffer)
+		self.rx_len = 0
+		self.rx_pos = 0
+		self.rx_seq = 0
+		self.rx_block = 0
+		self.rx_deadline = None
+
+		# sending
+		self.tx_data = None
+		self.tx_pos = 0
+		self.tx_seq = 0
+		self.tx_block = 0
+		self.tx_gap = 0.0
+		self.tx_next = None # time the next consecutive frame may go, None while waiting for a flow control
+		self.tx_deadline = None
+
+	@property
+	def sending(self):
+		return self.tx_data is not None
+
+	@property
+	def receiving(self):
+		return self.rx_deadline is not None
+
+	def _fail(self, text):
+		self.errors.append(text)
+		self.rx_deadline = None
+		self.tx_data = None
+
+class IsoTpStack():
+	def __init__(self, bus, timeout=TIMEOUT, clock=time.monotonic):
+		self.bus = bus
+		self.timeout = timeout
+		self.clock = clock
+		self.sessions = {}
+		self.active = set() # sessions with a transfer in progress, all that poll has to look at
+		self.rules = []
+		self.ignored = set()
+
+	def open(self, tx_id, rx_id, bus=0, **kwargs):
+		session = self.sessions.get((bus, rx_id))
+		if session is None:
+			session = self.sessions[(bus, rx_id)] = Session(tx_id, rx_id, bus, **kwargs)
+		return session
+
+	def close(self, session):
+		self.sessions.pop((session.bus, session.rx_id), None)
+		self.active.discard(session)
+
+	def accept(self, rule, **kwargs):
+		# rule(bus, rx id) -> tx id of a new session for a frame of no open session, None to ignore that id
+		self.rules.append((rule, kwargs))
+		self.ignored.clear()
+
+	def _match(self, bus, address):
+		for rule, kwargs in self.rules:
+			tx_id = rule(bus, address)
+			if tx_id is not None:
+				return self.open(tx_id, address, bus, **kwargs)
+		self.ignored.add((bus, address))
+		return None
+
+	def _send(self, session, frame):
+		self.bus.send(session.tx_id, _pad(frame, session.padding), session.bus)
+
+	### sending ###
+	def send(self, session, payload):
+		payload = bytes(payload)
+		if len(payload) > MAX_SIZE:
+			raise IsoTpError('%d bytes do not fit one iso-tp message' % len(payload))
+		if session.sending:
+			raise IsoTpError('session %s is still sending' % hex(session.tx_id))
+		if len(payload) <= 7:
+			self._send(session, bytes([len(payload)]) + payload)
+			return
+		self._send(session, bytes([(FIRST << 4) | (len(payload) >> 8), len(payload) & 0xff]) + payload[:6])
+		session.tx_data = payload
+		session.tx_pos = 6
+		session.tx_seq = 1
+		session.tx_next = None
+		session.tx_deadline = self.clock() + self.timeout
+		self.active.add(session)
+
+	def send_functional(self, address, payload, bus=0, padding=PADDING):
+		# functional requests are single frames, every ecu listening on address answers on its own id
+		payload = bytes(payload)
+		if len(payload) > 7:
+			raise IsoTpError('functional requests are single frames, %d bytes given' % len(payload))
+		self.bus.send(address, _pad(bytes([len(payload)]) + payload, padding), bus)
+
+	def _send_consecutive(self, session, now):
+		# as many frames as are due now: all of a block when stmin is 0, one per stmin gap otherwise
+		while session.tx_next is not None and session.tx_next <= now:
+			chunk = session.tx_data[session.tx_pos:session.tx_pos + 7]
+			self._send(session, bytes([(CONSECUTIVE << 4) | session.tx_seq]) + chunk)
+			session.tx_pos += len(chunk)
+			session.tx_seq = (session.tx_seq + 1) & 0xf
+			if session.tx_pos >= len(session.tx_data):
+				session.tx_data = None
+				if not session.receiving:
+					self.active.discard(session)
+				return
+			if session.tx_block:
+				session.tx_block -= 1
+				if session.tx_block == 0:
+					# block done, wait for the next flow control
+					session.tx_next = None
+					session.tx_deadline = now + self.timeout
+					return
+			if session.tx_gap:
+				session.tx_next = now + session.tx_gap
+				return
+
+	### receiving ###
+	def feed(self, frames, now=None):
+		# (address, time, data, bus) frames as returned by can_bus recv(), others' frames cost one dict lookup
+		now = self.clock() if now is None else now
+		for address, _, data, bus in frames:
+			session = self.sessions.get((bus, address))
+			if session is None and self.rules and (bus, address) not in self.ignored:
+				session = self._match(bus, address)
+			if session is not None and data:
+				self._on_frame(session, data, now)
+
+	def _on_frame(self, session, data, now):
+		kind = data[0] >> 4
+		if kind == SINGLE:
+			size = data[0] & 0xf
+			if 0 < size <= len(data) - 1:
+				session.messages.append(bytes(data[1:1 + size]))
+		elif kind == FIRST:
+			size = ((data[0] & 0xf) << 8) | data[1]
+			if size > len(session.buffer):
+				self._send(session, bytes([(FLOW << 4) | OVERFLOW, 0, 0]))
+				session._fail('%d byte message from %s does not fit the %d byte buffer' % (size, hex(session.rx_id), len(session.buffer)))
+				return
+			first = data[2:8]
+			session.view[:len(first)] = first
+			session.rx_len = size
+			session.rx_pos = len(first)
+			session.rx_seq = 1
+			session.rx_block = session.block_size
+			session.rx_deadline = now + self.timeout
+			self.active.add(session)
+			self._send(session, bytes([(FLOW << 4) | CONTINUE, session.block_size, session.st_min]))
+		elif kind == CONSECUTIVE:
+			if not session.receiving:
+				return
+			if data[0] & 0xf != session.rx_seq:
+				session._fail('sequence error from %s: got %d, expected %d' % (hex(session.rx_id), data[0] & 0xf, session.rx_seq))
+				return
+			chunk = data[1:1 + min(7, session.rx_len - session.rx_pos)]
+			session.view[session.rx_pos:session.rx_pos + len(chunk)] = chunk
+			session.rx_pos += len(chunk)
+			session.rx_seq = (session.rx_seq + 1) & 0xf
+			if session.rx_pos >= session.rx_len:
+				session.messages.append(bytes(session.view[:session.rx_len]))
+				session.rx_deadline = None
+				if not session.sending:
+					self.active.discard(session)
+				return
+			session.rx_deadline = now + self.timeout
+			if session.block_size:
+				session.rx_block -= 1
+				if session.rx_block == 0:
+					session.rx_block = session.block_size
+					self._send(session, bytes([(FLOW << 4) | CONTINUE, session.block_size, session.st_min]))
+		elif kind == FLOW:
+			if not session.sending or len(data) < 3:
+				return
+			status = data[0] & 0xf
+			if status == CONTINUE:
+				session.tx_block = data[1]
+				session.tx_gap = st_min_seconds(data[2])
+				session.tx_next = now
+				session.tx_deadline = None
+				self._send_consecutive(session, now)
+			elif status == WAIT:
+				session.tx_deadline = now + self.timeout
+			else:
+				session._fail('%s refused a %d byte message (overflow)' % (hex(session.rx_id), len(session.tx_data)))
+				self.active.discard(session)
+
+	def poll(self, now=None):
+		# send consecutive frames that are due and drop transfers that timed out
+		now = self.clock() if now is None else now
+		for session in list(self.active):
+			if session.sending:
+				if session.tx_next is not None:
+					self._send_consecutive(session, now)
+				elif session.tx_deadline is not None and now > session.tx_deadline:
+					session._fail('no flow control from %s' % hex(session.rx_id))
+			if session.receiving and now > session.rx_deadline:
+				session._fail('%s stopped after %d of %d bytes' % (hex(session.rx_id), session.rx_pos, session.rx_len))
+			if not session.sending and not session.receiving:
+				self.active.discard(session)
+
+	def step(self, now=None):
+		# one bus read (blocking for at most the bus timeout) and everything it makes due
+		frames = self.bus.recv()
+		now = self.clock() if now is None else now
+		if frames:
+			self.feed(frames, now)
+		self.poll(now)
+		return frames
+
+	def receive(self, sessions, timeout=TIMEOUT):
+		# {session: payload} of the first message of each session that arrives before the deadline
+		deadline = self.clock() + timeout
+		pending = set(sessions)
+		# only transfers failing from here on end the wait, errors of earlier ones stay in the list for reporting
+		seen = dict((session, len(session.errors)) for session in pending)
+		got = {}
+		while pending:
+			for session in list(pending):
+				if session.messages:
+					got[session] = session.messages.popleft()
+					pending.discard(session)
+				elif len(session.errors) > seen[session] and not session.receiving:
+					pending.discard(session)
+			if not pending or self.clock() > deadline:
+				break
+			self.step()
+		return got
+
+	def collect(self, timeout=TIMEOUT):
+		# {session: [payloads]} of every message completed by any session until the deadline
+		deadline = self.clock() + timeout
+		got = {}
+		while True:
+			for session in self.sessions.values():
+				while session.messages:
+					got.setdefault(session, []).append(session.messages.popleft())
+			if self.clock() > deadline:
+				return got
+			self.step()
+
+	def request(self, session, payload, timeout=TIMEOUT):
+		# physical request / response on one session, None when no answer came in time
+		self.send(session, payload)
+		return self.receive([session], timeout).get(session)
@@ -0,0 +1,512 @@
+#!/usr/bin/env python3
+
+### PandaLogger log access
+### streams a log as fixed size batches of typed frames so a drive capture never has to fit in memory as text
+### logs are either the original csv or a fixed width binary file of FRAME_DTYPE records opened with np.memmap,
+### or a directory of compressed, size / time bounded binary segments read back as one continuous log
+
+import argparse
+import binascii
+import csv
+import gzip
+import itertools
+import os
+import struct
+import sys
+import threading
+import time
+import numpy as np
+
+try:
+	import zstandard
+except ImportError:
+	zstandard = None
+
+try:
+	import lz4.frame
+except ImportError:
+	lz4 = None
+
+CSV_HEADER = ['Bus', 'MessageID', 'Message', 'MessageLength', 'UTC Time']
+
+# one can frame. the payload is kept big endian so the 8 bytes sit in wire order (byte 0 first)
+# and 'data' reads as the left aligned uint64 of the payload regardless of dlc
+FRAME_DTYPE = np.dtype([('time', '<f8'), ('bus', 'u1'), ('id', '<u4'), ('dlc', 'u1'), ('data', '>u8')])
+
+DEFAULT_CHUNK = 65536
+
+# binary log: 16 byte header (magic, record size, reserved) followed by packed FRAME_DTYPE records
+BIN_MAGIC = b'CANLOG\x00\x01'
+BIN_HEADER = struct.Struct('<8sII')
+
+# segment: fixed header (magic, record size, codec, start / end time, frame count, kbps of buses 0..3)
+# followed by a compressed stream of FRAME_DTYPE records. end time and count are patched in on close
+SEG_MAGIC = b'CANSEG\x00\x01'
+SEG_HEADER = struct.Struct('<8sIIddQ4H')
+SEG_SUFFIX = '.seg'
+CODECS = ['none', 'gzip', 'zstd', 'lz4']
+
+def _parse_rows(rows):
+	n = len(rows)
+	frames = np.zeros(n, dtype=FRAME_DTYPE)
+	if n == 0:
+		return frames
+
+	bus, ident, data, dlc, utc = zip(*rows)
+	frames['bus'] = np.fromiter((int(x, 0) for x in bus), dtype=np.uint8, count=n)
+	frames['id'] = np.fromiter((int(x, 16) for x in ident), dtype=np.uint32, count=n)
+	frames['dlc'] = np.fromiter((int(x, 0) for x in dlc), dtype=np.uint8, count=n)
+	frames['time'] = np.fromiter((float(x) for x in utc), dtype=np.float64, count=n)
+
+	# '0x0102..' payload strings are padded out to 8 bytes and decoded in one go
+	payload = bytes.fromhex(''.join(x.strip()[2:18].ljust(16, '0') for x in data))
+	frames['data'] = np.frombuffer(payload, dtype='>u8')
+	return frames
+
+def iter_csv(path, chunk_size=DEFAULT_CHUNK):
+	with open(path, 'r') as f:
+		first = f.readline()
+		pending = [] if first.startswith(CSV_HEADER[0]) else [first]
+
+		while True:
+			lines = pending + list(itertools.islice(f, chunk_size - len(pending)))
+			pending = []
+			if not lines:
+				break
+			rows = [line.split(',') for line in lines if line.strip()]
+			if rows:
+				yield _parse_rows(rows)
+
+def count_csv(path):
+	count = 0
+	last = b'\n'
+	with open(path, 'rb') as f:
+		for block in iter(lambda: f.read(1 << 20), b''):
+			count += block.count(b'\n')
+			last = block[-1:]
+	if last != b'\n':
+		count += 1
+	return max(count - 1, 0) # header row, blank lines make this an upper bound
+
+### binary format ###
+def is_binary(path):
+	if os.path.isdir(path):
+		return False
+	with open(path, 'rb') as f:
+		return f.read(len(BIN_MAGIC)) == BIN_MAGIC
+
+def open_bin(path):
+	with open(path, 'rb') as f:
+		magic, itemsize, _ = BIN_HEADER.unpack(f.read(BIN_HEADER.size))
+	if magic != BIN_MAGIC or itemsize != FRAME_DTYPE.itemsize:
+		raise ValueError('%s is not a binary can log' % path)
+
+	count = (os.path.getsize(path) - BIN_HEADER.size) // FRAME_DTYPE.itemsize
+	if count == 0:
+		return np.zeros(0, dtype=FRAME_DTYPE)
+	# only the pages that are actually touched get read from disk
+	return np.memmap(path, dtype=FRAME_DTYPE, mode='r', offset=BIN_HEADER.size, shape=(count,))
+
+def iter_bin(path, chunk_size=DEFAULT_CHUNK):
+	frames = open_bin(path)
+	for start in range(0, len(frames), chunk_size):
+		yield frames[start:start + chunk_size]
+
+### segmented format ###
+def default_codec():
+	if zstandard is not None:
+		return 'zstd'
+	if lz4 is not None:
+		return 'lz4'
+	return 'gzip'
+
+def _compress_stream(f, codec):
+	if codec == 'zstd':
+		return zstandard.ZstdCompressor().stream_writer(f, closefd=False)
+	if codec == 'lz4':
+		return lz4.frame.open(f, 'wb')
+	if codec == 'gzip':
+		return gzip.GzipFile(fileobj=f, mode='wb', compresslevel=6)
+	return f
+
+def _decompress_stream(f, codec):
+	if codec == 'zstd':
+		return zstandard.ZstdDecompressor().stream_reader(f)
+	if codec == 'lz4':
+		return lz4.frame.open(f, 'rb')
+	if codec == 'gzip':
+		return gzip.GzipFile(fileobj=f, mode='rb')
+	return f
+
+def _read_exact(stream, size):
+	parts = []
+	while size > 0:
+		part = stream.read(size)
+		if not part:
+			break
+		parts.append(part)
+		size -= len(part)
+	return b''.join(parts)
+
+def is_segment_dir(path):
+	return os.path.isdir(path)
+
+class SegmentInfo():
+	def __init__(self, path):
+		self.path = path
+		with open(path, 'rb') as f:
+			magic, itemsize, codec, start, end, count, k0, k1, k2, k3 = SEG_HEADER.unpack(f.read(SEG_HEADER.size))
+		if magic != SEG_MAGIC or itemsize != FRAME_DTYPE.itemsize:
+			raise ValueError('%s is not a can log segment' % path)
+		self.codec = CODECS[codec]
+		self.start = start
+		self.end = end # 0 until the segment was closed cleanly
+		self.count = count
+		self.bus_kbps = [k0, k1, k2, k3]
+
+	def iter_frames(self, chunk_size=DEFAULT_CHUNK):
+		with open(self.path, 'rb') as f:
+			f.seek(SEG_HEADER.size)
+			stream = _decompress_stream(f, self.codec)
+			while True:
+				data = _read_exact(stream, chunk_size * FRAME_DTYPE.itemsize)
+				usable = len(data) - len(data) % FRAME_DTYPE.itemsize # a crash can leave a partial record
+				if usable == 0:
+					break
+				yield np.frombuffer(data[:usable], dtype=FRAME_DTYPE)
+
+def list_segments(path):
+	segments = [SegmentInfo(os.path.join(path, f)) for f in sorted(os.listdir(path)) if f.endswith(SEG_SUFFIX)]
+	# unclosed segments end where the next one starts
+	for seg, nxt in zip(segments, segments[1:] + [None]):
+		if seg.end == 0:
+			seg.end = nxt.start if nxt is not None else float('inf')
+	return segments
+
+def iter_segments(path, chunk_size=DEFAULT_CHUNK, start=None, end=None):
+	# only the segments overlapping [start, end] are decompressed
+	for seg in list_segments(path):
+		if (start is not None and seg.end < start) or (end is not None and seg.start > end):
+			continue
+		for frames in seg.iter_frames(chunk_size):
+			yield frames
+
+def count_segments(path):
+	total = 0
+	for seg in list_segments(path):
+		if seg.count:
+			total += seg.count
+		else:
+			total += sum(len(frames) for frames in seg.iter_frames())
+	return total
+
+### any log format ###
+def _time_window(batches, start, end):
+	for frames in batches:
+		if start is not None or end is not None:
+			keep = np.ones(len(frames), dtype=bool)
+			if start is not None:
+				keep &= frames['time'] >= start
+			if end is not None:
+				keep &= frames['time'] <= end
+			frames = frames[keep]
+		if len(frames):
+			yield frames
+
+def iter_frames(path, chunk_size=DEFAULT_CHUNK, start=None, end=None):
+	# start / end limit the frames to a utc time window
+	if is_segment_dir(path):
+		batches = iter_segments(path, chunk_size, start, end)
+	elif is_binary(path):
+		batches = iter_bin(path, chunk_size)
+	else:
+		batches = iter_csv(path, chunk_size)
+	if start is None and end is None:
+		return batches
+	return _time_window(batches, start, end)
+
+def count_frames(path):
+	if is_segment_dir(path):
+		return count_segments(path)
+	if is_binary(path):
+		return len(open_bin(path))
+	return count_csv(path)
+
+def open_log(path, chunk_size=DEFAULT_CHUNK):
+	# whole log as one array, memory mapped when the log is binary
+	if not is_segment_dir(path) and is_binary(path):
+		return open_bin(path)
+	chunks = list(iter_frames(path, chunk_size))
+	if not chunks:
+		return np.zeros(0, dtype=FRAME_DTYPE)
+	return np.concatenate(chunks)
+
+read_frames = open_log
+
+def iter_rows(path, chunk_size=DEFAULT_CHUNK, on_batch=None):
+	# (time, bus, id, dlc, data) python tuples, still read from disk one batch at a time
+	# on_batch sees each whole batch before its rows, for vectorized work alongside the row loop
+	for frames in iter_frames(path, chunk_size):
+		if on_batch is not None:
+			on_batch(frames)
+		for row in frames.tolist():
+			yield row
+
+### helpers for code that still wants the original text representation ###
+def payload_bytes(frames):
+	return np.ascontiguousarray(frames['data'], dtype='>u8').view(np.uint8).reshape(-1, 8)
+
+def hex_payload(data, dlc):
+	# same string PandaLogger writes: "0x" + hexlify(dat)
+	return '0x' + ('%016x' % data)[:2 * dlc]
+
+def frame_row(bus, ident, data, dlc):
+	return [bus, hex(ident), hex_payload(data, dlc), dlc]
+
+### writers ###
+class CsvWriter():
+	def __init__(self, path):
+		self.f = open(path, 'w')
+		self.writer = csv.writer(self.f, lineterminator='\n')
+		self.writer.writerow(CSV_HEADER)
+
+	def write_frame(self, bus, address, dat, utc_time):
+		self.writer.writerow([str(bus), str(hex(address)), '0x' + binascii.hexlify(dat).decode(), len(dat), repr(utc_time)])
+
+	def write_frames(self, frames):
+		self.writer.writerows([str(bus), hex(ident), hex_payload(data, dlc), dlc, repr(utc_time)]
+			for utc_time, bus, ident, dlc, data in frames.tolist())
+
+	def flush(self):
+		self.f.flush()
+
+	def close(self):
+		self.f.close()
+
+class BinWriter():
+	def __init__(self, path, buffer_frames=4096):
+		self.f = open(path, 'wb')
+		self.f.write(BIN_HEADER.pack(BIN_MAGIC, FRAME_DTYPE.itemsize, 0))
+		self.buffer = np.zeros(buffer_frames, dtype=FRAME_DTYPE)
+		self.fill = 0
+
+	def write_frame(self, bus, address, dat, utc_time):
+		payload = struct.unpack('>Q', bytes(dat[:8]).ljust(8, b'\x00'))[0]
+		self.buffer[self.fill] = (utc_time, bus, address, len(dat), payload)
+		self.fill += 1
+		if self.fill == len(self.buffer):
+			self.flush()
+
+	def write_frames(self, frames):
+		self.flush()
+		np.ascontiguousarray(frames, dtype=FRAME_DTYPE).tofile(self.f)
+
+	def flush(self):
+		if self.fill:
+			self.buffer[:self.fill].tofile(self.f)
+			self.fill = 0
+		self.f.flush()
+
+	def close(self):
+		self.flush()
+		self.f.close()
+
+class SegmentWriter():
+	# writes a directory of compressed segments, rotating after max_bytes (compressed) or max_seconds of log time
+	def __init__(self, path, codec=None, max_bytes=256 << 20, max_seconds=3600.0, bus_kbps=(500, 500, 500, 0), buffer_frames=4096):
+		if not os.path.isdir(path):
+			os.makedirs(path)
+		self.path = path
+		self.codec = codec or default_codec()
+		self.max_bytes = max_bytes
+		self.max_seconds = max_seconds
+		self.bus_kbps = list(bus_kbps) + [0] * (4 - len(bus_kbps))
+		self.buffer = np.zeros(buffer_frames, dtype=FRAME_DTYPE)
+		self.fill = 0
+		self.sequence = len([f for f in os.listdir(path) if f.endswith(SEG_SUFFIX)])
+		self.f = None
+
+	def _header(self):
+		return SEG_HEADER.pack(SEG_MAGIC, FRAME_DTYPE.itemsize, CODECS.index(self.codec),
+			self.start, self.end, self.count, *self.bus_kbps)
+
+	def _open(self, start):
+		self.sequence += 1
+		self.f = open(os.path.join(self.path, '%06d%s' % (self.sequence, SEG_SUFFIX)), 'wb')
+		self.start = start
+		self.end = 0.0
+		self.count = 0
+		self.f.write(self._header())
+		self.stream = _compress_stream(self.f, self.codec)
+
+	def _close_segment(self):
+		if self.f is None:
+			return
+		if self.stream is not self.f:
+			self.stream.close()
+		self.f.seek(0)
+		self.f.write(self._header())
+		self.f.close()
+		self.f = None
+
+	def _write(self, frames):
+		if len(frames) == 0:
+			return
+		if self.f is not None and (self.f.tell() >= self.max_bytes or frames['time'][0] - self.start >= self.max_seconds):
+			self._close_segment()
+		if self.f is None:
+			self._open(float(frames['time'][0]))
+		self.stream.write(np.ascontiguousarray(frames, dtype=FRAME_DTYPE).tobytes())
+		self.count += len(frames)
+		self.end = float(frames['time'][-1])
+
+	def write_frame(self, bus, address, dat, utc_time):
+		payload = struct.unpack('>Q', bytes(dat[:8]).ljust(8, b'\x00'))[0]
+		self.buffer[self.fill] = (utc_time, bus, address, len(dat), payload)
+		self.fill += 1
+		if self.fill == len(self.buffer):
+			self.flush()
+
+	def write_frames(self, frames):
+		self.flush()
+		self._write(frames)
+
+	def flush(self):
+		if self.fill:
+			self._write(self.buffer[:self.fill].copy())
+			self.fill = 0
+
+	def close(self):
+		self.flush()
+		self._close_segment()
+
+def open_writer(path, fmt='csv', **kwargs):
+	if fmt == 'seg':
+		return SegmentWriter(path, **kwargs)
+	if fmt == 'bin':
+		return BinWriter(path)
+	return CsvWriter(path)
+
+### decoupled logging ###
+class FrameRing():
+	# single producer / single consumer ring of (utc_time, recv list) batches. no locks: only the
+	# producer moves head and only the consumer moves tail, a full ring drops the new batch and counts it
+	def __init__(self, capacity=4096):
+		self.slots = [None] * capacity
+		self.head = 0
+		self.tail = 0
+		self.dropped = 0 # frames
+		self.overflows = 0 # batches
+
+	def __len__(self):
+		return (self.head - self.tail) % len(self.slots)
+
+	def push(self, item, count=1):
+		nxt = (self.head + 1) % len(self.slots)
+		if nxt == self.tail:
+			self.dropped += count
+			self.overflows += 1
+			return False
+		self.slots[self.head] = item
+		self.head = nxt
+		return True
+
+	def pop_all(self):
+		items = []
+		head = self.head
+		while self.tail != head:
+			items.append(self.slots[self.tail])
+			self.slots[self.tail] = None
+			self.tail = (self.tail + 1) % len(self.slots)
+		return items
+
+class LogWriterThread(threading.Thread):
+	# drains a FrameRing of panda style (address, bus time, data, bus) recv batches (or FRAME_DTYPE arrays) into a log writer,
+	# flushing once per pass and printing a throttled per bus rate / queue status line
+	def __init__(self, writer, ring, accept=None, status_interval=1.0, poll=0.01, out=sys.stdout):
+		threading.Thread.__init__(self)
+		self.daemon = True
+		self.writer = writer
+		self.ring = ring
+		self.accept = accept
+		self.status_interval = status_interval
+		self.poll = poll
+		self.out = out
+		self.counts = [0] * 256
+		self.stopping = threading.Event()
+
+	def stop(self):
+		self.stopping.set()
+		self.join()
+
+	def _write(self, items):
+		write_frame = self.writer.write_frame
+		accept = self.accept
+		counts = self.counts
+		for utc_time, recv in items:
+			if isinstance(recv, np.ndarray):
+				# FRAME_DTYPE batches already timestamped and filtered per frame (can_capture)
+				self.writer.write_frames(recv)
+				for bus, n in enumerate(np.bincount(recv['bus'], minlength=len(counts)).tolist()):
+					counts[bus] += n
+				continue
+			for address, _, dat, src in recv:
+				if accept is None or accept(src, address):
+					write_frame(src, address, dat, utc_time)
+					counts[src] += 1
+
+	def _status(self, elapsed, last_counts):
+		rates = ['bus %d: %.0f/s' % (bus, (self.counts[bus] - last_counts[bus]) / elapsed) for bus in range(len(self.counts)) if self.counts[bus]]
+		self.out.write('\r' + '  '.join(rates) + '  queue: %d  dropped: %d  ' % (len(self.ring), self.ring.dropped))
+		self.out.flush()
+
+	def run(self):
+		last_status = time.time()
+		last_counts = list(self.counts)
+		while True:
+			stopping = self.stopping.is_set()
+			items = self.ring.pop_all()
+			if items:
+				self._write(items)
+				self.writer.flush()
+			elif stopping:
+				break
+			else:
+				self.stopping.wait(self.poll)
+
+			now = time.time()
+			if self.status_interval and now - last_status >= self.status_interval:
+				self._status(now - last_status, last_counts)
+				last_status = now
+				last_counts = list(self.counts)
+		self.writer.close()
+
+### converters ###
+def convert(src, dst, fmt, chunk_size=DEFAULT_CHUNK, start=None, end=None):
+	writer = open_writer(dst, fmt)
+	count = 0
+	for frames in iter_frames(src, chunk_size, start, end):
+		writer.write_frames(frames)
+		count += len(frames)
+	writer.close()
+	return count
+
+def parse_args():
+	arg_parser = argparse.ArgumentParser(description='convert PandaLogger logs between csv, binary and segment directories')
+	arg_parser.add_argument('-i', '--input', required=True, help='csv or binary log, or directory of segments')
+	arg_parser.add_argument('-o', '--output', required=True, help='converted log path')
+	arg_parser.add_argument('-f', '--format', required=False, default=None, choices=['csv', 'bin', 'seg'], help='output format, defaults to the opposite of the input')
+	arg_parser.add_argument('-ts', '--start', required=False, default=None, type=float, help='only frames at or after this utc time')
+	arg_parser.add_argument('-te', '--end', required=False, default=None, type=float, help='only frames at or before this utc time')
+	return arg_parser.parse_args()
+
+def main():
+	args = parse_args()
+	fmt = args.format
+	if fmt is None:
+		fmt = 'bin' if is_segment_dir(args.input) or not is_binary(args.input) else 'csv'
+	count = convert(args.input, args.output, fmt, start=args.start, end=args.end)
+	print(count, 'frames written to', args.output, 'as', fmt)
+
+if __name__ == "__main__":
+	main()
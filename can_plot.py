@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+
+### decimated, interactive plotting for long logs
+### every trace keeps a min / max pyramid: the min and max of each bucket of LEAF samples, then of each pair of
+### buckets, up to one bucket for the whole log. drawing a time window takes the finest level with no more than
+### POINTS_PER_PIXEL buckets per pixel in view and draws each bucket as a vertical min / max stroke, so peaks
+### survive any zoom. once a window holds few enough samples to draw them all, only that window's frames are
+### read back from the log (gathered through the sidecar index from the memmap of a binary log) and drawn as steps.
+### zooming or panning redraws the visible axes from the right level, whatever the length of the log
+
+import argparse
+import numpy as np
+import can_decode
+import can_index
+import can_log
+
+LEAF = 64
+POINTS_PER_PIXEL = 2
+
+class Pyramid():
+	def __init__(self, leaf=LEAF):
+		self.leaf = leaf
+		self.count = 0
+		self.last = None
+		self.levels = [] # [(start time, min, max)] finest first, filled in by finish
+		self._parts = []
+		self._carry_times = np.zeros(0)
+		self._carry_values = np.zeros(0)
+
+	def add(self, times, values):
+		# samples in time order, only whole leaf buckets are reduced and the rest waits for the next batch
+		self.count += len(times)
+		if len(times):
+			self.last = float(times[-1])
+		times = np.concatenate([self._carry_times, times])
+		values = np.concatenate([self._carry_values, np.asarray(values, dtype=np.float64)])
+		full = len(times) - len(times) % self.leaf
+		if full:
+			buckets = values[:full].reshape(-1, self.leaf)
+			self._parts.append((times[:full:self.leaf], buckets.min(axis=1), buckets.max(axis=1)))
+		self._carry_times = times[full:]
+		self._carry_values = values[full:]
+
+	def finish(self):
+		if len(self._carry_times):
+			self._parts.append((self._carry_times[:1], self._carry_values.min(keepdims=True), self._carry_values.max(keepdims=True)))
+			self._carry_times = np.zeros(0)
+			self._carry_values = np.zeros(0)
+		if not self._parts:
+			return
+		level = tuple(np.concatenate(part) for part in zip(*self._parts))
+		self._parts = []
+		self.levels = [level]
+		while len(level[0]) > 1:
+			times, lo, hi = level
+			if len(times) % 2:
+				lo = np.append(lo, lo[-1])
+				hi = np.append(hi, hi[-1])
+			level = (times[::2], lo.reshape(-1, 2).min(axis=1), hi.reshape(-1, 2).max(axis=1))
+			self.levels.append(level)
+
+	def span(self):
+		# first and last sample time
+		return self.levels[0][0][0], self.last
+
+	def _span(self, level, start, end):
+		times = self.levels[level][0]
+		# the bucket holding start is partly in view
+		return max(int(np.searchsorted(times, start, side='right')) - 1, 0), int(np.searchsorted(times, end, side='right'))
+
+	def samples_between(self, start, end):
+		# upper bound of the samples in [start, end] from the leaf buckets overlapping it
+		if not self.levels:
+			return 0
+		lo, hi = self._span(0, start, end)
+		return (hi - lo) * self.leaf
+
+	def envelope(self, start, end, budget):
+		# (times, min, max) of the finest level with at most budget buckets in [start, end]
+		for level in range(len(self.levels)):
+			lo, hi = self._span(level, start, end)
+			if hi - lo <= budget or level == len(self.levels) - 1:
+				times, mins, maxs = self.levels[level]
+				return times[lo:hi], mins[lo:hi], maxs[lo:hi]
+
+### traces ###
+class Trace():
+	# one plotted line: extract(frames) -> (times, values) for the frames of ids (on buses, None means any).
+	# stream, when given, is used instead for the pass over the whole log, batch after batch, and may carry state
+	# from one batch to the next. extract alone serves the independent windows read back when zooming
+	def __init__(self, label, ids, buses, extract, scale=1.0, leaf=LEAF, stream=None):
+		self.label = label
+		self.ids = list(ids)
+		self.buses = None if buses is None else list(buses)
+		self.extract = extract
+		self.stream = stream or extract
+		self.scale = scale
+		self.pyramid = Pyramid(leaf)
+
+	def values(self, frames, stream=False):
+		times, values = (self.stream if stream else self.extract)(frames)
+		return times, np.asarray(values, dtype=np.float64) * self.scale
+
+	def mask(self, frames):
+		keep = np.isin(frames['id'], np.asarray(self.ids, dtype=np.uint32))
+		if self.buses is not None:
+			keep &= np.isin(frames['bus'], np.asarray(self.buses, dtype=np.uint8))
+		return keep
+
+def signal_trace(sig, label=None, scale=1.0):
+	def extract(frames):
+		rows, values = can_decode.extract_frames(frames, sig)
+		return frames['time'][rows], values
+	return Trace(label or sig.name, [sig.ident], None if sig.bus is None else [sig.bus], extract, scale)
+
+def field_trace(label, bus, ident, first, size=1, min_dlc=None, scale=1.0):
+	# big endian field of size bytes from byte first, on every frame of at least min_dlc bytes
+	min_dlc = first + size if min_dlc is None else min_dlc
+	def extract(frames):
+		sel = (frames['id'] == ident) & (frames['bus'] == bus) & (frames['dlc'] >= min_dlc)
+		data = can_log.payload_bytes(frames[sel]).astype(np.int64)
+		value = np.zeros(len(data), dtype=np.int64)
+		for k in range(first, first + size):
+			value = (value << 8) | data[:, k]
+		return frames['time'][sel], value
+	return Trace(label, [ident], [bus], extract, scale)
+
+def frequency_trace(label, bus, ident):
+	# update rate (hz) of an id from the time since its previous frame, frames sharing a timestamp are skipped
+	def rates(times):
+		dt = np.diff(times)
+		keep = dt > 0
+		return times[1:][keep], 1 / dt[keep]
+
+	def extract(frames):
+		return rates(frames['time'][(frames['id'] == ident) & (frames['bus'] == bus)])
+
+	# over the whole log the last frame of the previous batch dates the first one of the next
+	last = []
+	def stream(frames):
+		times = frames['time'][(frames['id'] == ident) & (frames['bus'] == bus)]
+		if len(times) == 0:
+			return times, times
+		out = rates(np.concatenate([last, times]))
+		last[:] = times[-1:]
+		return out
+	return Trace(label, [ident], [bus], extract, stream=stream)
+
+### log windows ###
+def _first_row(frames, t):
+	# bisect on the memmap's time column, touching log2(n) records instead of reading the column
+	lo, hi = 0, len(frames)
+	while lo < hi:
+		mid = (lo + hi) // 2
+		if frames[mid]['time'] < t:
+			lo = mid + 1
+		else:
+			hi = mid
+	return lo
+
+class Plotter():
+	# feed every batch of the log to add (or call build), then show
+	def __init__(self, path, index=None):
+		self.path = path
+		self.index = index
+		self.binary = not can_log.is_segment_dir(path) and can_log.is_binary(path)
+		self.traces = []
+		self.figures = []
+		self.origin = None
+		self._kept = [] # frames of traced ids of a non binary log, kept from the first pass for zooming
+
+	def add_figure(self, title, panels):
+		# panels: one list of traces per subplot, top to bottom
+		self.figures.append((title, panels))
+		for panel in panels:
+			self.traces.extend(panel)
+
+	def add(self, frames):
+		if len(frames) == 0:
+			return
+		if self.origin is None:
+			self.origin = float(frames['time'][0])
+		for trace in self.traces:
+			trace.pyramid.add(*trace.values(frames, stream=True))
+		if not self.binary:
+			keep = np.zeros(len(frames), dtype=bool)
+			for trace in self.traces:
+				keep |= trace.mask(frames)
+			self._kept.append(frames[keep])
+
+	def build(self, chunk_size=can_log.DEFAULT_CHUNK):
+		for frames in can_log.iter_frames(self.path, chunk_size):
+			self.add(frames)
+
+	def frames_between(self, trace, start, end):
+		# frames of the trace's ids from just before start to just after end, so steps run to both edges
+		if self.binary:
+			if self.index is None:
+				self.index = can_index.load_index(self.path)
+			frames = can_log.open_bin(self.path)
+			lo, hi = _first_row(frames, start), _first_row(frames, end)
+			parts = []
+			for slot in self.index.slots(trace.ids, trace.buses).tolist():
+				rows = self.index.rows_all[self.index.starts[slot]:self.index.starts[slot + 1]]
+				a, b = np.searchsorted(rows, [lo, hi])
+				parts.append(rows[max(a - 1, 0):b + 1])
+			if not parts:
+				return frames[:0]
+			return frames[np.sort(np.concatenate(parts))]
+
+		if len(self._kept) != 1:
+			kept = np.concatenate(self._kept) if self._kept else np.zeros(0, dtype=can_log.FRAME_DTYPE)
+			self._kept = [kept]
+		frames = self._kept[0][trace.mask(self._kept[0])]
+		a, b = np.searchsorted(frames['time'], [start, end])
+		return frames[max(a - 1, 0):b + 1]
+
+	def window(self, trace, start, end, pixels):
+		# (x, y, drawstyle) of a trace between two utc times, x relative to the start of the log
+		budget = max(pixels, 1) * POINTS_PER_PIXEL
+		if trace.pyramid.samples_between(start, end) <= budget:
+			times, values = trace.values(self.frames_between(trace, start, end))
+			return times - self.origin, values, 'steps-post'
+		times, mins, maxs = trace.pyramid.envelope(start, end, budget)
+		return np.repeat(times, 2) - self.origin, np.column_stack([mins, maxs]).ravel(), 'default'
+
+	def show(self, style=None):
+		import matplotlib.pyplot as plt
+
+		for trace in self.traces:
+			trace.pyramid.finish()
+		if self.origin is None:
+			self.origin = 0.0
+		if style:
+			plt.style.use(style)
+		views = []
+		for title, panels in self.figures:
+			fig, axes = plt.subplots(len(panels), 1, sharex=True, squeeze=False)
+			fig.suptitle(title)
+			axes = axes[:, 0]
+			figure_views = [_View(self, ax, panel) for ax, panel in zip(axes, panels)]
+			spans = [trace.pyramid.span() for panel in panels for trace in panel if trace.pyramid.levels]
+			if spans:
+				start, end = min(s[0] for s in spans), max(s[1] for s in spans)
+				axes[0].set_xlim(start - self.origin, end - self.origin)
+				for view in figure_views:
+					view.update(start, end)
+			# connected once the first view is drawn, so setting it up redraws nothing twice
+			for view in figure_views:
+				view.ax.callbacks.connect('xlim_changed', view.on_xlim)
+			axes[-1].set_xlabel('time (s)')
+			views += figure_views
+		plt.show()
+		return views
+
+class _View():
+	# the lines of one subplot, redrawn from the pyramid / log whenever its x range changes
+	def __init__(self, plotter, ax, traces):
+		self.plotter = plotter
+		self.ax = ax
+		self.traces = traces
+		self.lines = [ax.plot([], [], label=trace.label)[0] for trace in traces]
+		ax.legend(loc='upper right')
+
+	def update(self, start, end):
+		pixels = int(self.ax.get_window_extent().width)
+		for trace, line in zip(self.traces, self.lines):
+			x, y, style = self.plotter.window(trace, start, end, pixels)
+			line.set_drawstyle(style)
+			line.set_data(x, y)
+		# a box zoom fixes the y range, a pan / x zoom keeps fitting it to what is in view
+		if self.ax.get_autoscaley_on():
+			self.ax.relim()
+			self.ax.autoscale_view(scalex=False)
+
+	def on_xlim(self, ax):
+		start, end = ax.get_xlim()
+		self.update(start + self.plotter.origin, end + self.plotter.origin)
+		ax.figure.canvas.draw_idle()
+
+def parse_args():
+	arg_parser = argparse.ArgumentParser(description='zoomable plots of decoded signals of a PandaLogger log')
+	arg_parser.add_argument('-i', '--input', required=True, help='csv or binary log, or directory of segments')
+	arg_parser.add_argument('-s', '--signals', required=True, nargs='+', help='signal names, one subplot each e.g. <veh_speed ford_ws_lf>')
+	arg_parser.add_argument('-d', '--definitions', required=False, nargs='+', default=['tesla_model_s', 'ford_f150'], help='signal definition files (.dbc / .yaml) or names of bundled ones in signals/')
+	arg_parser.add_argument('-c', '--chunk', required=False, default=can_log.DEFAULT_CHUNK, type=int, help='number of frames read from the log per batch')
+	return arg_parser.parse_args()
+
+def main():
+	args = parse_args()
+	definitions = []
+	for path in args.definitions:
+		definitions += can_decode.load_definitions(path)
+	by_name = dict((sig.name, sig) for sig in definitions)
+	missing = [name for name in args.signals if name not in by_name]
+	if missing:
+		raise ValueError('no signal %s in the definitions' % ', '.join(missing))
+
+	plotter = Plotter(args.input)
+	plotter.add_figure(args.input, [[signal_trace(by_name[name])] for name in args.signals])
+	plotter.build(args.chunk)
+	plotter.show('dark_background')
+
+if __name__ == "__main__":
+	main()
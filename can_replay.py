@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+
+### physical can replay scheduler
+### rebuilds the recorded inter frame timing from the log timestamps (optionally sped up / slowed down),
+### sends every frame that is due as one can_send_many batch and schedules against a monotonic clock so
+### timing errors do not add up the way back to back sleeps do
+
+import time
+import numpy as np
+import can_log
+
+class RecordingPanda():
+	# stand-in for panda.Panda that records what would have been sent and when
+	SAFETY_ALLOUTPUT = 0x1337
+	SAFETY_NOOUTPUT = 0
+
+	def __init__(self, clock=time.monotonic):
+		self.clock = clock
+		self.sent = [] # (send time, address, data, bus)
+
+	def can_send(self, addr, dat, bus):
+		self.sent.append((self.clock(), addr, dat, bus))
+
+	def can_send_many(self, arr):
+		now = self.clock()
+		self.sent.extend((now, addr, dat, bus) for addr, _, dat, bus in arr)
+
+	def can_clear(self, bus):
+		pass
+
+	def set_safety_mode(self, mode):
+		pass
+
+class ReplayScheduler():
+	def __init__(self, panda, speed=1.0, out_bus=0, spacing=0.0, bus_map=None, clock=time.monotonic, sleep=time.sleep, spin=0.0005):
+		self.panda = panda
+		self.speed = float(speed)
+		self.spacing = float(spacing) # > 0 ignores the log timestamps and sends one frame every spacing seconds
+		self.clock = clock
+		self.sleep = sleep
+		self.spin = spin # last part of every wait is busy waited, sleep() overshoots by about this much
+		# source bus -> target bus, everything goes to out_bus unless a map is given (see can_filter.parse_remap)
+		self.bus_map = np.full(256, out_bus, dtype=np.uint8) if bus_map is None else np.asarray(bus_map, dtype=np.uint8)
+		self.send_many = getattr(panda, 'can_send_many', None)
+
+		self.start = None
+		self.log_start = None
+		self.frames_sent = 0
+		self.batches_sent = 0
+		self.last_due = 0.0
+		self.errors = []
+
+	def _log_times(self, frames):
+		if self.spacing > 0:
+			return (self.frames_sent + np.arange(len(frames))) * self.spacing
+		return frames['time']
+
+	def _wait_until(self, due):
+		remaining = due - self.clock()
+		if remaining > self.spin:
+			self.sleep(remaining - self.spin)
+		while self.clock() < due:
+			pass
+
+	def _send(self, msgs):
+		if self.send_many is not None:
+			self.send_many(msgs)
+		else:
+			for addr, _, dat, bus in msgs:
+				self.panda.can_send(addr, dat, bus)
+
+	def send_frames(self, frames):
+		if len(frames) == 0:
+			return
+		times = self._log_times(frames)
+		if self.start is None:
+			self.start = self.clock()
+			self.log_start = times[0]
+
+		# absolute due time of every frame, and the latest due time up to each one (logs of several buses are not
+		# always in time order)
+		due = self.start + (times - self.log_start) / self.speed
+		latest = np.maximum.accumulate(due)
+
+		payload = can_log.payload_bytes(frames).tobytes()
+		ids = frames['id'].tolist()
+		dlcs = frames['dlc'].tolist()
+		buses = self.bus_map[frames['bus']].tolist()
+
+		# wait for the next frame, then send it along with every frame that came due meanwhile, so no frame goes out
+		# early and batches grow by themselves while sending falls behind
+		lo = 0
+		while lo < len(frames):
+			self._wait_until(due[lo])
+			hi = max(int(np.searchsorted(latest, self.clock(), side='right')), lo + 1)
+			msgs = [(ids[k], None, payload[8 * k:8 * k + dlcs[k]], buses[k]) for k in range(lo, hi)]
+			self._send(msgs)
+			self.errors.append(self.clock() - due[lo:hi])
+			self.batches_sent += 1
+			lo = hi
+
+		self.frames_sent += len(frames)
+		self.last_due = due[-1]
+
+	def run(self, batches):
+		for frames in batches:
+			self.send_frames(frames)
+		return self.stats()
+
+	def stats(self):
+		if not self.frames_sent:
+			return {'frames': 0}
+		errors = np.concatenate(self.errors)
+		wall = self.clock() - self.start
+		span = self.last_due - self.start
+		return {
+			'frames': self.frames_sent,
+			'batches': self.batches_sent,
+			'target_rate': self.frames_sent / span if span > 0 else float('inf'),
+			'achieved_rate': self.frames_sent / wall if wall > 0 else float('inf'),
+			'error_mean_ms': errors.mean() * 1e3,
+			'error_p50_ms': np.percentile(errors, 50) * 1e3,
+			'error_p95_ms': np.percentile(errors, 95) * 1e3,
+			'error_p99_ms': np.percentile(errors, 99) * 1e3,
+			'error_max_ms': errors.max() * 1e3,
+		}
+
+def print_stats(stats):
+	if not stats['frames']:
+		print('no frames replayed')
+		return
+	print('replayed', stats['frames'], 'frames in', stats['batches'], 'batches')
+	print('rate (frames/s) target: %.1f achieved: %.1f' % (stats['target_rate'], stats['achieved_rate']))
+	print('timing error (ms) mean: %.3f p50: %.3f p95: %.3f p99: %.3f max: %.3f' % (stats['error_mean_ms'],
+		stats['error_p50_ms'], stats['error_p95_ms'], stats['error_p99_ms'], stats['error_max_ms']))
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+
+### time aligned resampling of decoded signals
+### a signal is kept as its sparse (time, value) sample points only, and any set of them is aligned onto one time
+### grid (uniform at a chosen rate, or the union of all their sample times) with a zero order hold or linear
+### interpolation. alignment is one searchsorted merge per signal, the result is a table with a time column and
+### one column per signal, NaN where a signal has no value yet
+
+import argparse
+import collections
+import numpy as np
+import can_decode
+import can_log
+
+Series = collections.namedtuple('Series', ['name', 'times', 'values'])
+
+def series(name, times, values):
+	times = np.asarray(times, dtype=np.float64)
+	values = np.asarray(values, dtype=np.float64)
+	if len(times) > 1 and (np.diff(times) < 0).any():
+		order = np.argsort(times, kind='stable')
+		times, values = times[order], values[order]
+	return Series(name, times, values)
+
+def decode_series(path, names, definitions, chunk_size=can_log.DEFAULT_CHUNK, start=None, end=None):
+	# {name: Series} for the named signals, decoded a batch at a time
+	names = list(names)
+	sigs = [sig for sig in definitions if sig.name in names]
+	missing = set(names) - set(sig.name for sig in sigs)
+	if missing:
+		raise ValueError('no signal %s in the definitions' % ', '.join(sorted(missing)))
+	decoder = can_decode.BatchDecoder(sigs)
+	for frames in can_log.iter_frames(path, chunk_size, start, end):
+		decoder.add(frames)
+	return collections.OrderedDict((name, series(name, *decoder.timeseries(name))) for name in names)
+
+### grids ###
+def uniform_grid(all_series, rate, start=None, end=None):
+	# every 1 / rate seconds over the span covered by any of the series
+	firsts = [s.times[0] for s in all_series if len(s.times)]
+	lasts = [s.times[-1] for s in all_series if len(s.times)]
+	if not firsts:
+		return np.zeros(0)
+	start = min(firsts) if start is None else start
+	end = max(lasts) if end is None else end
+	return start + np.arange(int(np.floor((end - start) * rate)) + 1) / float(rate)
+
+def union_grid(all_series):
+	# every distinct sample time of any of the series
+	parts = [s.times for s in all_series if len(s.times)]
+	if not parts:
+		return np.zeros(0)
+	return np.unique(np.concatenate(parts))
+
+### alignment ###
+def hold_index(times, grid):
+	# index of the latest sample at or before every grid point, -1 before the first one
+	return np.searchsorted(times, grid, side='right') - 1
+
+def hold(s, grid):
+	# index -1 picks the appended NaN
+	return np.append(s.values, np.nan)[hold_index(s.times, grid)]
+
+def linear(s, grid):
+	if len(s.times) == 0:
+		return np.full(len(grid), np.nan)
+	out = np.interp(grid, s.times, s.values)
+	out[(grid < s.times[0]) | (grid > s.times[-1])] = np.nan
+	return out
+
+METHODS = {'hold': hold, 'linear': linear}
+
+def table_dtype(names, value_dtype=np.float64):
+	return np.dtype([('time', '<f8')] + [(name, value_dtype) for name in names])
+
+def resample(all_series, grid=None, rate=None, method='hold', value_dtype=np.float64):
+	# structured array (time, <one column per series>) on grid, or on a uniform grid at rate, or on the union
+	# of all sample times when neither is given
+	all_series = list(all_series)
+	if grid is None:
+		grid = uniform_grid(all_series, rate) if rate else union_grid(all_series)
+	align = METHODS[method]
+	out = np.zeros(len(grid), dtype=table_dtype([s.name for s in all_series], value_dtype))
+	out['time'] = grid
+	for s in all_series:
+		out[s.name] = align(s, grid)
+	return out
+
+def save_table(path, table):
+	# .npz keeps the columns as arrays, anything else is written as csv
+	if path.lower().endswith('.npz'):
+		np.savez(path, **dict((name, table[name]) for name in table.dtype.names))
+		return
+	columns = np.column_stack([table[name] for name in table.dtype.names])
+	np.savetxt(path, columns, delimiter=',', header=','.join(table.dtype.names), comments='', fmt='%.9g')
+
+def parse_args():
+	arg_parser = argparse.ArgumentParser(description='decode signals of a PandaLogger log onto one time base')
+	arg_parser.add_argument('-i', '--input', required=True, help='csv or binary log, or directory of segments')
+	arg_parser.add_argument('-s', '--signals', required=True, nargs='+', help='signal names e.g. <veh_speed ford_ws_lf>')
+	arg_parser.add_argument('-d', '--definitions', required=False, nargs='+', default=['tesla_model_s', 'ford_f150'], help='signal definition files (.dbc / .yaml) or names of bundled ones in signals/')
+	arg_parser.add_argument('-f', '--rate', required=False, default=None, type=float, help='uniform grid (Hz), defaults to the union of all sample times')
+	arg_parser.add_argument('-m', '--method', required=False, default='hold', choices=sorted(METHODS), help='zero order hold or linear interpolation')
+	arg_parser.add_argument('-o', '--output', required=True, help='table path, .npz or csv')
+	arg_parser.add_argument('-ts', '--start', required=False, default=None, type=float, help='only frames at or after this utc time')
+	arg_parser.add_argument('-te', '--end', required=False, default=None, type=float, help='only frames at or before this utc time')
+	return arg_parser.parse_args()
+
+def main():
+	args = parse_args()
+	definitions = []
+	for path in args.definitions:
+		definitions += can_decode.load_definitions(path)
+	decoded = decode_series(args.input, args.signals, definitions, start=args.start, end=args.end)
+	table = resample(decoded.values(), rate=args.rate, method=args.method)
+	save_table(args.output, table)
+	print(len(table), 'rows x', len(decoded), 'signals written to', args.output)
+
+if __name__ == "__main__":
+	main()
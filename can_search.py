@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+
+### checksum / rolling counter search
+### for every selected (bus, id) every candidate scheme is tried against all recorded frames of that id and the
+### hypotheses are ranked by the fraction of frames they match. ids are searched in parallel by a process pool
+###   sum / xor  one pass each, every offset at once: the best offset is the most common (checksum - sum) % 256
+###   crc8       all 255 polynomials on a sample of frames as one (poly x frame) table walk, xorout found the same
+###              way as the sum offset, best ones then verified on every frame
+###   counters   every 2..8 bit field in either byte order, ranked by how often it steps by its most common step
+### for one id and one dlc the id / len terms of a sum are constants and end up in the offset found. for a crc the
+### search fits one constant c with crc(poly, init 0, payload) ^ c == checksum over the frames of the id, and reports
+### an init / xorout pair that reproduces c. a real init or a "data id" byte fed ahead of the payload changes the
+### register state before the payload, not the output, so the reported pair matches these frames but need not be
+### the parameters the ecu uses. results are reported in definition file form (see can_checksum.py)
+
+import argparse
+import multiprocessing
+import numpy as np
+import can_checksum
+import can_decode
+import can_filter
+import can_index
+import can_log
+
+DEFAULT_SAMPLE = 8192
+CRC_POLYS = np.arange(1, 256)
+
+def _signed8(value):
+	return value - 256 if value >= 128 else value
+
+def _mode(values, size=256):
+	counts = np.bincount(values, minlength=size)
+	best = int(counts.argmax())
+	return best, int(counts[best])
+
+def _row_counts(values, size=256):
+	# (rows, size) histogram of every row of a (rows, n) array of small ints, one bincount for all rows
+	rows = values.shape[0]
+	return np.bincount((np.arange(rows)[:, None] * size + values).ravel(), minlength=rows * size).reshape(rows, size)
+
+def _row_modes(values, size=256):
+	# most common value of every row and its count
+	counts = _row_counts(values, size)
+	best = counts.argmax(axis=1)
+	return best, counts[np.arange(len(counts)), best]
+
+def checksum_layouts(dlc):
+	# (first, last, target): checksum in the last byte over the others, or in the first byte over the rest
+	if dlc < 2:
+		return []
+	return [(0, dlc - 2, dlc - 1), (1, dlc - 1, 0)]
+
+### checksums ###
+def _crc_tables():
+	crc = np.arange(256, dtype=np.uint16)[None, :].repeat(len(CRC_POLYS), axis=0)
+	polys = CRC_POLYS[:, None].astype(np.uint16)
+	for _ in range(8):
+		crc = np.where(crc & 0x80, (crc << 1) ^ polys, crc << 1) & 0xff
+	return crc.astype(np.uint8)
+
+def _crc_all_polys(block):
+	# (polys, frames) crc8 with init 0 of every row of block under every polynomial
+	tables = _crc_tables().ravel()
+	rows = np.arange(len(CRC_POLYS))[:, None] * 256
+	crc = np.zeros((len(CRC_POLYS), len(block)), dtype=np.intp)
+	for k in range(block.shape[1]):
+		crc = tables.take(rows + (crc ^ block[None, :, k]))
+	return crc
+
+def _crc_form(poly, xorout, length):
+	# the same checksum written with the common init values, preferring a named variant or init == xorout
+	forms = []
+	for init in (0x00, 0xff):
+		# crc with init i == crc with init 0 xor the crc of i over zero bytes
+		shift = can_checksum.crc8(bytes(length), poly, init, 0)
+		forms.append((init, xorout ^ shift))
+	for name, variant in sorted(can_checksum.CRC8_VARIANTS.items()):
+		if (poly,) + forms[0] == variant or (poly,) + forms[1] == variant:
+			return name, variant[1], variant[2]
+	for init, out in forms:
+		if init == out:
+			return 'crc8', init, out
+	return ('crc8',) + forms[0]
+
+def search_checksums(payloads, ident, dlc, sample=DEFAULT_SAMPLE, top=8):
+	# [(rate, Checksum)] best first for frames of one id, all of length dlc
+	n = len(payloads)
+	ids = np.full(n, ident, dtype=np.uint32)
+	dlcs = np.full(n, dlc, dtype=np.uint8)
+	hypotheses = []
+	for first, last, target in checksum_layouts(dlc):
+		block = payloads[:, first:last + 1]
+		want = payloads[:, target]
+
+		total = block.sum(axis=1, dtype=np.int64) + ident + dlc
+		offset, count = _mode(((want.astype(np.int64) - total) % 256).astype(np.intp))
+		hypotheses.append((count / float(n), can_checksum.checksum(ident, 'sum', first, last, target, _signed8(offset))))
+
+		total = np.bitwise_xor.reduce(block, axis=1).astype(np.int64)
+		offset, count = _mode(((want.astype(np.int64) - total) % 256).astype(np.intp))
+		hypotheses.append((count / float(n), can_checksum.checksum(ident, 'xor', first, last, target, _signed8(offset), False, False)))
+
+		# every polynomial on the sample, the best few on all frames
+		picks = np.linspace(0, n - 1, min(n, sample)).astype(np.int64)
+		crc = _crc_all_polys(block[picks])
+		xorouts, counts = _row_modes(crc ^ want[picks][None, :])
+		for k in np.argsort(-counts, kind='stable')[:top].tolist():
+			name, init, xorout = _crc_form(int(CRC_POLYS[k]), int(xorouts[k]), last - first + 1)
+			defn = can_checksum.checksum(ident, name, first, last, target, 0, False, False, None, int(CRC_POLYS[k]), init, xorout)
+			rate = np.count_nonzero(can_checksum.expected(defn, payloads, ids, dlcs) == want) / float(n)
+			hypotheses.append((rate, defn))
+
+	hypotheses.sort(key=lambda h: -h[0])
+	return hypotheses
+
+def checksum_yaml(defn):
+	if defn.algorithm == 'sum':
+		extra = 'offset: %d' % defn.offset
+	elif defn.algorithm == 'xor':
+		extra = 'offset: %d, include_id: false, include_len: false' % defn.offset
+	else:
+		extra = 'poly: 0x%02x, init: 0x%02x, xorout: 0x%02x' % (defn.poly, defn.init, defn.xorout)
+	return '{algorithm: %s, bytes: [%d, %d], target: %d, %s}' % (defn.algorithm, defn.first, defn.last, defn.target, extra)
+
+### counters ###
+def _le_bits(shift, length, little_endian):
+	# the field's bits numbered byte * 8 + bit, whichever order it was read in
+	if little_endian:
+		return frozenset(range(shift, shift + length))
+	return frozenset((7 - p // 8) * 8 + p % 8 for p in range(shift, shift + length))
+
+def _step_rate(words, shift, length, step):
+	mask = np.uint64((1 << length) - 1)
+	values = (words >> np.uint64(shift)) & mask
+	return np.count_nonzero(((values[1:] - values[:-1]) & mask) == step) / float(len(values) - 1)
+
+def search_counters(payloads, dlc, sample=DEFAULT_SAMPLE, min_length=2, max_length=8, min_rate=0.5):
+	# [(rate, start, length, little_endian, step)] best first, one entry per field (bit sub / super ranges of a
+	# better counter are dropped). rate is the fraction of consecutive frames the field moves by step. every field is
+	# tried on the first sample frames, the ones kept are then measured on all frames
+	n = len(payloads)
+	if n < 3:
+		return []
+	payloads = np.ascontiguousarray(payloads).view('>u8').ravel()
+	words = {True: can_decode.payload_words(payloads, True), False: can_decode.payload_words(payloads, False)}
+	head = {True: words[True][:sample], False: words[False][:sample]}
+
+	candidates = []
+	seen = set()
+	for length in range(min_length, max_length + 1):
+		mask = np.uint64((1 << length) - 1)
+		for little_endian in (True, False):
+			fields = [(shift, _le_bits(shift, length, little_endian)) for shift in range(0, 65 - length)]
+			fields = [(shift, bits) for shift, bits in fields if max(bits) < dlc * 8 and bits not in seen]
+			if not fields:
+				continue
+			seen.update(bits for _, bits in fields)
+			shifts = np.array([shift for shift, _ in fields], dtype=np.uint64)
+			values = (head[little_endian][:, None] >> shifts[None, :]) & mask
+			steps = ((values[1:] - values[:-1]) & mask).T.astype(np.intp)
+			# most common non zero step per field
+			counts = _row_counts(steps, 1 << length)
+			counts[:, 0] = 0
+			best = counts.argmax(axis=1)
+			rates = counts[np.arange(len(fields)), best] / float(steps.shape[1])
+			for k in np.flatnonzero(rates >= min_rate).tolist():
+				candidates.append((rates[k], length, fields[k][0], little_endian, int(best[k]), fields[k][1]))
+
+	candidates.sort(key=lambda c: (-round(c[0], 6), -c[1]))
+	counters = []
+	taken = []
+	for rate, length, shift, little_endian, step, bits in candidates:
+		if any(bits <= other or bits >= other for other in taken):
+			continue
+		taken.append(bits)
+		rate = _step_rate(words[little_endian], shift, length, step)
+		counters.append((rate, can_decode.dbc_start(shift, length, little_endian), length, little_endian, step))
+	counters.sort(key=lambda c: -c[0])
+	return counters
+
+def counter_yaml(start, length, little_endian):
+	return '{start: %d, length: %d, byte_order: %s}' % (start, length, 'little_endian' if little_endian else 'big_endian')
+
+### per id search ###
+def search_frames(job):
+	# job = (bus, id, frames of that (bus, id) in log order)
+	bus, ident, frames, sample = job
+	dlc = int(np.bincount(frames['dlc']).argmax())
+	same = frames[frames['dlc'] == dlc]
+	payloads = can_log.payload_bytes(same)
+	return {
+		'bus': bus,
+		'id': ident,
+		'frames': len(frames),
+		'dlc': dlc,
+		'checksums': search_checksums(payloads, ident, dlc, sample),
+		'counters': search_counters(payloads, dlc),
+	}
+
+def search_log(path, spec='*', processes=None, sample=DEFAULT_SAMPLE, min_frames=16):
+	index = can_index.load_index(path)
+	slots = np.flatnonzero(can_filter.IdFilter.from_spec(spec).mask(index.buses, index.ids) & (index.count >= min_frames))
+	jobs = ((bus, ident, frames, sample) for bus, ident, frames in can_index.iter_slot_frames(path, index, slots))
+	if processes == 1:
+		return [search_frames(job) for job in jobs]
+	pool = multiprocessing.Pool(processes)
+	try:
+		return list(pool.imap(search_frames, jobs))
+	finally:
+		pool.close()
+		pool.join()
+
+def print_results(results, top=3):
+	for result in results:
+		print('bus %d id %s  frames: %d  dlc: %d' % (result['bus'], hex(result['id']), result['frames'], result['dlc']))
+		for rate, defn in result['checksums'][:top]:
+			print('  checksum %7.2f%%  %s' % (100 * rate, checksum_yaml(defn)))
+		for rate, start, length, little_endian, step in result['counters'][:top]:
+			print('  counter  %7.2f%%  %s  step: %d' % (100 * rate, counter_yaml(start, length, little_endian), step))
+
+def parse_args():
+	arg_parser = argparse.ArgumentParser(description='search a PandaLogger log for checksum and rolling counter layouts')
+	arg_parser.add_argument('-i', '--input', required=True, help='csv or binary log, or directory of segments')
+	arg_parser.add_argument('-S', '--select', required=False, default='*', help='ids to search e.g. <0x2b9,1:0x2bf> (see can_filter.py)')
+	arg_parser.add_argument('-p', '--processes', required=False, default=None, type=int, help='worker processes, defaults to one per cpu')
+	arg_parser.add_argument('-n', '--sample', required=False, default=DEFAULT_SAMPLE, type=int, help='frames per id every crc8 polynomial is tried on')
+	arg_parser.add_argument('-k', '--top', required=False, default=3, type=int, help='hypotheses shown per id')
+	return arg_parser.parse_args()
+
+def main():
+	args = parse_args()
+	print_results(search_log(args.input, args.select, args.processes, args.sample), args.top)
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+
+### diagnostic sweep of every ecu on the bus: supported mode 0x01 / 0x09 pids and uds (0x22) data identifiers
+### ecus are found with one functional request per mode (see vinQuery.py), supported pids are discovered from the
+### bitmask pids 0x00, 0x20, 0x40 ... (bit 0x80 >> n of byte k set = pid base + 8k + n + 1 supported, the last bit
+### chains to the next bitmask pid) and every supported pid is then asked for physically. each ecu keeps up to
+### --depth requests in flight, answers are matched back by the pid / did they echo, and requests to one ecu are
+### spaced by at least --gap. unanswered requests are given up after --p2 (0x78 response pending extends it)
+### results go to a json file: per ecu the raw answers, negative response codes, timeouts, vin and matching configs
+### --simulate runs against in process simulated ecus, --serve answers as simulated ecus on a real bus (e.g. vcan)
+
+import argparse
+import collections
+import json
+import time
+import yaml
+import can_bus
+import can_isotp
+import vinQuery
+
+CURRENT_DATA = 0x01
+VEHICLE_INFO = 0x09
+READ_DID = 0x22
+NEGATIVE = 0x7F
+PENDING = 0x78
+
+BITMASK_PIDS = range(0x00, 0x100, 0x20)
+DIDS = [0xF180, 0xF186, 0xF187, 0xF188, 0xF189, 0xF18A, 0xF18B, 0xF18C, 0xF190, 0xF191, 0xF192, 0xF193, 0xF194, 0xF195, 0xF197, 0xF19E]
+
+def supported_pids(base, mask):
+	# pids flagged in the 4 byte answer to bitmask pid base, the chaining bit included
+	bits = int.from_bytes(bytes(mask[:4]), 'big')
+	return [base + n + 1 for n in range(32) if bits & (0x80000000 >> n)]
+
+def bitmask(base, pids):
+	bits = 0
+	for pid in pids:
+		if base < pid <= base + 32:
+			bits |= 0x80000000 >> (pid - base - 1)
+	return bits.to_bytes(4, 'big')
+
+def _key(service, payload):
+	# what an answer to service echoes back: the pid, or the did for uds
+	if service == READ_DID:
+		return int.from_bytes(bytes(payload[:2]), 'big')
+	return payload[0]
+
+### scanning ###
+class Ecu():
+	def __init__(self, session):
+		self.session = session
+		self.queue = collections.deque() # (service, key, request payload)
+		self.outstanding = collections.OrderedDict() # (service, key) -> deadline
+		self.next_send = 0.0
+		self.answers = {CURRENT_DATA: {}, VEHICLE_INFO: {}, READ_DID: {}}
+		self.negative = {}
+		self.timeouts = []
+		self.requests = 0
+
+	def ask(self, service, key):
+		if service == READ_DID:
+			payload = bytes([service, key >> 8, key & 0xff])
+		else:
+			payload = bytes([service, key])
+		self.queue.append((service, key, payload))
+
+class Scanner():
+	def __init__(self, stack, depth=4, gap=0.005, p2=0.05, p2_star=5.0, dids=DIDS, bus=0):
+		self.stack = stack
+		self.depth = depth
+		self.gap = gap
+		self.p2 = p2
+		self.p2_star = p2_star
+		self.dids = list(dids)
+		self.bus = bus
+		self.ecus = collections.OrderedDict() # rx id -> Ecu
+
+	def _ecu(self, session):
+		ecu = self.ecus.get(session.rx_id)
+		if ecu is None:
+			ecu = self.ecus[session.rx_id] = Ecu(session)
+			for did in self.dids:
+				ecu.ask(READ_DID, did)
+		return ecu
+
+	def discover(self, timeout=0.2):
+		# functional bitmask requests, whoever answers is an ecu
+		self.stack.accept(vinQuery.obd_request_id)
+		for service in (CURRENT_DATA, VEHICLE_INFO):
+			for address in (vinQuery.FUNCTIONAL_11_BIT, vinQuery.FUNCTIONAL_29_BIT):
+				self.stack.send_functional(address, bytes([service, 0x00]), self.bus)
+		for session, payloads in self.stack.collect(timeout).items():
+			ecu = self._ecu(session)
+			for payload in payloads:
+				self._answer(ecu, payload, time.monotonic())
+		return list(self.ecus)
+
+	def _answer(self, ecu, payload, now):
+		if not payload:
+			return
+		if payload[0] == NEGATIVE and len(payload) >= 3:
+			service, code = payload[1], payload[2]
+			waiting = [k for k in ecu.outstanding if k[0] == service]
+			if not waiting:
+				return
+			if code == PENDING:
+				ecu.outstanding[waiting[0]] = now + self.p2_star
+				return
+			del ecu.outstanding[waiting[0]]
+			ecu.negative['%s %s' % (hex(service), hex(waiting[0][1]))] = hex(code)
+			return
+		service = payload[0] - 0x40
+		if service not in ecu.answers or len(payload) < 2:
+			return
+		key = _key(service, payload[1:])
+		data = bytes(payload[3:] if service == READ_DID else payload[2:])
+		ecu.outstanding.pop((service, key), None)
+		ecu.answers[service][key] = data
+		if service != READ_DID and key in BITMASK_PIDS:
+			for pid in supported_pids(key, data):
+				if pid not in ecu.answers[service] and all(q[:2] != (service, pid) for q in ecu.queue):
+					ecu.ask(service, pid)
+
+	def run(self, timeout=30.0):
+		deadline = time.monotonic() + timeout
+		while True:
+			now = time.monotonic()
+			busy = False
+			for ecu in self.ecus.values():
+				for key, due in list(ecu.outstanding.items()):
+					if now > due:
+						del ecu.outstanding[key]
+						ecu.timeouts.append('%s %s' % (hex(key[0]), hex(key[1])))
+				while ecu.queue and len(ecu.outstanding) < self.depth and now >= ecu.next_send and not ecu.session.sending:
+					service, key, payload = ecu.queue.popleft()
+					self.stack.send(ecu.session, payload)
+					ecu.outstanding[(service, key)] = now + self.p2
+					ecu.next_send = now + self.gap
+					ecu.requests += 1
+				busy |= bool(ecu.queue or ecu.outstanding)
+			if not busy or now > deadline:
+				return
+			self.stack.step()
+			now = time.monotonic()
+			for ecu in self.ecus.values():
+				while ecu.session.messages:
+					self._answer(ecu, ecu.session.messages.popleft(), now)
+
+	def results(self, configs=()):
+		out = collections.OrderedDict()
+		for rx_id, ecu in self.ecus.items():
+			vin = vinQuery.decode_vin(bytes([0x49, 0x02]) + ecu.answers[VEHICLE_INFO][0x02]) if 0x02 in ecu.answers[VEHICLE_INFO] else None
+			out[hex(rx_id)] = collections.OrderedDict([
+				('request_id', hex(ecu.session.tx_id)),
+				('vin', vin),
+				('configs', [path for path, config_vin in configs if vin is not None and vin == config_vin]),
+				('mode_01', dict((hex(pid), data.hex()) for pid, data in sorted(ecu.answers[CURRENT_DATA].items()))),
+				('mode_09', dict((hex(pid), data.hex()) for pid, data in sorted(ecu.answers[VEHICLE_INFO].items()))),
+				('uds', dict((hex(did), data.hex()) for did, data in sorted(ecu.answers[READ_DID].items()))),
+				('negative', ecu.negative),
+				('timeouts', ecu.timeouts),
+				('requests', ecu.requests),
+				('iso_tp_errors', list(ecu.session.errors))])
+		return out
+
+### simulated ecus ###
+class _Inject():
+	# sends of a simulated ecu on a SimBus come back out of the tester's recv()
+	def __init__(self, sim):
+		self.sim = sim
+
+	def send(self, address, data, bus=0):
+		self.sim.inject(address, data, bus)
+
+class SimEcu():
+	# answers obd requests on its request ids with pids {pid: data}, vehicle info {pid: data} and dids {did: data}
+	def __init__(self, bus, response_id, pids=None, info=None, dids=None, vin=None, busnum=0):
+		self.pids = dict(pids or {})
+		self.info = dict(info or {})
+		self.dids = dict(dids or {})
+		if vin is not None:
+			self.info[0x02] = bytes([0x01]) + vin.encode('ascii')
+		self.stack = can_isotp.IsoTpStack(bus)
+		self.pending = collections.deque() # answers waiting for the previous multi frame answer to finish
+		request_id = vinQuery.obd_request_id(busnum, response_id)
+		self.physical = self.stack.open(response_id, request_id, busnum)
+		functional = vinQuery.FUNCTIONAL_11_BIT if response_id <= can_bus.MAX_STD_ID else vinQuery.FUNCTIONAL_29_BIT
+		self.functional = self.stack.open(response_id, functional, busnum)
+
+	def attach(self, sim):
+		# answer a SimBus' sent frames as they are sent
+		self.stack.bus = _Inject(sim)
+		sim.listeners.append(lambda sim, address, data, busnum: self.feed([(address, 0, data, busnum)]))
+		return self
+
+	def _respond(self, payload, functional):
+		service = payload[0]
+		if service in (CURRENT_DATA, VEHICLE_INFO) and len(payload) >= 2:
+			table = self.pids if service == CURRENT_DATA else self.info
+			pid = payload[1]
+			if pid in BITMASK_PIDS and (pid == 0 or any(p > pid for p in table)):
+				return bytes([service + 0x40, pid]) + bitmask(pid, list(table) + [b for b in BITMASK_PIDS if any(p > b for p in table)])
+			if pid in table:
+				return bytes([service + 0x40, pid]) + table[pid]
+			return None if functional else bytes([NEGATIVE, service, 0x12])
+		if service == READ_DID and len(payload) >= 3 and not functional:
+			did = int.from_bytes(bytes(payload[1:3]), 'big')
+			if did in self.dids:
+				return bytes([service + 0x40]) + bytes(payload[1:3]) + self.dids[did]
+			return bytes([NEGATIVE, service, 0x31])
+		return None if functional else bytes([NEGATIVE, service, 0x11])
+
+	def feed(self, frames):
+		self.stack.feed(frames)
+		for session in (self.functional, self.physical):
+			while session.messages:
+				response = self._respond(session.messages.popleft(), session is self.functional)
+				if response is not None:
+					self.pending.append(response)
+		self.stack.poll()
+		# answers to functional requests go out on the physical pair too, where the flow control comes back
+		while self.pending and not self.physical.sending:
+			self.stack.send(self.physical, self.pending.popleft())
+
+def demo_ecus(bus, count=2):
+	# an engine ecu on 11 bit ids and a transmission ecu on 29 bit ids, more ecus are copies of those
+	ecus = []
+	for k in range(count):
+		response_id = 0x7E8 + k if k % 2 == 0 else vinQuery.RESPONSE_29_BIT | (0x10 + k)
+		ecus.append(SimEcu(bus, response_id,
+			pids={0x04: b'\x40', 0x05: b'\x7b', 0x0C: b'\x1a\xf8', 0x0D: b'\x32', 0x11: b'\x33', 0x1F: b'\x01\x2c', 0x2F: b'\x80', 0x46: b'\x41', 0x51: b'\x01'},
+			info={0x04: b'\x01' + b'CALID0000000%04d' % k, 0x0A: b'\x01' + b'ECU%d' % k},
+			dids={0xF187: b'PART%04d' % k, 0xF18C: b'SN%06d' % k, 0xF190: b'1FTFW1ET5DFC10312'},
+			vin='1FTFW1ET5DFC10312' if k == 0 else None, busnum=0))
+	return ecus
+
+def parse_args():
+	arg_parser = argparse.ArgumentParser(description='sweep supported obd-ii pids and uds dids of every ecu into a json file')
+	arg_parser.add_argument('-I', '--interface', required=False, default='socketcan:can0', help='bus spec e.g. <socketcan:can0> <vcan:vcan0> <panda>')
+	arg_parser.add_argument('-o', '--output', required=False, default='obd_scan.json', help='result file (.json)')
+	arg_parser.add_argument('-c', '--configs', required=False, nargs='*', default=[], help='vehicle setup files (.yaml) to fingerprint the vin against')
+	arg_parser.add_argument('-D', '--dids', required=False, nargs='*', default=[hex(did) for did in DIDS], help='uds data identifiers to read from every ecu')
+	arg_parser.add_argument('-d', '--depth', required=False, default=4, type=int, help='requests in flight per ecu')
+	arg_parser.add_argument('-g', '--gap', required=False, default=0.005, type=float, help='minimum seconds between requests to one ecu')
+	arg_parser.add_argument('--p2', required=False, default=0.05, type=float, help='seconds to wait for an answer (0x78 pending extends it to 5 s)')
+	arg_parser.add_argument('-t', '--timeout', required=False, default=30.0, type=float, help='seconds for the whole sweep')
+	arg_parser.add_argument('--simulate', required=False, default=0, type=int, help='scan this many in process simulated ecus instead of a bus')
+	arg_parser.add_argument('--serve', required=False, default=0, type=int, help='answer as this many simulated ecus on the bus instead of scanning')
+	return arg_parser.parse_args()
+
+def main():
+	args = parse_args()
+	configs = []
+	for path in args.configs:
+		with open(path) as f:
+			configs.append((path, yaml.safe_load(f)['id']['vin']))
+
+	if args.simulate:
+		bus = can_bus.SimBus(rate=0, ids=0)
+		for ecu in demo_ecus(bus, args.simulate):
+			ecu.attach(bus)
+	else:
+		bus = can_bus.open_bus(args.interface)
+	try:
+		if args.serve:
+			ecus = demo_ecus(bus, args.serve)
+			print('answering as', ', '.join(hex(ecu.physical.tx_id) for ecu in ecus), 'on', args.interface)
+			while True:
+				frames = bus.recv()
+				for ecu in ecus:
+					ecu.feed(frames)
+
+		start = time.monotonic()
+		scanner = Scanner(can_isotp.IsoTpStack(bus), args.depth, args.gap, args.p2, dids=[int(did, 0) for did in args.dids])
+		found = scanner.discover()
+		print('ecus:', ', '.join(hex(rx_id) for rx_id in found) or 'none')
+		scanner.run(args.timeout)
+		results = scanner.results(configs)
+	except KeyboardInterrupt:
+		print(' ...exiting...')
+		return
+	finally:
+		bus.close()
+
+	with open(args.output, 'w') as f:
+		json.dump(collections.OrderedDict([('interface', 'sim' if args.simulate else args.interface), ('seconds', time.monotonic() - start), ('ecus', results)]), f, indent=2)
+	for rx_id, ecu in results.items():
+		print(rx_id, len(ecu['mode_01']), 'mode 01 pids', len(ecu['mode_09']), 'mode 09 pids', len(ecu['uds']), 'dids', ecu['requests'], 'requests', len(ecu['timeouts']), 'timeouts', 'vin', ecu['vin'], ecu['configs'])
+	print('wrote', args.output)
+
+if __name__ == "__main__":
+	main()
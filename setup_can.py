@@ -1,7 +1,6 @@
 #!/usr/bin/env python3
 
-from pyvit import can
-from pyvit.hw import socketcan
+import can_bus
 import os
 import time
 import argparse
@@ -36,15 +35,15 @@ def can_rx():
   print("if no errors above, can device up at can1")
   print("can baud rate set to 500kbps")
 
-  # associate device with "can0"
-  dev = socketcan.SocketCanDev("can0")
-  dev.start()
+  # can0 and can1 come back as bus 0 and 1
+  dev = can_bus.open_bus("socketcan:can0,can1")
 
   # ready for messages
   print("ready and waiting for data...")
 
   while True:
-    print("new message: ", dev.recv())
+    for address, _, dat, bus in dev.recv():
+      print("new message: ", bus, hex(address), dat.hex())
 
 def main():
   can_rx()